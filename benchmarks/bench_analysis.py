@@ -0,0 +1,70 @@
+"""
+Benchmark the agreement report on a large synthetic results file.
+
+Usage:
+    python benchmarks/bench_analysis.py --rows 300000
+
+Writes a results CSV with the full default layout (two models, three prompt types, request
+and raw columns), then times loading it, computing the report, and both end to end.
+"""
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.checkpoint import build_fieldnames, result_column
+from utils.analysis import LABELS, load_results, evaluate
+
+MODELS = ['gpt4o', 'gemini']
+PROMPT_TYPES = ['zero_shot', 'few_shot', 'chain_of_thought']
+
+def write_results(path, rows, seed=0):
+    rng = random.Random(seed)
+    fieldnames = build_fieldnames(MODELS, PROMPT_TYPES)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(rows):
+            truth = rng.choice(LABELS)
+            row = {'image_name': f"book_{i % 50}_page_{i}.png", 'timestamp': '2024-06-10 15:30:45'}
+            for model in MODELS:
+                for prompt_type in PROMPT_TYPES:
+                    column = result_column(model, prompt_type)
+                    # Annotators agree with a shared truth 70% of the time; 2% of calls failed
+                    label = truth if rng.random() < 0.7 else rng.choice(LABELS)
+                    row[column] = '' if rng.random() < 0.02 else label
+                    row[f"{column}_request"] = '{"prompt": "..."}'
+                    row[f"{column}_raw"] = label
+            writer.writerow(row)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time loading and evaluating a large results file.')
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--repeat', type=int, default=3, help='Report the best of this many loads and evaluations')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'results.csv')
+        start = time.perf_counter()
+        write_results(path, args.rows)
+        print(f"Wrote {args.rows} rows ({os.path.getsize(path) / 1e6:.0f} MB) in {time.perf_counter() - start:.2f}s")
+        loads, evaluations = [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            table = load_results([path])
+            loads.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            report = evaluate(table)
+            evaluations.append(time.perf_counter() - start)
+    totals = [load + evaluation for load, evaluation in zip(loads, evaluations)]
+    print(f"load_results: {min(loads):.3f}s")
+    print(f"evaluate:     {min(evaluations):.3f}s  (Fleiss' kappa {report['fleiss_kappa']:.3f}, "
+          f"{len(report['book_distribution'])} books)")
+    print(f"end to end:   {min(totals):.3f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark the image preprocessing stage: images/sec against worker count.
+
+Usage:
+    python benchmarks/bench_preprocess.py --images-dir images --workers 0 1 2 4 8
+
+Worker count 0 is the in-process baseline (resize and encode on the calling thread).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.image_cache import ImagePayloadCache, set_payload_cache
+from utils.image_utils import list_image_paths
+from utils.encoding import parse_encoding_profile
+from utils.preprocess import prepare_payload, iter_prepared_images
+
+def run_serial(paths, profile):
+    for path in paths:
+        prepare_payload(path, profile)
+
+def run_pool(paths, workers, profile):
+    for _, img in iter_prepared_images(paths, workers=workers, profile=profile):
+        img.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure preprocessing throughput for different worker counts.')
+    parser.add_argument('--images-dir', default='images')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--repeat', type=int, default=1, help='Process the corpus this many times per measurement')
+    parser.add_argument('--encoding', default='png', help="Encoding profile, e.g. 'png' or 'jpeg:quality=80'")
+    parser.add_argument('--json', metavar='FILE', help='Also write the measurements to a JSON file')
+    args = parser.parse_args(argv)
+
+    paths = list_image_paths(args.images_dir) * args.repeat
+    rows = []
+    profile = parse_encoding_profile(args.encoding)
+    print(f"{len(paths)} images, encoding={args.encoding}")
+    print(f"{'workers':>8} {'seconds':>9} {'images/sec':>11} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        # A fresh cache per measurement so every payload is really computed
+        set_payload_cache(ImagePayloadCache())
+        start = time.perf_counter()
+        if workers == 0:
+            run_serial(paths, profile)
+        else:
+            run_pool(paths, workers, profile)
+        elapsed = time.perf_counter() - start
+        rate = len(paths) / elapsed
+        baseline = baseline or rate
+        rows.append({'workers': workers, 'seconds': round(elapsed, 3), 'images_per_sec': round(rate, 3)})
+        print(f"{workers:>8} {elapsed:>9.2f} {rate:>11.2f} {rate / baseline:>7.2f}x")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'images': len(paths), 'encoding': args.encoding, 'results': rows}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
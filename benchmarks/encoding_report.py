@@ -0,0 +1,78 @@
+"""
+Offline report comparing image encoding profiles on a corpus: payload bytes per image,
+encode time per image and the estimated OpenAI image tokens. No API calls are made.
+
+Usage:
+    python benchmarks/encoding_report.py --images-dir images
+    python benchmarks/encoding_report.py --profiles png jpeg webp:quality=70 auto:max_bytes=150000
+
+The first profile is the baseline for the size ratio column.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from PIL import Image
+from utils.image_utils import list_image_paths
+from utils.encoding import PROFILES, parse_encoding_profile, render_for_profile, openai_image_tokens
+
+def measure_profile(images, profile):
+    """
+    Encode every image with a profile.
+
+    Returns:
+        Dict of per-image averages and maxima for the profile
+    """
+    sizes, seconds, tokens = [], [], []
+    for img in images:
+        start = time.perf_counter()
+        payload = render_for_profile(img, profile)
+        seconds.append(time.perf_counter() - start)
+        sizes.append(len(payload))
+        width, height = Image.open(io.BytesIO(payload)).size
+        tokens.append(openai_image_tokens(width, height, profile.detail or 'high'))
+    over_budget = sum(1 for size in sizes if profile.max_bytes and size > profile.max_bytes)
+    return {
+        'mean_bytes': round(statistics.mean(sizes)),
+        'max_bytes': max(sizes),
+        'total_bytes': sum(sizes),
+        'mean_encode_ms': round(1000 * statistics.mean(seconds), 2),
+        'mean_openai_tokens': round(statistics.mean(tokens)),
+        'over_budget': over_budget,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare image encoding profiles offline.')
+    parser.add_argument('--images-dir', default='images')
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES),
+                        help="Profile specs to compare (default: every built-in profile)")
+    parser.add_argument('--json', metavar='FILE', help='Also write the report to a JSON file')
+    args = parser.parse_args(argv)
+
+    images = []
+    for path in list_image_paths(args.images_dir):
+        img = Image.open(path)
+        img.load()
+        images.append(img)
+    print(f"{len(images)} images from '{args.images_dir}'")
+    print(f"{'profile':<28} {'mean KB':>9} {'max KB':>9} {'ratio':>7} {'encode ms':>10} {'tokens':>7} {'over':>5}")
+    report = []
+    baseline = None
+    for spec in args.profiles:
+        row = {'profile': spec, **measure_profile(images, parse_encoding_profile(spec))}
+        baseline = baseline or row['mean_bytes']
+        row['size_ratio'] = round(row['mean_bytes'] / baseline, 3)
+        report.append(row)
+        print(f"{spec:<28} {row['mean_bytes'] / 1024:>9.1f} {row['max_bytes'] / 1024:>9.1f} {row['size_ratio']:>7.3f} "
+              f"{row['mean_encode_ms']:>10.1f} {row['mean_openai_tokens']:>7} {row['over_budget']:>5}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'images': len(images), 'images_dir': args.images_dir, 'profiles': report}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
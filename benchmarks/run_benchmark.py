@@ -0,0 +1,205 @@
+"""
+End-to-end pipeline benchmark against the local fake LLM server, without any paid API calls.
+
+Runs main.py over an image corpus with both providers pointed at utils/fake_llm_server.py. The
+server adds simulated latency, 429s and errors. The script reports images/sec, per-call latency
+percentiles per provider, preprocessing CPU time and peak RSS, and saves the results as JSON under
+benchmarks/results/, named by timestamp and git revision, so runs can be compared across commits.
+
+Usage:
+    python benchmarks/run_benchmark.py --latency-ms 400 --throttle-rate 0.02
+    python benchmarks/run_benchmark.py --latency-ms 400 -- --encoding jpeg --concurrency 8
+    python benchmarks/run_benchmark.py --latency-ms 200 --outlier-rate 0.05 --outlier-ms 5000 -- --hedge-percentile 95
+    python benchmarks/run_benchmark.py --compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+
+Arguments after '--' are passed to main.py unchanged.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+from utils.fake_llm_server import start_fake_server, add_fault_arguments, fault_options
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+def git_revision():
+    """
+    Short commit hash of the working tree, with '+dirty' if it has uncommitted changes; None outside git.
+    """
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{revision}+dirty" if dirty else revision
+
+def prepare_few_shot_dir(images_dir, few_shot_dir, workdir):
+    """
+    Use the real few-shot examples if present, else stand-ins copied from the first three corpus images.
+    """
+    if os.path.isdir(few_shot_dir) and any(name.lower().startswith('sadness') for name in os.listdir(few_shot_dir)):
+        return few_shot_dir
+    from utils.image_utils import list_image_paths
+    stand_in_dir = os.path.join(workdir, 'few_shot_examples')
+    os.makedirs(stand_in_dir)
+    for base, path in zip(('sadness', 'surprise', 'disgust'), list_image_paths(images_dir)):
+        shutil.copy(path, os.path.join(stand_in_dir, base + os.path.splitext(path)[1]))
+    return stand_in_dir
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(who).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def cpu_seconds(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+def count_results(csv_path):
+    """
+    Return (rows, empty label cells) of a results CSV.
+    """
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    label_columns = [c for c in (rows[0] if rows else {}) if c not in ('image_name', 'timestamp')
+                     and not c.endswith(('_request', '_reasoning', '_raw'))]
+    return len(rows), sum(1 for row in rows for column in label_columns if not row[column])
+
+def run_benchmark(args, main_args):
+    """
+    Run the pipeline once against a fresh fake server and return the measurements.
+    """
+    server, base_url = start_fake_server(**fault_options(args))
+    # Before importing main: the provider clients read these once, and .env must not override them
+    os.environ.update({
+        'OPENAI_BASE_URL': base_url,
+        'GEMINI_BASE_URL': base_url[:-len('/v1')],
+        'OPENAI_API_KEY': 'fake-key',
+        'GOOGLE_API_KEY': 'fake-key',
+        'IMAGE_CACHE_DIR': '',
+    })
+    import main
+    from utils.image_cache import get_payload_cache
+    from utils.providers import PROVIDERS
+    from utils.hedging import get_hedge_policy
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        output = os.path.join(workdir, 'results.csv')
+        few_shot_dir = prepare_few_shot_dir(args.images_dir, os.path.join(ROOT, 'few_shot_examples'), workdir)
+        cpu_before = cpu_seconds(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        main.main(['--temperature', '0', '--images-dir', args.images_dir, '--few-shot-dir', few_shot_dir,
+                   '--output', output, '--no-response-cache', '--quiet', *main_args])
+        elapsed = time.perf_counter() - start
+        images, failed_cells = count_results(output)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'images': images,
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(images / elapsed, 3) if elapsed else None,
+        'failed_cells': failed_cells,
+        'latency': {name: provider.latency.summary() for name, provider in PROVIDERS.items()
+                    if provider.latency.calls},
+        'server_calls': dict(server.state.calls),
+        'hedging': {name: get_hedge_policy(name).stats() for name, provider in PROVIDERS.items()
+                    if provider.latency.calls and get_hedge_policy(name).enabled},
+        # In-process resize/encode plus any --preprocess-workers processes
+        'preprocess_cpu_seconds': round(get_payload_cache().stats()['build_cpu_seconds']
+                                        + cpu_seconds(resource.RUSAGE_CHILDREN), 3),
+        'process_cpu_seconds': round(cpu_seconds(resource.RUSAGE_SELF) - cpu_before, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_child_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+def print_report(metrics):
+    print(f"images:            {metrics['images']} in {metrics['seconds']:.2f}s "
+          f"({metrics['images_per_sec']:.2f} images/sec, {metrics['failed_cells']} failed cells)")
+    print(f"preprocess CPU:    {metrics['preprocess_cpu_seconds']:.2f}s "
+          f"(process total {metrics['process_cpu_seconds']:.2f}s)")
+    print(f"peak RSS:          {metrics['peak_rss_mb']} MB (workers {metrics['peak_child_rss_mb']} MB)")
+    print(f"server calls:      {metrics['server_calls']}")
+    for name, stats in metrics['hedging'].items():
+        print(f"hedging ({name}):{' ' * max(1, 8 - len(name))}{stats}")
+    print(f"{'provider':<10} {'calls':>6} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, stats in metrics['latency'].items():
+        print(f"{name:<10} {stats['calls']:>6} {stats['errors']:>7} " +
+              ' '.join(f"{1000 * stats[key]:>8.0f}" for key in ('p50', 'p95', 'p99', 'max')))
+
+def flatten(metrics, prefix=''):
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(old_path, new_path):
+    """
+    Print the numeric metrics of two saved results side by side with the relative change.
+    """
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{'metric':<32} {old.get('revision') or 'old':>14} {new.get('revision') or 'new':>14} {'change':>8}")
+    old_metrics, new_metrics = flatten(old['metrics']), flatten(new['metrics'])
+    for key in old_metrics:
+        if key not in new_metrics:
+            continue
+        before, after = old_metrics[key], new_metrics[key]
+        change = f"{100 * (after - before) / before:+.1f}%" if before else ''
+        print(f"{key:<32} {before:>14g} {after:>14g} {change:>8}")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    main_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, main_args = argv[:split], argv[split + 1:]
+    parser = argparse.ArgumentParser(description='Benchmark the full pipeline against a local fake LLM server.')
+    parser.add_argument('--images-dir', default=os.path.join(ROOT, 'images'))
+    parser.add_argument('--label', help='Free-form note stored with the results')
+    parser.add_argument('--output', metavar='FILE', help='Results JSON path (default: benchmarks/results/<timestamp>_<revision>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two saved results and exit')
+    add_fault_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    metrics = run_benchmark(args, main_args)
+    print_report(metrics)
+    revision = git_revision()
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output = args.output or os.path.join(RESULTS_DIR, f"{timestamp}_{(revision or 'norev').replace('+', '_')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'revision': revision,
+            'timestamp': timestamp,
+            'label': args.label,
+            'config': {'images_dir': args.images_dir, 'server': fault_options(args), 'main_args': main_args},
+            'cpus': os.cpu_count(),
+            'metrics': metrics,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"Saved {output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
 import os
 import logging
-import csv
+import sys
+import json
+import socket
+import argparse
+from functools import partial
+import openai
 from datetime import datetime
-from utils.image_utils import load_images
+from utils.image_utils import list_image_paths, iter_images
+from utils.encoding import parse_encoding_profile, set_encoding_profile, encode_image_payload
+from utils.preprocess import iter_prepared_images
 from utils.prompt_utils import (
     get_zero_shot_prompt,
     get_few_shot_prompt,
@@ -10,10 +17,25 @@ from utils.prompt_utils import (
     EMOTION_LABELS_EN_AR,
     normalize_emotion
 )
-from utils.model_utils import (
-    query_gpt4o,
-    query_gemini
-)
+from utils.model_utils import OPENAI_API_KEY, BATCH_PROMPT_TYPES, MAX_IMAGES_PER_REQUEST
+from utils.providers import PROVIDERS, DEFAULT_MODELS, get_provider
+from utils.batch_api import build_batch_lines, write_batch_files, submit_batch, wait_for_batch, download_batch_output, parse_batch_output
+from utils.engine import run_annotation_jobs
+from utils.rate_limit import configure_rate_limiter, get_rate_limiter
+from utils.hedging import configure_hedging, get_hedge_policy
+from utils.circuit_breaker import configure_circuit_breaker, get_circuit_breaker
+from utils.clients import configure_clients, close_clients, DEFAULT_TIMEOUT
+from utils.image_cache import ImagePayloadCache, get_payload_cache, set_payload_cache
+from utils.response_cache import ResponseCache
+from utils.results_store import ResultsStore
+from utils.sharding import parse_shard, select_shard, WorkQueue, default_worker_id
+from utils.manifest import Manifest
+from utils.dedup import HASH_FUNCTIONS, NearDuplicateFilter, append_duplicates
+from utils.cascade import CascadePolicy, parse_cascade_stage
+from utils.checkpoint import (RunWriter, run_paths, latest_run, load_completed_cells, load_failed_images,
+                              load_written_images, drop_rows, build_fieldnames, result_column)
+from utils.replay import replay_results
+from utils.metrics import Metrics, get_metrics, set_metrics, start_metrics_server
 import time
 from tqdm import tqdm
 from rich import print as rprint
@@ -26,13 +48,12 @@ from bidi.algorithm import get_display
 
 console = Console()
 
-def load_named_few_shot_examples():
+def load_named_few_shot_examples(few_shot_dir='few_shot_examples'):
     """
     Load the three required few-shot example images by base name (sadness, surprise, disgust) regardless of extension.
     Returns a list of (path, PIL.Image) tuples in the order: sadness, surprise, disgust.
     """
     from PIL import Image
-    few_shot_dir = 'few_shot_examples'
     required_basenames = [
         ('sadness', 'حزن'),
         ('surprise', 'مفاجأة'),
@@ -51,6 +72,7 @@ def load_named_few_shot_examples():
             raise FileNotFoundError(f"Few-shot example image for '{label}' not found: {base}.[image extension] in {few_shot_dir}")
         path = os.path.join(few_shot_dir, found)
         img = Image.open(path)
+        img.load()  # Decode up front: the examples are shared by all worker threads
         loaded.append((path, img))
     return loaded
 
@@ -98,156 +120,576 @@ def print_tqdm_rich(text):
         console.print(text)
     tqdm.write(capture.get())
 
-def main():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    
-    # Get temperature setting from user
-    temperature = get_temperature_from_user()
-    rprint(f":thermometer: [bold cyan]Using temperature:[/bold cyan] [yellow]{temperature}[/yellow]")
-    
-    images = load_images('images')
-    total_images = len(images)
-    rprint(f":framed_picture: [bold green]Found {total_images} images in the 'images' folder.[/bold green]")
-    
-    few_shot_examples = load_named_few_shot_examples()
-    results = []
-    start_time = time.time()
-    
-    for idx, (img_path, img) in enumerate(tqdm(images, desc='Processing Images', unit='img'), 1):
-        img_filename = os.path.basename(img_path)
-        print_tqdm_rich(f"\n[bold blue]Processing image {idx}/{total_images}: {img_filename}[/bold blue]")
-        logging.info(f"Processing image {idx}/{total_images}: {img_path}")
-        
-        row = {
-            'image_name': img_filename,
-            'gpt4o_zero_shot': None,
-            'gpt4o_few_shot': None,
-            'gpt4o_cot': None,
-            'gpt4o_cot_reasoning': None,
-            'gemini_zero_shot': None,
-            'gemini_few_shot': None,
-            'gemini_cot': None,
-            'gemini_cot_reasoning': None,
-            'gpt4o_zero_shot_request': None,
-            'gpt4o_few_shot_request': None,
-            'gpt4o_cot_request': None,
-            'gemini_zero_shot_request': None,
-            'gemini_few_shot_request': None,
-            'gemini_cot_request': None,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        # GPT-4o
-        result = query_gpt4o(img, None, 'zero_shot', temperature=temperature)
-        normalized_label = normalize_emotion(result['label'])
-        arabic_label = reshape_arabic(normalized_label)
-        row['gpt4o_zero_shot'] = normalized_label
-        row['gpt4o_zero_shot_request'] = result.get('request_json')
-        rprint(Panel(f"[bold]Image {idx}/{total_images}: [cyan]{img_filename}[/cyan]\nModel: [magenta]gpt-4o[/magenta]\nPrompt type: [yellow]zero_shot[/yellow]\nLabel: [green]{arabic_label}[/green]", title=":robot: GPT-4o Zero-Shot", style="bold blue"))
-        if normalized_label != result['label']:
-            arabic_normalized_label = reshape_arabic(normalized_label)
-            rprint(f"[yellow]Normalized to:[/yellow] [green]{arabic_normalized_label}[/green]")
-        rprint('-' * 40)
-        
-        result = query_gpt4o(img, None, 'few_shot', temperature=temperature, few_shot_examples=few_shot_examples)
-        normalized_label = normalize_emotion(result['label'])
-        arabic_label = reshape_arabic(normalized_label)
-        row['gpt4o_few_shot'] = normalized_label
-        row['gpt4o_few_shot_request'] = result.get('request_json')
-        rprint(Panel(f"[bold]Image {idx}/{total_images}: [cyan]{img_filename}[/cyan]\nModel: [magenta]gpt-4o[/magenta]\nPrompt type: [yellow]few_shot[/yellow]\nLabel: [green]{arabic_label}[/green]", title=":robot: GPT-4o Few-Shot", style="bold magenta"))
-        if normalized_label != result['label']:
-            arabic_normalized_label = reshape_arabic(normalized_label)
-            rprint(f"[yellow]Normalized to:[/yellow] [green]{arabic_normalized_label}[/green]")
-        rprint('-' * 40)
-        
-        result = query_gpt4o(img, None, 'chain_of_thought', temperature=temperature)
-        normalized_label = normalize_emotion(result['label'])
-        arabic_label = reshape_arabic(normalized_label)
-        row['gpt4o_cot'] = normalized_label
-        row['gpt4o_cot_reasoning'] = result.get('reasoning')
-        row['gpt4o_cot_request'] = result.get('request_json')
-        rprint(Panel(f"[bold]Image {idx}/{total_images}: [cyan]{img_filename}[/cyan]\nModel: [magenta]gpt-4o[/magenta]\nPrompt type: [yellow]chain_of_thought[/yellow]\nLabel: [green]{arabic_label}[/green]", title=":robot: GPT-4o CoT", style="bold green"))
-        if normalized_label != result['label']:
-            arabic_normalized_label = reshape_arabic(normalized_label)
-            rprint(f"[yellow]Normalized to:[/yellow] [green]{arabic_normalized_label}[/green]")
-        if result.get('reasoning'):
-            arabic_reasoning = reshape_arabic(result['reasoning'])
-            rprint(f"[bold blue]Reasoning:[/bold blue] {arabic_reasoning}")
-        rprint('-' * 40)
-        
-        # Gemini
-        result = query_gemini(img, None, 'zero_shot', temperature=temperature)
-        normalized_label = normalize_emotion(result['label'])
-        arabic_label = reshape_arabic(normalized_label)
-        row['gemini_zero_shot'] = normalized_label
-        row['gemini_zero_shot_request'] = result.get('request_json')
-        rprint(Panel(f"[bold]Image {idx}/{total_images}: [cyan]{img_filename}[/cyan]\nModel: [magenta]gemini-1.5-pro[/magenta]\nPrompt type: [yellow]zero_shot[/yellow]\nLabel: [green]{arabic_label}[/green]", title=":crystal_ball: Gemini Zero-Shot", style="bold blue"))
-        if normalized_label != result['label']:
-            arabic_normalized_label = reshape_arabic(normalized_label)
-            rprint(f"[yellow]Normalized to:[/yellow] [green]{arabic_normalized_label}[/green]")
-        rprint('-' * 40)
-        
-        result = query_gemini(img, None, 'few_shot', temperature=temperature, few_shot_examples=few_shot_examples)
-        normalized_label = normalize_emotion(result['label'])
-        arabic_label = reshape_arabic(normalized_label)
-        row['gemini_few_shot'] = normalized_label
-        row['gemini_few_shot_request'] = result.get('request_json')
-        rprint(Panel(f"[bold]Image {idx}/{total_images}: [cyan]{img_filename}[/cyan]\nModel: [magenta]gemini-1.5-pro[/magenta]\nPrompt type: [yellow]few_shot[/yellow]\nLabel: [green]{arabic_label}[/green]", title=":crystal_ball: Gemini Few-Shot", style="bold magenta"))
-        if normalized_label != result['label']:
-            arabic_normalized_label = reshape_arabic(normalized_label)
-            rprint(f"[yellow]Normalized to:[/yellow] [green]{arabic_normalized_label}[/green]")
-        rprint('-' * 40)
-        
-        result = query_gemini(img, None, 'chain_of_thought', temperature=temperature)
-        normalized_label = normalize_emotion(result['label'])
-        arabic_label = reshape_arabic(normalized_label)
-        row['gemini_cot'] = normalized_label
-        row['gemini_cot_reasoning'] = result.get('reasoning')
-        row['gemini_cot_request'] = result.get('request_json')
-        rprint(Panel(f"[bold]Image {idx}/{total_images}: [cyan]{img_filename}[/cyan]\nModel: [magenta]gemini-1.5-pro[/magenta]\nPrompt type: [yellow]chain_of_thought[/yellow]\nLabel: [green]{arabic_label}[/green]", title=":crystal_ball: Gemini CoT", style="bold green"))
-        if normalized_label != result['label']:
-            arabic_normalized_label = reshape_arabic(normalized_label)
-            rprint(f"[yellow]Normalized to:[/yellow] [green]{arabic_normalized_label}[/green]")
-        if result.get('reasoning'):
-            arabic_reasoning = reshape_arabic(result['reasoning'])
-            rprint(f"[bold blue]Reasoning:[/bold blue] {arabic_reasoning}")
-        rprint('-' * 40)
-        
-        results.append(row)
-
-        # Elapsed and remaining time reporting
-        elapsed = time.time() - start_time
-        avg_time = elapsed / idx
-        remaining = avg_time * (total_images - idx)
-        elapsed_str = time.strftime('%H:%M:%S', time.gmtime(elapsed))
-        remaining_str = time.strftime('%H:%M:%S', time.gmtime(remaining))
-        print_tqdm_rich(f"[bold green]Elapsed time:[/bold green] {elapsed_str} | [bold yellow]Estimated remaining:[/bold yellow] {remaining_str}")
-    # Save results to CSV
-    os.makedirs('results', exist_ok=True)
-    csv_filename = f"results/results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = [
-            'image_name',
-            'gpt4o_zero_shot',
-            'gpt4o_few_shot',
-            'gpt4o_cot',
-            'gpt4o_cot_reasoning',
-            'gemini_zero_shot',
-            'gemini_few_shot',
-            'gemini_cot',
-            'gemini_cot_reasoning',
-            'gpt4o_zero_shot_request',
-            'gpt4o_few_shot_request',
-            'gpt4o_cot_request',
-            'gemini_zero_shot_request',
-            'gemini_few_shot_request',
-            'gemini_cot_request',
-            'timestamp'
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in results:
-            writer.writerow(row)
+# CSV column suffix, panel title suffix and panel style for each prompt type
+PROMPT_TYPE_DISPLAY = {
+    'zero_shot': ('zero_shot', 'Zero-Shot', 'bold blue'),
+    'few_shot': ('few_shot', 'Few-Shot', 'bold magenta'),
+    'chain_of_thought': ('cot', 'CoT', 'bold green'),
+}
+
+def print_result_panel(image_index, total_images, img_filename, model, prompt_type, result, normalized_label):
+    """
+    Print the rich panel summarizing a single model answer.
+    """
+    provider = get_provider(model)
+    model_name, model_title = provider.model_name, provider.title
+    _, type_title, style = PROMPT_TYPE_DISPLAY[prompt_type]
+    arabic_label = reshape_arabic(normalized_label) if normalized_label else normalized_label
+    rprint(Panel(f"[bold]Image {image_index}/{total_images}: [cyan]{img_filename}[/cyan]\nModel: [magenta]{model_name}[/magenta]\nPrompt type: [yellow]{prompt_type}[/yellow]\nLabel: [green]{arabic_label}[/green]", title=f"{model_title} {type_title}", style=style))
+    if normalized_label != result['label']:
+        rprint(f"[yellow]Normalized to:[/yellow] [green]{arabic_label}[/green]")
+    if result.get('reasoning'):
+        arabic_reasoning = reshape_arabic(result['reasoning'])
+        rprint(f"[bold blue]Reasoning:[/bold blue] {arabic_reasoning}")
+    rprint('-' * 40)
+
+def image_name(path, images_dir):
+    """
+    The name an image is recorded under: its path relative to the images folder
+    (just the file name unless sub-folders are scanned).
+    """
+    return os.path.relpath(path, images_dir)
+
+def warm_payload_cache(img):
+    """
+    Encode an image into the payload cache on the prefetch thread, ahead of its API calls.
+    """
+    encode_image_payload(img)
+    return img
+
+def open_image_stream(args, image_paths):
+    """
+    Stream (path, image) pairs to the request stage, with payloads prepared ahead of time
+    on a process pool or a prefetch thread.
+    """
+    if args.preprocess_workers > 0:
+        return iter_prepared_images(image_paths, workers=args.preprocess_workers,
+                                    queue_size=max(2 * args.preprocess_workers, args.prefetch))
+    return iter_images(image_paths, prefetch=args.prefetch, preprocess=warm_payload_cache)
+
+def fill_row(row, model, prompt_type, result):
+    """
+    Store a query result in the per-image CSV row.
+    """
+    column = result_column(model, prompt_type)
+    with get_metrics().stage('normalize', model=model):
+        row[column] = normalize_emotion(result['label'])
+    row[f"{column}_request"] = result.get('request_json')
+    row[f"{column}_raw"] = result.get('raw_answer')
+    if prompt_type == 'chain_of_thought':
+        row[f"{column}_reasoning"] = result.get('reasoning')
+
+def parse_model_limits(values, models=DEFAULT_MODELS):
+    """
+    Parse per-model limit flags (--concurrency, --rpm, --tpm): a bare number applies
+    to every model in `models`, 'model=N' to one model.
+    """
+    limits = {}
+    for value in values or []:
+        if '=' in value:
+            model, limit = value.split('=', 1)
+            limits[model.strip()] = int(limit)
+        else:
+            for model in models:
+                limits[model] = int(value)
+    return limits
+
+def parse_args(argv=None):
+    """
+    Parse command-line options. Values from --config (a JSON object keyed by option
+    name, e.g. {"temperature": 0.0, "models": ["gpt4o"]}) are defaults that explicit
+    command-line flags override.
+    """
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument('--config', metavar='FILE', help='JSON file with default values for any option below')
+    config_args, remaining_argv = config_parser.parse_known_args(argv)
+
+    parser = argparse.ArgumentParser(description='Annotate emotions in images with GPT-4o and Gemini.',
+                                     parents=[config_parser])
+    parser.add_argument('--temperature', type=float,
+                        help='Model temperature between 0.0 and 1.0 (prompted for interactively if omitted on a terminal, else 0.0)')
+    parser.add_argument('--images-dir', default='images', help="Folder of images to annotate (default: 'images')")
+    parser.add_argument('--recursive', action='store_true', help='Also annotate images in sub-folders of --images-dir')
+    parser.add_argument('--prefetch', type=int, default=2, help='Images to load and encode ahead of the API calls (default: 2)')
+    parser.add_argument('--preprocess-workers', type=int, default=0,
+                        help='Resize and encode images in this many worker processes (default: 0, a single prefetch thread)')
+    parser.add_argument('--encoding', type=parse_encoding_profile, default='png', metavar='PROFILE[:KEY=VALUE,...]',
+                        help="Image wire format: png (default), jpeg, webp, low or auto, with optional overrides "
+                             "such as 'jpeg:quality=80,max_size=768,detail=low' or 'auto:max_bytes=150000'")
+    parser.add_argument('--dedup-threshold', type=int, metavar='BITS',
+                        help='Annotate only one image of each group of near-duplicates (perceptual hashes within BITS '
+                             'of 64 bits, e.g. 4); the others reuse its labels (default: off)')
+    parser.add_argument('--dedup-hash', choices=list(HASH_FUNCTIONS), default='dhash',
+                        help='Perceptual hash used by --dedup-threshold (default: dhash)')
+    parser.add_argument('--few-shot-dir', default='few_shot_examples', help="Folder of few-shot example images (default: 'few_shot_examples')")
+    parser.add_argument('--models', nargs='+', choices=list(PROVIDERS), default=list(DEFAULT_MODELS),
+                        help=f"Models to query (default: {' '.join(DEFAULT_MODELS)}; 'stub' answers locally without any API)")
+    parser.add_argument('--prompt-types', nargs='+', choices=list(PROMPT_TYPE_DISPLAY), default=list(PROMPT_TYPE_DISPLAY),
+                        help='Prompt types to run (default: all)')
+    parser.add_argument('--cascade', nargs='*', type=parse_cascade_stage, metavar='STAGE',
+                        help="Run each image's calls in stages, cheapest first, and stop once the answers agree. "
+                             "Without STAGEs: zero_shot, then few_shot, then chain_of_thought, each for every model. "
+                             "A STAGE lists cells such as 'zero_shot' or 'gpt4o/few_shot,gemini/zero_shot'")
+    parser.add_argument('--cascade-margin', type=int, default=2, metavar='VOTES',
+                        help='With --cascade: votes the leading clean label needs over the runner-up to stop (default: 2)')
+    parser.add_argument('--images-per-request', type=int, default=1, metavar='K',
+                        help='Label up to K images per zero-shot and few-shot request, sending the instructions and '
+                             f'few-shot examples once (default: 1, at most {MAX_IMAGES_PER_REQUEST})')
+    parser.add_argument('--concurrency', action='append', metavar='[MODEL=]N',
+                        help="Maximum concurrent calls per provider; repeat as 'gpt4o=8' for per-model limits")
+    parser.add_argument('--rpm', action='append', metavar='[MODEL=]N',
+                        help="Requests-per-minute limit per provider; repeat as 'gemini=60' for per-model limits")
+    parser.add_argument('--tpm', action='append', metavar='[MODEL=]N',
+                        help="Estimated tokens-per-minute limit per provider; repeat as 'gpt4o=30000' for per-model limits")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f'Seconds a single model call may take before it is retried (default: {DEFAULT_TIMEOUT:g})')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='Abandon a model call (and any hedge) after this many seconds and retry it (default: no deadline)')
+    parser.add_argument('--hedge-percentile', type=float, metavar='P',
+                        help="Send a duplicate request when a call runs past this percentile of the provider's "
+                             "observed latency, e.g. 95; the first answer wins (default: off)")
+    parser.add_argument('--hedge-budget', type=float, default=0.05, metavar='FRACTION',
+                        help='Maximum hedged requests as a fraction of all calls (default: 0.05)')
+    parser.add_argument('--breaker-threshold', type=int, default=5, metavar='N',
+                        help="Consecutive failures after which a provider's circuit opens and its jobs are deferred "
+                             "(default: 5; 0 disables)")
+    parser.add_argument('--breaker-cooldown', type=float, default=30.0, metavar='SECONDS',
+                        help='Seconds an open circuit waits before probing the provider again (default: 30)')
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help="Only annotate shard I (0-based) of N, chosen by a hash of the image name, e.g. 0/4; "
+                             "combine the shard outputs with 'python -m utils.sharding merge'")
+    parser.add_argument('--work-queue', metavar='FILE',
+                        help='Claim images one at a time from a SQLite work queue shared with other workers '
+                             '(e.g. on a shared filesystem) instead of processing a fixed list')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='Skip images whose content is recorded in this manifest of annotated images, and '
+                             'record each newly annotated one')
+    parser.add_argument('--watch', type=float, nargs='?', const=60.0, metavar='SECONDS',
+                        help='Keep running: every SECONDS (default: 60), annotate images added to or changed in '
+                             '--images-dir and append them to --output (default: results/results_watch.csv)')
+    parser.add_argument('--watch-cycles', type=int, metavar='N', help='With --watch: stop after N scans')
+    parser.add_argument('--output', metavar='CSV', help='Results CSV path (default: results/results_<timestamp>.csv)')
+    parser.add_argument('--resume', metavar='RUN',
+                        help="Resume an interrupted run: its timestamp (e.g. 20240610_153045), its results CSV path, or 'latest'")
+    parser.add_argument('--cache-dir', help='Directory for the on-disk image payload and response caches')
+    parser.add_argument('--no-response-cache', action='store_true', help='Always call the APIs, never reuse stored answers')
+    parser.add_argument('--openai-batch', action='store_true',
+                        help='Run the GPT-4o jobs through the OpenAI Batch API (half price, results within 24h) instead of live calls')
+    parser.add_argument('--batch-id', nargs='+',
+                        help='With --openai-batch: collect already submitted batches instead of submitting new ones')
+    parser.add_argument('--batch-poll-interval', type=float, default=60.0, help='Seconds between batch status checks (default: 60)')
+    parser.add_argument('--results-db', metavar='FILE',
+                        help='Also store every finished image in this indexed SQLite results store, with request '
+                             'templates deduplicated (query or export it with python -m utils.results_store)')
+    parser.add_argument('--replay', metavar='RUN',
+                        help="Re-parse and re-normalize a finished run from its raw answers, without any API call: its "
+                             "timestamp, results CSV path, or 'latest'. Writes --output (default: <run>.replay.csv)")
+    parser.add_argument('--quiet', action='store_true',
+                        help='Skip per-call panels and Arabic rendering; only warnings, errors and the progress bar are shown')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Append a JSONL record of every stage span and model call (tokens, bytes, attempts) to FILE')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='Serve live stage timings and call counters for Prometheus at http://127.0.0.1:PORT/metrics')
+
+    if config_args.config:
+        with open(config_args.config, encoding='utf-8') as f:
+            config = json.load(f)
+        known = {action.dest for action in parser._actions}
+        unknown = set(config) - known
+        if unknown:
+            parser.error(f"Unknown option(s) in {config_args.config}: {', '.join(sorted(unknown))}")
+        parser.set_defaults(**config)
+    args = parser.parse_args(remaining_argv)
+    # Config files may give limits as a number or a {model: N} object
+    for name in ('concurrency', 'rpm', 'tpm'):
+        value = getattr(args, name)
+        if isinstance(value, (int, str)):
+            setattr(args, name, [str(value)])
+        elif isinstance(value, dict):
+            setattr(args, name, [f"{model}={limit}" for model, limit in value.items()])
+    if isinstance(args.batch_id, str):
+        args.batch_id = [args.batch_id]
+    # Config files give cascade stages as strings
+    if args.cascade is not None:
+        args.cascade = [parse_cascade_stage(stage) if isinstance(stage, str) else stage for stage in args.cascade]
+    if args.temperature is not None and not 0.0 <= args.temperature <= 1.0:
+        parser.error('--temperature must be between 0.0 and 1.0')
+    if args.hedge_percentile is not None and not 0.0 < args.hedge_percentile < 100.0:
+        parser.error('--hedge-percentile must be between 0 and 100')
+    if args.work_queue and args.openai_batch:
+        parser.error('--work-queue cannot be combined with --openai-batch')
+    if not 1 <= args.images_per_request <= MAX_IMAGES_PER_REQUEST:
+        parser.error(f'--images-per-request must be between 1 and {MAX_IMAGES_PER_REQUEST}')
+    if args.images_per_request > 1 and args.openai_batch:
+        parser.error('--images-per-request cannot be combined with --openai-batch')
+    if args.dedup_threshold is not None and not 0 <= args.dedup_threshold < 64:
+        parser.error('--dedup-threshold must be between 0 and 63')
+    if args.watch is not None and (args.work_queue or args.openai_batch):
+        parser.error('--watch cannot be combined with --work-queue or --openai-batch')
+    return args
+
+def list_pending_images(args, written_images=(), manifest=None):
+    """
+    The images of --images-dir still to annotate: not yet fully written to a resumed run, in this
+    process's --shard, and new or changed since the --manifest recorded them.
+    """
+    image_paths = [path for path in list_image_paths(args.images_dir, recursive=args.recursive)
+                   if image_name(path, args.images_dir) not in written_images]
+    if args.shard:
+        image_paths = select_shard(image_paths, args.shard, key=lambda path: image_name(path, args.images_dir))
+    if manifest is not None:
+        image_paths = [path for path, _ in manifest.changes((path, image_name(path, args.images_dir))
+                                                            for path in image_paths)]
+    return image_paths
+
+def store_image(results_store, csv_filename, row, image_results):
+    """
+    Add a finished image to the results store under the run named after its CSV, with the
+    labels already normalized into `row`.
+    """
+    run = os.path.splitext(os.path.basename(csv_filename))[0]
+    cells = {(model, prompt_type): (row[result_column(model, prompt_type)], result)
+             for (model, prompt_type), result in image_results.items()}
+    results_store.add_image(run, row['image_name'], cells, row['timestamp'])
+
+def run_openai_batch(args, image_paths, temperature, few_shot_examples, csv_filename, cells_filename,
+                     results_store=None, manifest=None, completed=None):
+    """
+    Annotate the GPT-4o columns through the OpenAI Batch API: submit (or attach to) one batch per
+    input file (the job matrix is split at the API's per-file limits), poll them to completion and
+    merge their answers into the results CSV. Requests the batches report as failed are recorded
+    as failed cells, so a resumed run submits them again; cells in `completed` are not resubmitted.
+    """
+    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    run_prefix = csv_filename[:-len('.csv')]
+    completed = completed or {}
+    if args.batch_id:
+        batch_ids = args.batch_id
+    else:
+        lines = build_batch_lines(open_image_stream(args, image_paths), args.prompt_types,
+                                  temperature=temperature, few_shot_examples=few_shot_examples,
+                                  image_root=args.images_dir, completed=completed)
+        batches = []
+        for input_path, count in write_batch_files(f"{run_prefix}.batch_input", lines):
+            batch = submit_batch(client, input_path, metadata={'results_csv': os.path.basename(csv_filename)})
+            batches.append({'batch_id': batch.id, 'input_file': input_path, 'requests': count})
+        batch_ids = [batch['batch_id'] for batch in batches]
+        total = sum(batch['requests'] for batch in batches)
+        with open(f"{run_prefix}.batch.json", 'w', encoding='utf-8') as f:
+            json.dump({'batches': batches, 'requests': total}, f, indent=2)
+        logging.info(f"Submitted {len(batch_ids)} batch(es) with {total} requests; "
+                     f"collect later with --openai-batch --batch-id {' '.join(batch_ids)}")
+    results = {}
+    for batch_id in batch_ids:
+        batch = wait_for_batch(client, batch_id, poll_interval=args.batch_poll_interval)
+        for img_filename, cells in parse_batch_output(download_batch_output(client, batch)).items():
+            results.setdefault(img_filename, {}).update(cells)
+    
+    fieldnames = build_fieldnames(['gpt4o'], args.prompt_types)
+    with RunWriter(csv_filename, fieldnames, cells_filename) as writer:
+        for image_path in image_paths:
+            img_filename = image_name(image_path, args.images_dir)
+            image_results = {**completed.get(image_path, {}), **results.get(img_filename, {})}
+            if not image_results:
+                logging.warning(f"No batch returned answers for {img_filename}")
+                continue
+            row = {field: None for field in fieldnames}
+            row['image_name'] = img_filename
+            row['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for (model, prompt_type), result in image_results.items():
+                writer.write_cell(image_path, model, prompt_type, result)
+                fill_row(row, model, prompt_type, result)
+            writer.write_row(row)
+            if results_store is not None:
+                store_image(results_store, csv_filename, row, image_results)
+            if manifest is not None:
+                manifest.mark_done(img_filename)
+    logging.info(f"Results saved to {csv_filename}")
+
+def replay_run(args):
+    """
+    Rewrite a finished run's labels from its stored raw answers with the current parsing
+    and normalization. Never calls a model.
+    """
+    run = latest_run() if args.replay == 'latest' else args.replay
+    if run is None:
+        raise FileNotFoundError("No previous run found in 'results' to replay.")
+    csv_filename, cells_filename = run_paths(run)
+    output = args.output or f"{csv_filename[:-len('.csv')]}.replay.csv"
+    start = time.time()
+    count = replay_results(csv_filename, output, cells_path=cells_filename,
+                           image_name=lambda path: image_name(path, args.images_dir))
+    logging.info(f"Replayed {count} rows of {csv_filename} into {output} in {time.time() - start:.2f}s")
+
+def main(argv=None):
+    args = parse_args(argv)
+    quiet = args.quiet
+    logging.basicConfig(level=logging.WARNING if quiet else logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.replay:
+        replay_run(args)
+        return
+    
+    # Get temperature setting, only prompting when running on a terminal
+    if args.temperature is not None:
+        temperature = args.temperature
+    elif sys.stdin.isatty():
+        temperature = get_temperature_from_user()
+    else:
+        temperature = 0.0
+    if not quiet:
+        rprint(f":thermometer: [bold cyan]Using temperature:[/bold cyan] [yellow]{temperature}[/yellow]")
+    
+    # Results are streamed to disk as they complete; a resumed run only finishes what is missing
+    resume = latest_run() if args.resume == 'latest' else args.resume
+    if args.resume and resume is None:
+        raise FileNotFoundError("No previous run found in 'results' to resume.")
+    run = resume or args.output
+    if run is None and args.watch is not None:
+        # Not timestamp-named, so --resume latest and --replay latest never pick the rolling file
+        run = 'watch'
+    elif run is None and (args.shard or args.work_queue):
+        # Shards and workers started in the same second must not share an output file
+        run = datetime.now().strftime('%Y%m%d_%H%M%S')
+        run += f"_shard{args.shard[0]}of{args.shard[1]}" if args.shard else f"_{socket.gethostname()}_{os.getpid()}"
+    csv_filename, cells_filename = run_paths(run)
+    completed_cells = load_completed_cells(cells_filename) if resume else {}
+    written_images = load_written_images(csv_filename) if resume else set()
+    retry_images = set()
+    if resume:
+        # Written images with failed cells run again for just those cells; their new rows replace the old ones
+        retry_images = {image_name(path, args.images_dir) for path in load_failed_images(cells_filename)} & written_images
+        drop_rows(csv_filename, retry_images)
+        written_images -= retry_images
+    if resume and not quiet:
+        rprint(f":repeat: [bold cyan]Resuming {csv_filename}:[/bold cyan] {len(written_images)} images already written, "
+               f"{len(retry_images)} with failed cells to retry")
+    
+    # Incremental runs skip images whose content was already annotated
+    manifest_path = args.manifest or (f"{csv_filename[:-len('.csv')]}.manifest.sqlite" if args.watch is not None else None)
+    manifest = Manifest(manifest_path) if manifest_path else None
+    image_paths = list_pending_images(args, written_images, manifest)
+    total_images = len(image_paths)
+    if not quiet:
+        shard = f" (shard {args.shard[0]}/{args.shard[1]})" if args.shard else ''
+        changed = ' new or changed' if manifest is not None else ''
+        rprint(f":framed_picture: [bold green]Found {total_images}{changed} images to process in the '{args.images_dir}' folder{shard}.[/bold green]")
+    
+    # With a shared work queue, images are claimed lazily so idle workers pick up the remaining ones
+    work_queue = None
+    if args.work_queue:
+        work_queue = WorkQueue(args.work_queue)
+        work_queue.add(image_name(path, args.images_dir) for path in image_paths)
+        total_images = work_queue.remaining()
+        image_paths = (os.path.join(args.images_dir, name) for name in work_queue.claims(default_worker_id()))
+    
+    # Every request builder encodes images with this profile
+    set_encoding_profile(args.encoding)
+    
+    # Per-stage timings and per-call records, summarized at the end of the run
+    set_metrics(Metrics(trace_path=args.trace))
+    metrics_server = start_metrics_server(args.metrics_port) if args.metrics_port else None
+    
+    # Optional on-disk store so encoded payloads are reused across runs
+    image_cache_dir = os.path.join(args.cache_dir, 'images') if args.cache_dir else os.getenv('IMAGE_CACHE_DIR')
+    if image_cache_dir:
+        set_payload_cache(ImagePayloadCache(disk_dir=image_cache_dir))
+    
+    # Answers to unchanged temperature-0 requests are served from disk on re-runs
+    response_cache = None
+    if not args.no_response_cache:
+        response_cache_path = (os.path.join(args.cache_dir, 'responses.sqlite') if args.cache_dir
+                               else os.getenv('RESPONSE_CACHE_PATH', 'cache/responses.sqlite'))
+        response_cache = ResponseCache(response_cache_path)
+    
+    # Optional indexed store next to the CSV, for queries by model, prompt type or image
+    results_store = None
+    if args.results_db:
+        results_store = ResultsStore(args.results_db)
+        results_store.start_run(os.path.splitext(os.path.basename(csv_filename))[0],
+                                ['gpt4o'] if args.openai_batch else args.models, args.prompt_types)
+    
+    few_shot_examples = load_named_few_shot_examples(args.few_shot_dir) if 'few_shot' in args.prompt_types else None
+    if args.openai_batch:
+        if args.models != ['gpt4o']:
+            logging.warning("The Batch API only covers GPT-4o; run the other models live with --models.")
+        run_openai_batch(args, image_paths, temperature, few_shot_examples, csv_filename, cells_filename,
+                         results_store=results_store, manifest=manifest, completed=completed_cells)
+        if results_store is not None:
+            results_store.close()
+        if manifest is not None:
+            manifest.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        get_metrics().close()
+        return
+    # One query function per configured provider; the job matrix and CSV columns follow from these
+    query_fns = {
+        model: partial(get_provider(model).query, temperature=temperature, few_shot_examples=few_shot_examples,
+                       response_cache=response_cache)
+        for model in args.models
+    }
+    # Zero-shot and few-shot cells can label several images per request, amortizing the instructions and examples
+    batch_fns = {
+        (model, prompt_type): partial(get_provider(model).query_batch, prompt_type=prompt_type, temperature=temperature,
+                                      few_shot_examples=few_shot_examples, response_cache=response_cache)
+        for model in args.models if get_provider(model).supports_batch_prompts
+        for prompt_type in args.prompt_types if prompt_type in BATCH_PROMPT_TYPES
+    }
+    fieldnames = build_fieldnames(args.models, args.prompt_types)
+    
+    # Shared per-provider throttling: RPM/TPM buckets and an AIMD cap up to the worker count
+    concurrency = {model: get_provider(model).default_concurrency for model in args.models}
+    concurrency.update(parse_model_limits(args.concurrency, args.models))
+    rpm_limits = parse_model_limits(args.rpm, args.models)
+    tpm_limits = parse_model_limits(args.tpm, args.models)
+    for model in query_fns:
+        configure_rate_limiter(model, rpm=rpm_limits.get(model), tpm=tpm_limits.get(model),
+                               max_concurrency=concurrency[model])
+        configure_hedging(model, deadline=args.deadline, budget=args.hedge_budget,
+                          percentile=args.hedge_percentile / 100 if args.hedge_percentile is not None else None)
+        # A degraded provider fails fast and its jobs wait for it, instead of burning every retry
+        configure_circuit_breaker(model, failure_threshold=args.breaker_threshold or None,
+                                  reset_timeout=args.breaker_cooldown)
+    # Long-lived provider clients shared by all workers, with a keep-alive pool per worker
+    configure_clients(pool_size=concurrency.get('gpt4o'), timeout=args.timeout)
+    writer = RunWriter(csv_filename, fieldnames, cells_filename)
+    # Escalate to the expensive prompt types only for images the cheap answers do not settle
+    cascade = CascadePolicy(args.cascade or None, margin=args.cascade_margin) if args.cascade is not None else None
+    # Near-duplicate pages are annotated once; the index spans every batch of a --watch run
+    dedup = NearDuplicateFilter(args.dedup_threshold, args.dedup_hash) if args.dedup_threshold is not None else None
+    
+    def write_image(img_path, image_results):
+        """
+        Write a finished image's row and mark it done in the stores that track progress.
+        """
+        img_filename = image_name(img_path, args.images_dir)
+        row = {field: None for field in fieldnames}
+        row['image_name'] = img_filename
+        row['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for (model, prompt_type), result in image_results.items():
+            fill_row(row, model, prompt_type, result)
+        with get_metrics().stage('write'):
+            writer.write_row(row)
+            if results_store is not None:
+                store_image(results_store, csv_filename, row, image_results)
+        if work_queue is not None:
+            work_queue.complete(img_filename)
+        if manifest is not None:
+            manifest.mark_done(img_filename)
+        return img_filename
+    
+    def write_duplicates():
+        """
+        Write the rows of near-duplicates whose canonical image has been annotated.
+        """
+        duplicates = []
+        for img_path, canonical, distance, image_results in dedup.pop_ready():
+            for (model, prompt_type), result in image_results.items():
+                writer.write_cell(img_path, model, prompt_type, result)
+            duplicates.append((write_image(img_path, image_results), image_name(canonical, args.images_dir), distance))
+            logging.info(f"{img_path} is a near-duplicate of {canonical} ({distance} bits); reused its labels")
+        if duplicates:
+            append_duplicates(f"{csv_filename[:-len('.csv')]}.duplicates.csv", duplicates)
+        return len(duplicates)
+    
+    def annotate(image_paths, total_images):
+        """
+        Run every (model, prompt type) job of the given images and write their rows.
+        """
+        start_time = time.time()
+    
+        def on_result(job, result):
+            with get_metrics().stage('write', model=job.model):
+                writer.write_cell(job.image_path, job.model, job.prompt_type, result)
+            if quiet:
+                return
+            img_filename = image_name(job.image_path, args.images_dir)
+            logging.info(f"Finished {job.model}/{job.prompt_type} for image {job.image_index}/{total_images}: {job.image_path}")
+            print_result_panel(job.image_index, total_images, img_filename, job.model, job.prompt_type, result, normalize_emotion(result['label']))
+    
+        # Images are decoded and encoded just in time ahead of their API calls, so memory stays flat
+        images = open_image_stream(args, image_paths)
+        if dedup is not None:
+            images = dedup.filter(images)
+        progress = tqdm(total=total_images, desc='Processing Images', unit='img')
+        image_results_iter = run_annotation_jobs(images, query_fns, prompt_types=args.prompt_types,
+                                                 concurrency=concurrency,
+                                                 on_result=on_result, completed=completed_cells, cascade=cascade,
+                                                 batch_fns=batch_fns, batch_size=args.images_per_request)
+        for done_count, (image_index, img_path, image_results) in enumerate(image_results_iter, 1):
+            img_filename = write_image(img_path, image_results)
+            progress.update(1)
+            if dedup is not None:
+                dedup.resolve(img_path, image_results)
+                progress.update(write_duplicates())
+            if quiet:
+                continue
+
+            # Elapsed and remaining time reporting
+            elapsed = time.time() - start_time
+            avg_time = elapsed / done_count
+            remaining = avg_time * (total_images - done_count)
+            elapsed_str = time.strftime('%H:%M:%S', time.gmtime(elapsed))
+            remaining_str = time.strftime('%H:%M:%S', time.gmtime(remaining))
+            print_tqdm_rich(f"[bold green]Finished image {image_index}/{total_images}: {img_filename}[/bold green] | [bold green]Elapsed time:[/bold green] {elapsed_str} | [bold yellow]Estimated remaining:[/bold yellow] {remaining_str}")
+        if dedup is not None:
+            # Duplicates of images that had already finished when they were streamed
+            progress.update(write_duplicates())
+        progress.close()
+    
+    if args.watch is None:
+        annotate(image_paths, total_images)
+    else:
+        # Poll for added or changed images; each batch costs only its own calls
+        scans = 0
+        try:
+            while True:
+                if image_paths:
+                    annotate(image_paths, len(image_paths))
+                scans += 1
+                if args.watch_cycles and scans >= args.watch_cycles:
+                    break
+                time.sleep(args.watch)
+                image_paths = list_pending_images(args, manifest=manifest)
+                if image_paths:
+                    logging.info(f"Found {len(image_paths)} new or changed images")
+        except KeyboardInterrupt:
+            logging.info("Watch stopped.")
+    writer.close()
     logging.info(f"Results saved to {csv_filename}")
+    if results_store is not None:
+        logging.info(f"Results store {args.results_db}: {results_store.stats()}")
+        results_store.close()
+    if work_queue is not None:
+        logging.info(f"Work queue {args.work_queue}: {work_queue.stats()}")
+        work_queue.close()
+    if manifest is not None:
+        logging.info(f"Manifest {manifest.path}: {len(manifest)} images")
+        manifest.close()
+    if cascade is not None and cascade.images:
+        stats = cascade.stats()
+        logging.info(f"Cascade: {stats}")
+        if not quiet:
+            rprint(f":chart_with_downwards_trend: [bold cyan]Cascade:[/bold cyan] {stats['calls_per_image']} calls per image "
+                   f"instead of {stats['full_calls'] / stats['images']:g} ({stats['saved']:.0%} fewer calls); "
+                   f"settled at stage {stats['settled_at_stage']}, unsettled {stats['unsettled']}")
+    logging.info(f"Image payload cache: {get_payload_cache().stats()}")
+    if response_cache is not None:
+        logging.info(f"Response cache: {response_cache.stats()}")
+        response_cache.close()
+    for model in query_fns:
+        logging.info(f"Rate limiter ({model}): {get_rate_limiter(model).stats()}")
+        logging.info(f"Latency ({model}): {get_provider(model).latency.summary()}")
+        if get_hedge_policy(model).enabled:
+            logging.info(f"Hedging ({model}): {get_hedge_policy(model).stats()}")
+        if get_circuit_breaker(model).opened:
+            logging.info(f"Circuit breaker ({model}): {get_circuit_breaker(model).stats()}")
+    close_clients()
+    if not quiet:
+        console.print(Panel(get_metrics().summary_table(), title='Pipeline stages', expand=False))
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    get_metrics().close()
     logging.info("Processing complete.")
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+import os
+import csv
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.analysis import (LABELS, MISSING, book_of, encode_labels, load_results, majority_labels,
+                            confusion_matrix, cohen_kappa, fleiss_kappa, group_distribution, evaluate)
+
+JOY, TRUST, FEAR, SURPRISE, SADNESS = range(5)
+
+
+def test_book_of_image_names():
+    assert book_of('open_tap_page_11.png') == 'open_tap'
+    assert book_of('kenan_and_watermelon_head_page_28 (1).png') == 'kenan_and_watermelon_head'
+    assert book_of('open_tap/11.png') == 'open_tap'
+    assert book_of('cover.png') == 'cover'
+
+
+def test_encode_labels_marks_missing_and_unknown_labels():
+    codes = encode_labels([['سعادة', ''], ['غير معروف', 'محايد']])
+    assert codes.tolist() == [[0, MISSING], [MISSING, LABELS.index('محايد')]]
+
+
+def test_load_results_reads_quoted_multiline_cells_and_short_rows(tmp_path):
+    path = tmp_path / 'results.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image_name', 'gpt4o_cot', 'gpt4o_cot_reasoning', 'gemini_zero_shot', 'timestamp'])
+        writer.writerow(['a, b.png', 'حزن', 'سطر أول\nو"سطر" ثان, ثالث', 'سعادةٌ', '2024-06-10'])
+        writer.writerow(['c.png', '', '', 'غضب', '2024-06-10'])
+    table = load_results([str(path)])
+    assert table.image_names.tolist() == ['a, b.png', 'c.png']
+    assert table.codes.tolist() == [[LABELS.index('حزن'), MISSING], [MISSING, LABELS.index('غضب')]]
+
+    # A row torn by a crash is read with its missing cells empty
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('d.png,قرف\n')
+    assert load_results([str(path)]).codes[-1].tolist() == [LABELS.index('قرف'), MISSING]
+
+
+def test_majority_labels_leave_ties_undecided():
+    codes = np.array([[JOY, JOY, FEAR], [JOY, FEAR, MISSING], [MISSING, MISSING, MISSING], [SADNESS, MISSING, MISSING]])
+    labels, votes = majority_labels(codes)
+    assert labels.tolist() == [JOY, MISSING, MISSING, SADNESS]
+    assert votes.tolist() == [2, 1, 0, 1]
+
+
+def test_cohen_kappa_matches_the_textbook_example():
+    # 50 items: both yes 20, a yes/b no 5, a no/b yes 10, both no 15 -> kappa 0.4
+    a = np.array([JOY] * 25 + [FEAR] * 25)
+    b = np.array([JOY] * 20 + [FEAR] * 5 + [JOY] * 10 + [FEAR] * 15)
+    assert confusion_matrix(a, b)[[JOY, JOY, FEAR, FEAR], [JOY, FEAR, JOY, FEAR]].tolist() == [20, 5, 10, 15]
+    assert cohen_kappa(a, b) == pytest.approx(0.4)
+    assert cohen_kappa(np.append(a, MISSING), np.append(b, JOY)) == pytest.approx(0.4)
+
+
+def test_fleiss_kappa_matches_the_textbook_example():
+    # Fleiss (1971) worked example: 10 subjects, 14 raters, 5 categories -> kappa 0.210
+    counts = [[0, 0, 0, 0, 14], [0, 2, 6, 4, 2], [0, 0, 3, 5, 6], [0, 3, 9, 2, 0], [2, 2, 8, 1, 1],
+              [7, 7, 0, 0, 0], [3, 2, 6, 3, 0], [2, 5, 3, 2, 2], [6, 5, 2, 1, 0], [0, 2, 2, 3, 7]]
+    codes = np.array([[label for label, n in enumerate(row) for _ in range(n)] for row in counts])
+    assert fleiss_kappa(codes) == pytest.approx(0.2099, abs=1e-4)
+    # Rows missing a rater are left out
+    assert fleiss_kappa(np.vstack([codes, [MISSING] + [JOY] * 13])) == pytest.approx(0.2099, abs=1e-4)
+
+
+def test_group_distribution_counts_labels_per_group():
+    codes = np.array([[JOY, JOY], [FEAR, MISSING], [JOY, SURPRISE]])
+    names, counts = group_distribution(codes, ['b', 'a', 'b'])
+    assert names == ['a', 'b']
+    assert counts[0, FEAR] == 1 and counts[1, JOY] == 3 and counts[1, SURPRISE] == 1 and counts.sum() == 5
+
+
+def test_report_over_several_results_files(tmp_path):
+    first = tmp_path / 'first.csv'
+    with open(first, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image_name', 'gpt4o_zero_shot', 'gemini_zero_shot', 'gpt4o_zero_shot_raw', 'timestamp'])
+        writer.writerow(['open_tap_page_11.png', 'سعادة', 'سعادة', 'x', 't'])
+        writer.writerow(['open_tap_page_13.png', 'حزن', 'خوف', 'x', 't'])
+    second = tmp_path / 'second.csv'
+    with open(second, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image_name', 'gpt4o_cot', 'gpt4o_cot_reasoning', 'gpt4o_zero_shot', 'timestamp'])
+        writer.writerow(['bird_page_1.png', 'غضب', 'الوجه غاضب', '', 't'])
+
+    table = load_results([str(first), str(second)])
+    assert table.annotators == [('gpt4o', 'zero_shot'), ('gemini', 'zero_shot'), ('gpt4o', 'chain_of_thought')]
+    assert table.codes.tolist() == [[JOY, JOY, MISSING], [SADNESS, FEAR, MISSING],
+                                    [MISSING, MISSING, LABELS.index('غضب')]]
+
+    report = evaluate(table)
+    assert report['rows'] == 3 and report['no_majority'] == 1
+    assert report['missing'] == {'gpt4o/zero_shot': 1, 'gemini/zero_shot': 1, 'gpt4o/chain_of_thought': 2}
+    assert report['book_distribution']['open_tap']['حزن'] == 1
+    assert report['confusion_matrices']['gpt4o/zero_shot vs gemini/zero_shot'][SADNESS][FEAR] == 1
+    assert report['pairwise_kappa'][0][2] is None
+
+
+def test_evaluate_on_a_large_random_table():
+    from utils.analysis import ResultTable
+    rng = np.random.default_rng(0)
+    rows = 300000
+    codes = rng.integers(MISSING, len(LABELS), (rows, 6)).astype(np.int8)
+    names = np.array([f"book_{i % 40}_page_{i}.png" for i in range(rows)], dtype=object)
+    table = ResultTable(names, ['results.csv'] * rows, [('m', str(i)) for i in range(6)], codes)
+    report = evaluate(table)
+    assert len(report['book_distribution']) == 40
+    assert abs(report['fleiss_kappa']) < 0.01
@@ -0,0 +1,119 @@
+import os
+import csv
+import sys
+import json
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+openai = pytest.importorskip("openai")
+pytest.importorskip("rich")
+pytest.importorskip("google.generativeai")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.batch_api import (
+    build_batch_lines, write_batch_files, submit_batch, wait_for_batch,
+    download_batch_output, parse_batch_output, split_custom_id,
+)
+from utils.fake_llm_server import start_fake_server, FAKE_LABELS
+import main
+
+
+@pytest.fixture
+def fake_server():
+    server, base_url = start_fake_server()
+    yield server, base_url
+    server.shutdown()
+
+
+def make_images(directory, names):
+    directory.mkdir()
+    for i, name in enumerate(names):
+        Image.new('RGB', (16, 16), (i * 40, 0, 0)).save(directory / name)
+    return [(str(directory / name), Image.open(directory / name)) for name in names]
+
+
+def test_batch_lines_use_live_builders_and_custom_ids(tmp_path):
+    images = make_images(tmp_path / 'images', ['page (1).png'])
+    lines = list(build_batch_lines(images, ['zero_shot', 'chain_of_thought']))
+    assert [line['custom_id'] for line in lines] == ['page (1).png::zero_shot', 'page (1).png::chain_of_thought']
+    assert split_custom_id(lines[0]['custom_id']) == ('page (1).png', 'zero_shot')
+    assert lines[0]['body']['model'] == 'gpt-4o'
+    assert lines[0]['body']['messages'][1]['content'][1]['type'] == 'image_url'
+
+
+def test_batch_files_are_split_at_the_request_and_byte_limits(tmp_path):
+    lines = [{'custom_id': f"page{i}.png::zero_shot", 'body': 'x' * 50} for i in range(5)]
+    files = write_batch_files(str(tmp_path / 'batch'), lines, max_requests=2)
+    assert [count for _, count in files] == [2, 2, 1]
+    assert [os.path.basename(path) for path, _ in files] == ['batch.1.jsonl', 'batch.2.jsonl', 'batch.3.jsonl']
+    with open(files[2][0], encoding='utf-8') as f:
+        assert json.loads(f.read())['custom_id'] == 'page4.png::zero_shot'
+
+    line_bytes = len(json.dumps(lines[0]).encode('utf-8')) + 1
+    files = write_batch_files(str(tmp_path / 'small'), lines, max_bytes=2 * line_bytes + 1)
+    assert [count for _, count in files] == [2, 2, 1]
+    assert all(os.path.getsize(path) <= 2 * line_bytes + 1 for path, _ in files)
+
+
+def test_submit_poll_download_and_merge_against_local_server(tmp_path, fake_server):
+    _, base_url = fake_server
+    client = openai.OpenAI(api_key='test', base_url=base_url)
+    images = make_images(tmp_path / 'images', ['a.png', 'b.png'])
+    [(input_path, count)] = write_batch_files(str(tmp_path / 'batch'), build_batch_lines(images, ['zero_shot', 'chain_of_thought']))
+    assert count == 4
+
+    batch = submit_batch(client, input_path)
+    batch = wait_for_batch(client, batch.id, poll_interval=0.01, timeout=10)
+    results = parse_batch_output(download_batch_output(client, batch))
+
+    assert batch.status == 'completed'
+    assert set(results) == {'a.png', 'b.png'}
+    for image_results in results.values():
+        assert image_results[('gpt4o', 'zero_shot')]['label'] in FAKE_LABELS
+        cot = image_results[('gpt4o', 'chain_of_thought')]
+        assert cot['label'] in FAKE_LABELS and cot['reasoning']
+
+
+def test_main_batch_mode_writes_results_csv(tmp_path, fake_server, monkeypatch):
+    _, base_url = fake_server
+    monkeypatch.setenv('OPENAI_BASE_URL', base_url)
+    monkeypatch.setattr(main, 'OPENAI_API_KEY', 'test')
+    make_images(tmp_path / 'images', ['a.png', 'b.png', 'c.png'])
+    output = tmp_path / 'out.csv'
+
+    main.main(['--openai-batch', '--models', 'gpt4o', '--prompt-types', 'zero_shot', 'chain_of_thought',
+               '--temperature', '0', '--images-dir', str(tmp_path / 'images'), '--output', str(output),
+               '--batch-poll-interval', '0.01', '--no-response-cache', '--quiet'])
+
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row['image_name'] for row in rows) == ['a.png', 'b.png', 'c.png']
+    assert all(row['gpt4o_zero_shot'] in FAKE_LABELS and row['gpt4o_cot'] in FAKE_LABELS for row in rows)
+    with open(tmp_path / 'out.batch.json', encoding='utf-8') as f:
+        assert json.load(f)['requests'] == 6
+
+
+def test_failed_batch_requests_are_read_from_the_error_file_and_resubmitted_on_resume(tmp_path, fake_server, monkeypatch):
+    server, base_url = fake_server
+    server.state.error_rate = 1.0
+    monkeypatch.setenv('OPENAI_BASE_URL', base_url)
+    monkeypatch.setattr(main, 'OPENAI_API_KEY', 'test')
+    make_images(tmp_path / 'images', ['a.png', 'b.png'])
+    output = tmp_path / 'out.csv'
+    argv = ['--openai-batch', '--models', 'gpt4o', '--prompt-types', 'zero_shot', '--temperature', '0',
+            '--images-dir', str(tmp_path / 'images'), '--output', str(output),
+            '--batch-poll-interval', '0.01', '--no-response-cache', '--quiet']
+
+    main.main(argv)
+    with open(output, newline='', encoding='utf-8') as f:
+        assert sorted((row['image_name'], row['gpt4o_zero_shot']) for row in csv.DictReader(f)) == [('a.png', ''), ('b.png', '')]
+
+    server.state.error_rate = 0.0
+    main.main(argv + ['--resume', str(output)])
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row['image_name'] for row in rows) == ['a.png', 'b.png']
+    assert all(row['gpt4o_zero_shot'] in FAKE_LABELS for row in rows)
+    with open(tmp_path / 'out.batch.json', encoding='utf-8') as f:
+        assert json.load(f)['requests'] == 2
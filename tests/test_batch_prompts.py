@@ -0,0 +1,164 @@
+import os
+import csv
+import sys
+import json
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("openai")
+pytest.importorskip("google.generativeai")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.model_utils import (build_gpt4o_batch_request, build_gemini_batch_request, parse_batch_answer,
+                               BATCH_IMAGE_MARKER)
+from utils.providers import Provider
+from utils.engine import run_annotation_jobs
+
+
+def examples():
+    return [(f'{name}.png', Image.new('RGB', (8, 8), color)) for name, color in
+            (('sadness', 'blue'), ('surprise', 'yellow'), ('disgust', 'green'))]
+
+
+def test_batched_prompt_sends_the_examples_once_and_numbers_the_targets():
+    targets = [Image.new('RGB', (8, 8), color) for color in ('red', 'white', 'black')]
+    messages, request_json = build_gpt4o_batch_request(targets, 'few_shot', examples())
+    content = messages[1]['content']
+    assert sum(part['type'] == 'image_url' for part in content) == 6
+    texts = [part['text'] for part in content if part['type'] == 'text']
+    assert [text for text in texts if text.startswith(BATCH_IMAGE_MARKER)] == [
+        f'{BATCH_IMAGE_MARKER} 1:', f'{BATCH_IMAGE_MARKER} 2:', f'{BATCH_IMAGE_MARKER} 3:']
+    assert 'JSON' in content[-1]['text'] and '[BASE64_IMAGE_DATA]' in request_json
+
+    contents, _ = build_gemini_batch_request(targets[:2], 'zero_shot')
+    assert sum('inline_data' in part for part in contents[1]['parts']) == 2
+    with pytest.raises(ValueError):
+        build_gpt4o_batch_request(targets, 'chain_of_thought')
+
+
+def test_batched_answers_are_split_per_image():
+    assert parse_batch_answer('{"1": "حزن", "2": "غضب"}', 2) == ['حزن', 'غضب']
+    assert parse_batch_answer('```json\n{"٢": "خوف", "1": " سعادة "}\n```', 2) == ['سعادة', 'خوف']
+    # Missing, empty and non-string entries are unreadable; so is anything that isn't a JSON object
+    assert parse_batch_answer('{"1": "حزن", "2": "", "4": "قرف"}', 3) == ['حزن', None, None]
+    assert parse_batch_answer('{"1": ["حزن"]}', 1) == [None]
+    assert parse_batch_answer('عذرا، لا أستطيع تحليل الصور', 2) == [None, None]
+    assert parse_batch_answer(None, 1) == [None]
+
+
+class ScriptedBatchProvider(Provider):
+    """Answers batched requests with `batch_answer` and single requests with the image's name."""
+    name = 'scripted'
+    model_name = 'scripted-1'
+    supports_batch_prompts = True
+
+    def __init__(self, batch_answer):
+        super().__init__()
+        self.batch_answer = batch_answer
+        self.requests = []
+
+    def build_request(self, image, prompt_type, few_shot_examples=None):
+        return {'single': image.info['name']}, 'single'
+
+    def build_batch_request(self, images, prompt_type, few_shot_examples=None):
+        return {'batch': [image.info['name'] for image in images]}, 'batch'
+
+    def invoke(self, request, temperature):
+        self.requests.append(request)
+        return (self.batch_answer if 'batch' in request else request['single']), None
+
+
+def named(name):
+    image = Image.new('RGB', (8, 8))
+    image.info['name'] = name
+    return image
+
+
+def test_query_batch_falls_back_to_single_requests_for_unparsed_images():
+    images = [named('a'), named('b'), named('c')]
+    provider = ScriptedBatchProvider('{"1": "حزن", "3": "غضب"}')
+    results = provider.query_batch(images, 'zero_shot', max_retries=0)
+    assert [result['label'] for result in results] == ['حزن', 'b', 'غضب']
+    assert results[0] == {'label': 'حزن', 'reasoning': None, 'request_json': 'batch', 'raw_answer': 'حزن'}
+    assert provider.requests == [{'batch': ['a', 'b', 'c']}, {'single': 'b'}]
+
+    provider = ScriptedBatchProvider('لا أستطيع المساعدة')
+    assert [result['label'] for result in provider.query_batch(images[:2], 'zero_shot', max_retries=0)] == ['a', 'b']
+    assert len(provider.requests) == 3
+
+
+def test_failed_batched_request_is_not_repeated_per_image(monkeypatch):
+    from utils import rate_limit
+    monkeypatch.setattr(rate_limit, '_rate_limiters', {})
+    rate_limit.configure_rate_limiter('scripted', sleep=lambda seconds: None)
+    provider = ScriptedBatchProvider(None)
+
+    def down(request, temperature):
+        provider.requests.append(request)
+        raise ConnectionError('provider unavailable')
+    provider.invoke = down
+    results = provider.query_batch([named('a'), named('b'), named('c')], 'zero_shot', max_retries=2)
+    assert [result['label'] for result in results] == [None, None, None]
+    assert provider.requests == [{'batch': ['a', 'b', 'c']}] * 3
+
+
+def test_engine_groups_batchable_jobs_and_routes_answers_to_their_images():
+    groups = []
+
+    def batch_fn(images):
+        groups.append(list(images))
+        return [{'label': f'{image}-zero', 'reasoning': None, 'request_json': None} for image in images]
+
+    query_fns = {'m': lambda image, prompt_type: {'label': f'{image}-{prompt_type}', 'reasoning': None, 'request_json': None}}
+    images = [(f'{name}.png', name) for name in 'abcdefg']
+    finished = {path: results for _, path, results in run_annotation_jobs(
+        images, query_fns, prompt_types=('zero_shot', 'chain_of_thought'), batch_fns={('m', 'zero_shot'): batch_fn},
+        batch_size=3)}
+
+    assert sorted(finished) == [path for path, _ in images]
+    for path, name in images[:6]:
+        assert finished[path][('m', 'zero_shot')]['label'] == f'{name}-zero'
+        assert finished[path][('m', 'chain_of_thought')]['label'] == f'{name}-chain_of_thought'
+    assert groups == [list('abc'), list('def')]
+    # The remainder goes out once the stream ends, a group of one as a plain single-image query
+    assert finished['g.png'][('m', 'zero_shot')]['label'] == 'g-zero_shot'
+
+
+def test_run_with_images_per_request_makes_fewer_calls(tmp_path):
+    pytest.importorskip("rich")
+    import main
+    from utils.metrics import get_metrics
+
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    for index, color in enumerate(('red', 'blue', 'green', 'white', 'black')):
+        Image.new('RGB', (16, 16), color).save(images_dir / f'page_{index}.png')
+    few_shot_dir = tmp_path / 'few_shot'
+    few_shot_dir.mkdir()
+    for name, image in examples():
+        image.save(few_shot_dir / name)
+    output = tmp_path / 'out.csv'
+    main.main(['--temperature', '0', '--images-dir', str(images_dir), '--models', 'stub', '--output', str(output),
+               '--no-response-cache', '--quiet', '--few-shot-dir', str(few_shot_dir), '--images-per-request', '5'])
+
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 5
+    for row in rows:
+        assert row['stub_zero_shot'] and row['stub_few_shot'] and row['stub_cot']
+        assert row['stub_few_shot_raw'] == row['stub_few_shot']
+        assert 'JSON' in json.loads(row['stub_few_shot_request'])[1]['content'][-1]['text']
+    # One batched request per batchable prompt type, plus a chain-of-thought request per image
+    assert get_metrics().call_summary()['stub']['calls'] == 2 + 5
+
+
+def test_open_circuit_during_fallback_keeps_the_batched_labels():
+    from utils.circuit_breaker import CircuitOpen
+    provider = ScriptedBatchProvider('{"1": "حزن", "3": "غضب"}')
+
+    def circuit_open(*args, **kwargs):
+        raise CircuitOpen('scripted', 30)
+    provider.query = circuit_open
+    results = provider.query_batch([named('a'), named('b'), named('c')], 'zero_shot', max_retries=0)
+    assert [result['label'] for result in results] == ['حزن', None, 'غضب']
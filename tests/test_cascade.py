@@ -0,0 +1,95 @@
+import os
+import sys
+import argparse
+
+import pytest
+
+pytest.importorskip("PIL.Image")
+pytest.importorskip("openai")
+pytest.importorskip("google.generativeai")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.cascade import CascadePolicy, parse_cascade_stage, answer_vote
+from utils.engine import run_annotation_jobs, PROMPT_TYPES
+
+MODELS = ['gpt4o', 'gemini']
+
+
+def answer(label, raw=None):
+    return {'label': label, 'reasoning': None, 'request_json': None, 'raw_answer': raw if raw is not None else label}
+
+
+def test_parse_cascade_stage():
+    assert parse_cascade_stage('zero_shot') == [(None, 'zero_shot')]
+    assert parse_cascade_stage('gpt4o/few_shot, gemini/zero_shot') == [('gpt4o', 'few_shot'), ('gemini', 'zero_shot')]
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_cascade_stage('gpt4o/cot')
+
+
+def test_default_plan_runs_the_cheapest_prompt_type_first():
+    assert CascadePolicy().plan(MODELS, PROMPT_TYPES) == [
+        [('gpt4o', 'zero_shot'), ('gemini', 'zero_shot')],
+        [('gpt4o', 'few_shot'), ('gemini', 'few_shot')],
+        [('gpt4o', 'chain_of_thought'), ('gemini', 'chain_of_thought')],
+    ]
+    stages = [parse_cascade_stage('gpt4o/zero_shot,mistral/zero_shot'), parse_cascade_stage('chain_of_thought')]
+    # Unknown models are dropped, and cells in no stage (few-shot) never run
+    assert CascadePolicy(stages).plan(MODELS, PROMPT_TYPES) == [
+        [('gpt4o', 'zero_shot')], [('gpt4o', 'chain_of_thought'), ('gemini', 'chain_of_thought')]]
+
+
+def test_only_clean_labels_vote():
+    assert answer_vote(answer('حُزن.')) == 'حزن'
+    assert answer_vote(answer('فرح')) == 'سعادة'
+    # Matched only on a two-letter prefix by normalize_emotion: not clean
+    assert answer_vote(answer('حزين جدا')) is None
+    assert answer_vote(answer('حزن', raw='عذرا، لا أستطيع تحليل الصور')) is None
+    assert answer_vote(answer(None)) is None
+
+
+def test_agreement_settles_and_disagreement_escalates():
+    policy = CascadePolicy()
+    assert policy.settled({('gpt4o', 'zero_shot'): answer('حزن'), ('gemini', 'zero_shot'): answer('حزن')})
+    assert not policy.settled({('gpt4o', 'zero_shot'): answer('حزن'), ('gemini', 'zero_shot'): answer('غضب')})
+    assert not policy.settled({('gpt4o', 'zero_shot'): answer('حزن'), ('gemini', 'zero_shot'): answer(None)})
+    assert policy.settled({('gpt4o', 'zero_shot'): answer('حزن'), ('gemini', 'zero_shot'): answer('غضب'),
+                           ('gpt4o', 'few_shot'): answer('حزن'), ('gemini', 'few_shot'): answer('حزن')})
+
+
+class ScriptedProvider:
+    """Answers from a script keyed on (image, prompt type); counts calls."""
+
+    def __init__(self, script):
+        self.script = script
+        self.calls = []
+
+    def __call__(self, image, prompt_type):
+        self.calls.append((image, prompt_type))
+        return answer(self.script.get((image, prompt_type), 'محايد'))
+
+
+def test_engine_escalates_only_unsettled_images():
+    providers = {
+        'gpt4o': ScriptedProvider({('a', 'zero_shot'): 'حزن', ('b', 'zero_shot'): 'حزن', ('b', 'few_shot'): 'غضب',
+                                   ('c', 'zero_shot'): 'خوف'}),
+        'gemini': ScriptedProvider({('a', 'zero_shot'): 'حزن', ('b', 'zero_shot'): 'غضب', ('b', 'few_shot'): 'غضب',
+                                    ('c', 'zero_shot'): 'قرف', ('c', 'few_shot'): 'سعادة'}),
+    }
+    policy = CascadePolicy()
+    images = [('a.png', 'a'), ('b.png', 'b'), ('c.png', 'c')]
+    finished = {path: results for _, path, results in run_annotation_jobs(images, providers, cascade=policy)}
+
+    assert set(finished['a.png']) == {('gpt4o', 'zero_shot'), ('gemini', 'zero_shot')}
+    assert len(finished['b.png']) == 4
+    assert len(finished['c.png']) == 6
+    assert policy.stats() == {'images': 3, 'calls': 12, 'full_calls': 18, 'calls_per_image': 4.0, 'saved': 0.333,
+                              'settled_at_stage': {1: 1, 2: 1, 3: 1}, 'unsettled': 0}
+
+
+def test_engine_cascade_resumes_from_completed_cells():
+    providers = {'gpt4o': ScriptedProvider({}), 'gemini': ScriptedProvider({})}
+    completed = {'a.png': {('gpt4o', 'zero_shot'): answer('محايد')}}
+    policy = CascadePolicy()
+    (_, _, results), = run_annotation_jobs([('a.png', 'a')], providers, completed=completed, cascade=policy)
+    assert len(results) == 2
+    assert providers['gpt4o'].calls == [] and providers['gemini'].calls == [('a', 'zero_shot')]
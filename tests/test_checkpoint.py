@@ -0,0 +1,99 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.checkpoint import (RunWriter, run_paths, latest_run, load_completed_cells, load_failed_images,
+                              load_written_images, drop_rows)
+from utils.engine import run_annotation_jobs
+
+FIELDNAMES = ['image_name', 'gpt4o_zero_shot']
+
+
+def ok(label):
+    return {'label': label, 'reasoning': None, 'request_json': None}
+
+
+def test_run_paths_accepts_timestamp_or_csv_path():
+    assert run_paths('20240610_153045') == (os.path.join('results', 'results_20240610_153045.csv'),
+                                            os.path.join('results', 'results_20240610_153045.cells.jsonl'))
+    assert run_paths('out/run.csv') == ('out/run.csv', 'out/run.cells.jsonl')
+
+
+def test_latest_run_skips_sidecar_csvs(tmp_path):
+    assert latest_run(str(tmp_path)) is None
+    for name in ('results_20240610_153045.csv', 'results_20240611_090000_shard1of2.csv',
+                 'results_20240611_090000_shard1of2.replay.csv'):
+        (tmp_path / name).write_text('image_name\n')
+    assert latest_run(str(tmp_path)) == str(tmp_path / 'results_20240611_090000_shard1of2.csv')
+
+
+def test_cells_and_rows_are_readable_after_reopen(tmp_path):
+    csv_path, cells_path = str(tmp_path / 'run.csv'), str(tmp_path / 'run.cells.jsonl')
+    with RunWriter(csv_path, FIELDNAMES, cells_path) as writer:
+        writer.write_cell('images/a.png', 'gpt4o', 'zero_shot', ok('حزن'))
+        writer.write_cell('images/a.png', 'gemini', 'zero_shot', ok(None))
+        writer.write_row({'image_name': 'a.png', 'gpt4o_zero_shot': 'حزن'})
+    with RunWriter(csv_path, FIELDNAMES, cells_path) as writer:
+        writer.write_row({'image_name': 'b.png', 'gpt4o_zero_shot': 'قرف'})
+
+    assert load_written_images(csv_path) == {'a.png', 'b.png'}
+    with open(csv_path, encoding='utf-8') as f:
+        assert f.read().count('image_name') == 1
+    # Failed calls are not treated as done
+    assert load_completed_cells(cells_path) == {'images/a.png': {('gpt4o', 'zero_shot'): ok('حزن')}}
+
+
+def test_failed_images_and_their_rows_are_found_for_retry(tmp_path):
+    csv_path, cells_path = str(tmp_path / 'run.csv'), str(tmp_path / 'run.cells.jsonl')
+    with RunWriter(csv_path, FIELDNAMES, cells_path) as writer:
+        writer.write_cell('images/a.png', 'gpt4o', 'zero_shot', ok(None))
+        writer.write_cell('images/b.png', 'gpt4o', 'zero_shot', ok('قرف'))
+        writer.write_row({'image_name': 'a.png'})
+        writer.write_row({'image_name': 'b.png', 'gpt4o_zero_shot': 'قرف'})
+    assert load_failed_images(cells_path) == {'images/a.png'}
+    # A later record of the same cell supersedes the earlier one
+    with RunWriter(csv_path, FIELDNAMES, cells_path) as writer:
+        writer.write_cell('images/a.png', 'gpt4o', 'zero_shot', ok('حزن'))
+    assert load_failed_images(cells_path) == set()
+    assert load_completed_cells(cells_path)['images/a.png'] == {('gpt4o', 'zero_shot'): ok('حزن')}
+
+    assert drop_rows(csv_path, {'a.png'}) == 1
+    assert load_written_images(csv_path) == {'b.png'}
+    with RunWriter(csv_path, FIELDNAMES, cells_path) as writer:
+        writer.write_row({'image_name': 'a.png', 'gpt4o_zero_shot': 'حزن'})
+    with open(csv_path, encoding='utf-8') as f:
+        assert f.read().count('image_name') == 1
+
+
+def test_torn_last_line_is_ignored_and_terminated(tmp_path):
+    csv_path, cells_path = str(tmp_path / 'run.csv'), str(tmp_path / 'run.cells.jsonl')
+    with RunWriter(csv_path, FIELDNAMES, cells_path) as writer:
+        writer.write_cell('images/a.png', 'gpt4o', 'zero_shot', ok('حزن'))
+    with open(cells_path, 'a', encoding='utf-8') as f:
+        f.write('{"image_path": "images/a.png", "mod')
+    with RunWriter(csv_path, FIELDNAMES, cells_path) as writer:
+        writer.write_cell('images/a.png', 'gpt4o', 'few_shot', ok('قرف'))
+
+    cells = load_completed_cells(cells_path)['images/a.png']
+    assert set(cells) == {('gpt4o', 'zero_shot'), ('gpt4o', 'few_shot')}
+
+
+def test_engine_only_runs_missing_cells():
+    calls = []
+
+    def query(image, prompt_type):
+        calls.append((image, prompt_type))
+        return ok('new')
+
+    completed = {
+        'a.png': {('gpt4o', 'zero_shot'): ok('old'), ('gpt4o', 'few_shot'): ok('old'),
+                  ('gpt4o', 'chain_of_thought'): ok('old')},
+        'b.png': {('gpt4o', 'zero_shot'): ok('old')},
+    }
+    finished = {path: results for _, path, results in
+                run_annotation_jobs([('a.png', 'A'), ('b.png', 'B')], {'gpt4o': query}, completed=completed)}
+
+    assert sorted(calls) == [('B', 'chain_of_thought'), ('B', 'few_shot')]
+    assert all(result['label'] == 'old' for result in finished['a.png'].values())
+    assert finished['b.png'][('gpt4o', 'zero_shot')]['label'] == 'old'
+    assert finished['b.png'][('gpt4o', 'few_shot')]['label'] == 'new'
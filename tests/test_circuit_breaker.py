@@ -0,0 +1,149 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_opens_after_consecutive_failures_and_fails_fast():
+    clock = FakeClock()
+    breaker = CircuitBreaker('gpt4o', failure_threshold=3, reset_timeout=30, clock=clock)
+    for _ in range(2):
+        breaker.on_failure()
+    breaker.on_success()
+    for _ in range(2):
+        breaker.on_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.on_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    clock.now = 10
+    assert breaker.retry_in() == pytest.approx(20)
+    assert breaker.stats() == {'state': OPEN, 'opened': 1, 'rejected': 1}
+
+
+def test_half_open_lets_one_probe_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker('gemini', failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.on_failure()
+    clock.now = 5
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    # A failed probe reopens the circuit for another cooldown
+    breaker.on_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    clock.now = 10
+    assert breaker.allow()
+    breaker.on_success()
+    assert breaker.state == CLOSED and breaker.allow() and breaker.allow()
+
+
+def test_default_breaker_never_opens():
+    breaker = CircuitBreaker('gpt4o')
+    for _ in range(100):
+        breaker.on_failure()
+    assert breaker.allow()
+
+
+def test_release_gives_back_the_half_open_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker('gemini', failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.on_failure()
+    clock.now = 5
+    assert breaker.allow() and not breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN and breaker.allow()
+
+
+@pytest.fixture
+def down_provider(monkeypatch):
+    pytest.importorskip("PIL.Image")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    from utils import circuit_breaker, rate_limit
+    from utils.providers import StubProvider
+
+    class DownProvider(StubProvider):
+        name = 'down'
+
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+            self.on_invoke = lambda: None
+
+        def invoke(self, request, temperature):
+            self.calls += 1
+            self.on_invoke()
+            raise ConnectionError('provider unavailable')
+
+    monkeypatch.setattr(circuit_breaker, '_circuit_breakers', {})
+    monkeypatch.setattr(rate_limit, '_rate_limiters', {})
+    rate_limit.configure_rate_limiter('down', sleep=lambda seconds: None)
+    return DownProvider()
+
+
+def test_failed_calls_open_the_circuit_once_their_retries_are_exhausted(down_provider):
+    from PIL import Image
+    from utils.circuit_breaker import configure_circuit_breaker
+    breaker = configure_circuit_breaker('down', failure_threshold=2, reset_timeout=60)
+    image = Image.new('RGB', (8, 8))
+    # A single job's retries count as one failed call
+    assert down_provider.query(image, 'zero_shot', max_retries=3)['label'] is None
+    assert down_provider.calls == 4 and breaker.state == CLOSED
+    down_provider.query(image, 'chain_of_thought', max_retries=1)
+    assert breaker.state == OPEN
+    # Later jobs fail fast without calling the provider
+    with pytest.raises(CircuitOpen) as excinfo:
+        down_provider.query(image, 'zero_shot')
+    assert down_provider.calls == 6 and excinfo.value.retry_in > 0
+
+
+def test_provider_query_stops_retrying_once_the_circuit_opens(down_provider):
+    from PIL import Image
+    from utils.circuit_breaker import configure_circuit_breaker
+    breaker = configure_circuit_breaker('down', failure_threshold=1, reset_timeout=60)
+    # Another job's failure opens the circuit while this one is between retries
+    down_provider.on_invoke = breaker.on_failure
+    with pytest.raises(CircuitOpen):
+        down_provider.query(Image.new('RGB', (8, 8)), 'zero_shot', max_retries=5)
+    assert down_provider.calls == 1
+
+
+def test_probe_is_released_when_the_request_cannot_be_built(down_provider, monkeypatch):
+    from PIL import Image
+    from utils.circuit_breaker import configure_circuit_breaker
+    clock = FakeClock()
+    breaker = configure_circuit_breaker('down', failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.on_failure()
+    clock.now = 5
+
+    def broken(*args, **kwargs):
+        raise OSError('cannot encode image')
+    monkeypatch.setattr(down_provider, 'build_request', broken)
+    assert down_provider.query(Image.new('RGB', (8, 8)), 'zero_shot', max_retries=1)['label'] is None
+    # The circuit is still half-open and its probe is free for the next job
+    assert breaker.state == HALF_OPEN and breaker.allow()
+
+
+def test_failed_probe_reopens_the_circuit_without_retrying(down_provider):
+    from PIL import Image
+    from utils.circuit_breaker import configure_circuit_breaker
+    clock = FakeClock()
+    breaker = configure_circuit_breaker('down', failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.on_failure()
+    clock.now = 5
+    with pytest.raises(CircuitOpen):
+        down_provider.query(Image.new('RGB', (8, 8)), 'zero_shot', max_retries=3)
+    # One probe attempt, then the circuit is open for another cooldown
+    assert down_provider.calls == 1 and breaker.state == OPEN and breaker.retry_in() == pytest.approx(5)
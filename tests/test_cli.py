@@ -0,0 +1,93 @@
+import os
+import csv
+import sys
+import json
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("rich")
+pytest.importorskip("openai")
+pytest.importorskip("google.generativeai")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import main
+from utils.providers import get_provider
+
+
+def fake_query(image, prompt_type, max_retries=3, temperature=0.0, few_shot_examples=None, response_cache=None):
+    return {'label': 'فرح', 'reasoning': 'سبب' if prompt_type == 'chain_of_thought' else None, 'request_json': '[]'}
+
+
+def test_config_file_supplies_defaults_and_flags_override(tmp_path):
+    config = tmp_path / 'run.json'
+    config.write_text(json.dumps({'temperature': 0.2, 'models': ['gemini'], 'concurrency': {'gemini': 3}}))
+
+    args = main.parse_args(['--config', str(config), '--temperature', '0.5'])
+    assert args.temperature == 0.5
+    assert args.models == ['gemini']
+    assert main.parse_model_limits(args.concurrency) == {'gemini': 3}
+
+
+def test_parse_model_limits_accepts_global_and_per_model_limits():
+    assert main.parse_model_limits(['2', 'gemini=6']) == {'gpt4o': 2, 'gemini': 6}
+
+
+def test_unknown_config_key_is_rejected(tmp_path):
+    config = tmp_path / 'run.json'
+    config.write_text(json.dumps({'temprature': 0.2}))
+    with pytest.raises(SystemExit):
+        main.parse_args(['--config', str(config)])
+
+
+def test_headless_quiet_run_writes_selected_columns(tmp_path, monkeypatch):
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    for name in ('a.png', 'b.png'):
+        Image.new('RGB', (16, 16), 'white').save(images_dir / name)
+    monkeypatch.setattr(get_provider('gpt4o'), 'query', fake_query)
+    monkeypatch.setattr(get_provider('gemini'), 'query', fake_query)
+    monkeypatch.setattr(main, 'get_temperature_from_user', lambda: pytest.fail('must not prompt'))
+    output = tmp_path / 'out.csv'
+
+    main.main(['--temperature', '0', '--images-dir', str(images_dir), '--models', 'gpt4o',
+               '--prompt-types', 'zero_shot', 'chain_of_thought', '--output', str(output),
+               '--no-response-cache', '--quiet'])
+
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row['image_name'] for row in rows) == ['a.png', 'b.png']
+    for row in rows:
+        assert row['gpt4o_zero_shot'] == 'سعادة'
+        assert row['gpt4o_cot_reasoning'] == 'سبب'
+        # Only the configured models and prompt types get columns
+        assert 'gpt4o_few_shot' not in row
+        assert 'gemini_zero_shot' not in row
+
+
+def test_resume_retries_failed_cells_of_written_images(tmp_path, monkeypatch):
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    for name in ('a.png', 'b.png'):
+        Image.new('RGB', (16, 16), 'white').save(images_dir / name)
+    output = tmp_path / 'out.csv'
+    argv = ['--temperature', '0', '--images-dir', str(images_dir), '--models', 'stub', '--prompt-types', 'zero_shot',
+            'chain_of_thought', '--no-response-cache', '--quiet']
+    calls, failing = [], [('a.png', 'zero_shot')]
+
+    def flaky_query(image, prompt_type, **kwargs):
+        calls.append((os.path.basename(image.filename), prompt_type))
+        if calls[-1] in failing:
+            return {'label': None, 'reasoning': None, 'request_json': None}
+        return fake_query(image, prompt_type)
+    monkeypatch.setattr(get_provider('stub'), 'query', flaky_query)
+    main.main(argv + ['--output', str(output)])
+    calls.clear()
+    failing.clear()
+    main.main(argv + ['--resume', str(output)])
+
+    # Only the failed cell is asked again, and its image's row is replaced
+    assert calls == [('a.png', 'zero_shot')]
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = {row['image_name']: row for row in csv.DictReader(f)}
+    assert len(rows) == 2 and rows['a.png']['stub_zero_shot'] == 'سعادة' and rows['a.png']['stub_cot'] == 'سعادة'
@@ -0,0 +1,48 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("openai")
+pytest.importorskip("google.generativeai")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils import clients, providers, rate_limit
+from utils.fake_llm_server import start_fake_server
+
+
+@pytest.fixture
+def fake_openai_endpoint(monkeypatch):
+    server, base_url = start_fake_server()
+    monkeypatch.setenv('OPENAI_BASE_URL', base_url)
+    monkeypatch.setattr(clients, 'OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(rate_limit, '_rate_limiters', {})
+    clients.configure_clients(pool_size=2, timeout=5)
+    yield server
+    clients.close_clients()
+    clients.configure_clients(pool_size=clients.DEFAULT_POOL_SIZE, timeout=clients.DEFAULT_TIMEOUT)
+    server.shutdown()
+
+
+def test_client_is_created_once_and_rebuilt_on_reconfigure(fake_openai_endpoint):
+    client = clients.get_openai_client()
+    assert clients.get_openai_client() is client
+    assert client.max_retries == 0
+    assert client.timeout.read == 5
+    clients.configure_clients(timeout=7)
+    rebuilt = clients.get_openai_client()
+    assert rebuilt is not client
+    assert rebuilt.timeout.read == 7
+
+
+def test_concurrent_calls_reuse_pooled_connections(fake_openai_endpoint):
+    images = [Image.new('RGB', (16, 16), (i * 20, 0, 0)) for i in range(8)]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(lambda img: providers.query_gpt4o(img, None, 'zero_shot', max_retries=0), images))
+
+    assert all(result['label'] for result in results)
+    assert fake_openai_endpoint.state.requests == 8
+    # Eight calls over at most one keep-alive connection per worker
+    assert len(fake_openai_endpoint.state.connections) <= 2
@@ -0,0 +1,104 @@
+import os
+import csv
+import sys
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.dedup import average_hash, difference_hash, HashIndex, NearDuplicateFilter
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def page(seed, size=(320, 240)):
+    """A smooth random 'page': upsampled low-resolution noise."""
+    rng = np.random.default_rng(seed)
+    small = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8))
+    return small.resize(size, Image.Resampling.BICUBIC)
+
+
+def reexport(image, tmp_path, name):
+    """The same page scaled down a little and saved as a JPEG."""
+    path = tmp_path / name
+    image.resize((300, 225), Image.Resampling.LANCZOS).save(path, quality=85)
+    return Image.open(path)
+
+
+@pytest.mark.parametrize('hash_image', [difference_hash, average_hash])
+def test_reexported_pages_hash_close_and_other_pages_far(tmp_path, hash_image):
+    original = page(1)
+    copy = reexport(original, tmp_path, 'copy.jpg')
+    assert bin(hash_image(original) ^ hash_image(copy)).count('1') <= 4
+    others = [bin(hash_image(original) ^ hash_image(page(seed))).count('1') for seed in range(2, 12)]
+    assert min(others) > 8
+
+
+def test_index_lookup_matches_a_linear_scan():
+    rng = random.Random(0)
+    index = HashIndex(threshold=5)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    for key, value in enumerate(hashes):
+        index.add(value, key)
+    for _ in range(300):
+        value = rng.choice(hashes)
+        for bit in rng.sample(range(64), rng.randint(0, 7)):
+            value ^= 1 << bit
+        distances = [bin(value ^ other).count('1') for other in hashes]
+        best = min(range(len(hashes)), key=distances.__getitem__)
+        expected = (best, distances[best]) if distances[best] <= 5 else None
+        assert index.nearest(value) == expected
+
+
+def test_filter_holds_back_duplicates_until_their_canonical_image_is_annotated(tmp_path):
+    original = page(1)
+    stream = [('a.png', original), ('b.png', page(2)), ('a copy.jpg', reexport(original, tmp_path, 'copy.jpg'))]
+    dedup = NearDuplicateFilter(threshold=4)
+    assert [path for path, _ in dedup.filter(stream)] == ['a.png', 'b.png']
+    assert dedup.pop_ready() == []
+    dedup.resolve('a.png', {'labels': 'a'})
+    (path, canonical, distance, results), = dedup.pop_ready()
+    assert (path, canonical, results) == ('a copy.jpg', 'a.png', {'labels': 'a'})
+
+    # A duplicate seen after its canonical image finished is ready at once
+    list(dedup.filter([('a again.png', page(1))]))
+    assert [ready[0] for ready in dedup.pop_ready()] == ['a again.png']
+
+
+def test_run_with_dedup_lists_every_file_and_annotates_each_page_once(tmp_path):
+    pytest.importorskip("rich")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    import main
+    from utils.metrics import get_metrics
+
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    page(1).save(images_dir / 'book_page_1.png')
+    reexport(page(1), images_dir, 'book_page_1 (1).jpg')
+    page(2).save(images_dir / 'book_page_2.png')
+    output = tmp_path / 'out.csv'
+    main.main(['--temperature', '0', '--images-dir', str(images_dir), '--models', 'stub', '--output', str(output),
+               '--no-response-cache', '--quiet', '--few-shot-dir', str(images_dir), '--prompt-types', 'zero_shot',
+               '--dedup-threshold', '4'])
+
+    rows = {row['image_name']: row for row in read_csv(output)}
+    assert sorted(rows) == ['book_page_1 (1).jpg', 'book_page_1.png', 'book_page_2.png']
+    assert rows['book_page_1 (1).jpg']['stub_zero_shot'] == rows['book_page_1.png']['stub_zero_shot']
+    duplicate, = read_csv(tmp_path / 'out.duplicates.csv')
+    # Images are streamed in sorted order, so the re-export comes first and is the canonical image
+    assert (duplicate['image_name'], duplicate['duplicate_of']) == ('book_page_1.png', 'book_page_1 (1).jpg')
+    assert get_metrics().call_summary()['stub']['calls'] == 2
+
+
+def test_duplicates_sidecar_is_never_resumed_as_a_run(tmp_path):
+    from utils.checkpoint import latest_run
+    from utils.dedup import append_duplicates
+    (tmp_path / 'results_20240610_153045.csv').write_text('image_name\n')
+    append_duplicates(str(tmp_path / 'results_20240610_153045.duplicates.csv'), [('b.png', 'a.png', 2)])
+    assert latest_run(str(tmp_path)) == str(tmp_path / 'results_20240610_153045.csv')
@@ -0,0 +1,88 @@
+import io
+import os
+import sys
+import random
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.encoding import (PROFILES, EncodingProfile, parse_encoding_profile, render_for_profile, encode_image_payload,
+                            openai_image_part, gemini_image_part, openai_image_tokens, get_encoding_profile,
+                            set_encoding_profile)
+from utils.image_cache import ImagePayloadCache, get_payload_cache, set_payload_cache
+from utils.image_utils import encode_image_to_bytes
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    previous_cache, previous_profile = get_payload_cache(), get_encoding_profile()
+    set_payload_cache(ImagePayloadCache())
+    yield
+    set_payload_cache(previous_cache)
+    set_encoding_profile(previous_profile)
+
+
+def noisy_image(size=(1200, 900)):
+    rng = random.Random(0)
+    return Image.frombytes('RGB', size, bytes(rng.getrandbits(8) for _ in range(size[0] * size[1] * 3)))
+
+
+def test_parse_profile_with_overrides():
+    assert parse_encoding_profile('png') == PROFILES['png']
+    profile = parse_encoding_profile('jpeg:quality=70,max_size=768,detail=low')
+    assert profile == EncodingProfile('JPEG', 768, quality=70, detail='low')
+    for bad in ('gif', 'jpeg:colour=1', 'jpeg:detail=medium', 'png:format=BMP'):
+        with pytest.raises(ValueError):
+            parse_encoding_profile(bad)
+
+
+def test_default_profile_matches_the_original_png_payload():
+    image = Image.new('RGB', (1500, 1000), (200, 10, 10))
+    assert encode_image_payload(image) == encode_image_to_bytes(image, format='PNG', max_size=1024)
+    # Same cache entry: the second call is a hit
+    assert get_payload_cache().stats()['misses'] == 1
+
+
+def test_lossy_profiles_encode_rgba_and_set_mime_and_detail():
+    image = Image.new('RGBA', (64, 64), (0, 0, 255, 128))
+    profile = parse_encoding_profile('jpeg')
+    assert Image.open(io.BytesIO(encode_image_payload(image, profile))).format == 'JPEG'
+
+    set_encoding_profile(parse_encoding_profile('webp:detail=low'))
+    part = openai_image_part(image)
+    assert part['image_url']['url'].startswith('data:image/webp;base64,')
+    assert part['image_url']['detail'] == 'low'
+    assert gemini_image_part(image)['inline_data']['mime_type'] == 'image/webp'
+    # The PNG profile leaves detail to the API default
+    assert 'detail' not in openai_image_part(image, PROFILES['png'])['image_url']
+
+
+def test_auto_profile_keeps_payloads_under_the_byte_budget():
+    image = noisy_image()
+    unbounded = render_for_profile(image, parse_encoding_profile('jpeg:quality=90'))
+    budget = len(unbounded) // 4
+    payload = render_for_profile(image, parse_encoding_profile(f'auto:max_bytes={budget}'))
+    assert len(payload) <= budget
+    assert Image.open(io.BytesIO(payload)).format == 'JPEG'
+
+
+def test_response_cache_keys_and_request_text_follow_the_profile():
+    model_utils = pytest.importorskip("utils.model_utils")
+    image = Image.new('RGB', (32, 32))
+    png_hashes = model_utils.request_image_hashes(image, 'zero_shot')
+    png_text = model_utils.prompt_text('gpt-4o', 'zero_shot')
+    set_encoding_profile(parse_encoding_profile('low'))
+    assert model_utils.request_image_hashes(image, 'zero_shot') != png_hashes
+    assert '"detail": "low"' in model_utils.prompt_text('gpt-4o', 'zero_shot')
+    assert 'image/jpeg' in model_utils.prompt_text('gemini-1.5-pro', 'zero_shot')
+    set_encoding_profile(PROFILES['png'])
+    assert model_utils.prompt_text('gpt-4o', 'zero_shot') == png_text
+
+
+def test_openai_image_token_estimate():
+    assert openai_image_tokens(4000, 4000, 'low') == 85
+    # 1024x1024 is scaled to 768x768: four tiles
+    assert openai_image_tokens(1024, 1024) == 85 + 170 * 4
+    assert openai_image_tokens(512, 512) == 85 + 170
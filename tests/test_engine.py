@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.engine import run_annotation_jobs, PROMPT_TYPES
+
+
+class FakeProvider:
+    """Local stand-in for a model API: sleeps, records concurrency and echoes the job."""
+
+    def __init__(self, name, delay=0.02):
+        self.name = name
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+
+    def __call__(self, image, prompt_type):
+        with self.lock:
+            self.active += 1
+            self.calls += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return {'label': f"{self.name}:{image}:{prompt_type}", 'reasoning': None, 'request_json': None}
+
+
+def test_every_job_runs_and_results_map_back_to_images():
+    images = [(f"img_{i}.png", f"img{i}") for i in range(5)]
+    providers = {'gpt4o': FakeProvider('gpt4o'), 'gemini': FakeProvider('gemini')}
+    finished = list(run_annotation_jobs(images, providers))
+
+    assert sorted(index for index, _, _ in finished) == [1, 2, 3, 4, 5]
+    for image_index, image_path, results in finished:
+        assert image_path == f"img_{image_index - 1}.png"
+        assert len(results) == len(providers) * len(PROMPT_TYPES)
+        for (model, prompt_type), result in results.items():
+            assert result['label'] == f"{model}:img{image_index - 1}:{prompt_type}"
+    assert providers['gpt4o'].calls == providers['gemini'].calls == 15
+
+
+def test_per_provider_concurrency_limits_are_respected():
+    images = [(f"img_{i}.png", i) for i in range(6)]
+    providers = {'gpt4o': FakeProvider('gpt4o'), 'gemini': FakeProvider('gemini')}
+    list(run_annotation_jobs(images, providers, concurrency={'gpt4o': 2, 'gemini': 5}))
+
+    assert providers['gpt4o'].max_active <= 2
+    assert 2 < providers['gemini'].max_active <= 5
+
+
+def test_concurrent_run_is_faster_than_serial():
+    images = [(f"img_{i}.png", i) for i in range(4)]
+    providers = {'gpt4o': FakeProvider('gpt4o', 0.05), 'gemini': FakeProvider('gemini', 0.05)}
+    start = time.time()
+    list(run_annotation_jobs(images, providers, concurrency={'gpt4o': 6, 'gemini': 6}))
+    serial_time = 0.05 * 2 * len(PROMPT_TYPES) * len(images)
+    assert time.time() - start < serial_time / 3
+
+
+def test_failing_job_yields_empty_result_and_on_result_is_called():
+    def broken(image, prompt_type):
+        raise RuntimeError("boom")
+
+    seen = []
+    finished = list(run_annotation_jobs([("a.png", 0)], {'gpt4o': broken},
+                                        on_result=lambda job, result: seen.append(job)))
+    assert len(seen) == len(PROMPT_TYPES)
+    assert all(result['label'] is None for result in finished[0][2].values())
+
+
+def test_jobs_of_an_open_circuit_are_deferred_and_rerun():
+    from utils.circuit_breaker import CircuitOpen
+    lock = threading.Lock()
+    outage = {'rejected': 0}
+
+    def flaky(image, prompt_type):
+        # Unavailable for the first four calls, then healthy
+        with lock:
+            if outage['rejected'] < 4:
+                outage['rejected'] += 1
+                raise CircuitOpen('gemini', 0.05)
+        return {'label': f"gemini:{image}:{prompt_type}", 'reasoning': None, 'request_json': None}
+
+    images = [(f"img_{i}.png", i) for i in range(3)]
+    healthy = FakeProvider('gpt4o', 0.0)
+    finished = list(run_annotation_jobs(images, {'gpt4o': healthy, 'gemini': flaky}))
+    assert len(finished) == 3
+    for _, _, results in finished:
+        assert all(result['label'] for result in results.values())
+    assert healthy.calls == 9
+
+
+def test_jobs_fail_after_too_many_deferrals():
+    from utils.circuit_breaker import CircuitOpen
+
+    def down(image, prompt_type):
+        raise CircuitOpen('gemini', 0.01)
+
+    checkpointed = []
+    finished = list(run_annotation_jobs([("a.png", 0)], {'gemini': down}, max_deferrals=2,
+                                        on_result=lambda job, result: checkpointed.append(result)))
+    assert all(result['label'] is None for result in finished[0][2].values())
+    # Abandoned jobs still reach the checkpoint as failed cells, which --resume retries
+    assert len(checkpointed) == 3 and all(result['label'] is None for result in checkpointed)
+
+
+def test_images_are_closed_once_their_jobs_are_done():
+    class Handle:
+        def __init__(self, name):
+            self.name = name
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+        def __str__(self):
+            return self.name
+
+    handles = [Handle(f"img{i}") for i in range(4)]
+    completed = {'img_0.png': {(model, prompt_type): {'label': 'old'} for model in ('gpt4o', 'gemini')
+                               for prompt_type in PROMPT_TYPES}}
+    providers = {'gpt4o': FakeProvider('gpt4o'), 'gemini': FakeProvider('gemini')}
+    for _, image_path, _ in run_annotation_jobs([(f"img_{i}.png", h) for i, h in enumerate(handles)], providers,
+                                                completed=completed):
+        assert handles[int(image_path[4])].closed
+    assert all(handle.closed for handle in handles)
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import statistics
+import urllib.error
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.fake_llm_server import start_fake_server, FakeLLMState, FAKE_LABELS
+
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.loads(response.read())
+
+
+@pytest.fixture
+def server_factory():
+    servers = []
+
+    def start(**options):
+        server, base_url = start_fake_server(**options)
+        servers.append(server)
+        return server, base_url
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_gemini_generate_content_endpoint_answers_deterministically(server_factory):
+    _, base_url = server_factory()
+    url = f"{base_url[:-len('/v1')]}/v1beta/models/gemini-1.5-pro:generateContent"
+    body = {'contents': [{'role': 'user', 'parts': [{'text': 'الخطوات: صف الصورة'}]}]}
+    first, second = post(url, body), post(url, body)
+    text = first['candidates'][0]['content']['parts'][0]['text']
+    assert first == second
+    assert text.rsplit('الشعور:', 1)[1].strip() in FAKE_LABELS
+
+
+def test_throttled_and_failed_calls_use_provider_error_formats(server_factory):
+    server, base_url = server_factory(throttle_rate=1.0, retry_after=7)
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        post(f"{base_url}/chat/completions", {'model': 'gpt-4o', 'messages': []})
+    assert excinfo.value.code == 429
+    assert excinfo.value.headers['Retry-After'] == '7'
+    assert json.loads(excinfo.value.read())['error']['type'] == 'rate_limit_error'
+
+    server, base_url = server_factory(error_rate=1.0)
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        post(f"{base_url[:-len('/v1')]}/v1beta/models/gemini-1.5-pro:generateContent", {'contents': []})
+    assert excinfo.value.code == 500
+    assert json.loads(excinfo.value.read())['error']['status'] == 'INTERNAL'
+    assert server.state.calls == {'ok': 0, 'throttled': 0, 'errors': 1}
+
+
+def test_latency_distributions_keep_the_configured_mean():
+    for dist in ('fixed', 'uniform', 'lognormal'):
+        state = FakeLLMState(latency_ms=100, latency_dist=dist, seed=1)
+        samples = [state.sample_latency() for _ in range(5000)]
+        assert statistics.mean(samples) == pytest.approx(0.1, rel=0.05)
+    heavy = FakeLLMState(latency_ms=100, latency_dist='lognormal', latency_sigma=1.0)
+    samples = sorted(heavy.sample_latency() for _ in range(5000))
+    # Long tail: p99 well above the mean
+    assert samples[int(0.99 * len(samples))] > 0.4
+
+
+def test_gemini_provider_talks_to_the_fake_server(server_factory, monkeypatch):
+    pytest.importorskip("google.generativeai")
+    Image = pytest.importorskip("PIL.Image")
+    from utils import clients, rate_limit
+    from utils.providers import get_provider
+
+    _, base_url = server_factory()
+    monkeypatch.setenv('GEMINI_BASE_URL', base_url[:-len('/v1')])
+    monkeypatch.setattr(clients, 'GOOGLE_API_KEY', 'test')
+    monkeypatch.setattr(rate_limit, '_rate_limiters', {})
+    clients.close_clients()
+    try:
+        result = get_provider('gemini').query(Image.new('RGB', (16, 16)), 'zero_shot', max_retries=0)
+    finally:
+        clients.close_clients()
+    assert result['label'] in FAKE_LABELS
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.hedging import HedgePolicy, DeadlineExceeded
+from utils.metrics import LatencyStats
+
+
+def slow_then_fast(slow=1.0):
+    """
+    fn(hedge) whose primary attempt stalls and whose hedge answers at once.
+    """
+    def fn(hedge):
+        if not hedge:
+            time.sleep(slow)
+            return 'primary'
+        return 'hedge'
+    return fn
+
+
+def test_hedge_wins_when_the_primary_stalls():
+    policy = HedgePolicy(percentile=0.9, budget=1.0)
+    start = time.monotonic()
+    result, hedged, hedge_won = policy.call(slow_then_fast(), delay=0.05)
+    assert (result, hedged, hedge_won) == ('hedge', True, True)
+    assert time.monotonic() - start < 0.5
+    assert policy.stats() == {'primaries': 1, 'hedges': 1, 'hedge_wins': 1, 'deadlines': 0}
+
+
+def test_fast_primary_is_never_hedged():
+    policy = HedgePolicy(percentile=0.9, budget=1.0)
+    calls = []
+    result, hedged, _ = policy.call(lambda hedge: calls.append(hedge) or 'ok', delay=0.5)
+    assert result == 'ok' and not hedged and calls == [False]
+
+
+def test_budget_caps_hedges_as_a_fraction_of_calls():
+    policy = HedgePolicy(percentile=0.9, budget=0.25)
+    for _ in range(8):
+        policy.call(slow_then_fast(0.1), delay=0.01)
+    assert policy.stats()['hedges'] == 2
+
+
+def test_hedge_is_skipped_without_rate_headroom():
+    policy = HedgePolicy(percentile=0.9, budget=1.0)
+    result, hedged, _ = policy.call(slow_then_fast(0.1), delay=0.01, allow_hedge=lambda: False)
+    assert result == 'primary' and not hedged
+    assert policy.stats()['hedges'] == 0
+
+
+def test_rate_headroom_is_not_taken_when_the_budget_refuses():
+    policy = HedgePolicy(percentile=0.9, budget=0.0)
+    asked = []
+    result, hedged, _ = policy.call(slow_then_fast(0.1), delay=0.01, allow_hedge=lambda: asked.append(1) or True)
+    assert result == 'primary' and not hedged and asked == []
+
+
+def test_failed_hedge_falls_back_to_the_primary():
+    policy = HedgePolicy(percentile=0.9, budget=1.0)
+
+    def fn(hedge):
+        if hedge:
+            raise RuntimeError('hedge failed')
+        time.sleep(0.1)
+        return 'primary'
+    assert policy.call(fn, delay=0.01)[0] == 'primary'
+
+
+def test_deadline_abandons_a_stalled_call():
+    policy = HedgePolicy(deadline=0.1)
+    released = threading.Event()
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        policy.call(lambda hedge: released.wait(5))
+    assert time.monotonic() - start < 1.0
+    assert policy.stats()['deadlines'] == 1
+    released.set()
+
+
+def test_abandoned_attempts_hold_a_concurrency_slot_until_they_end():
+    from utils.rate_limit import ProviderRateLimiter
+    limiter = ProviderRateLimiter(max_concurrency=1)
+    policy = HedgePolicy(deadline=0.05)
+    released = threading.Event()
+    with pytest.raises(DeadlineExceeded):
+        with limiter.request():
+            policy.call(lambda hedge: released.wait(5), on_abandon=limiter.hold_until_done)
+    # The stalled attempt still runs, so the next call has to wait for it
+    assert limiter.concurrency.in_flight == 1
+    released.set()
+    deadline = time.monotonic() + 1.0
+    while limiter.concurrency.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert limiter.concurrency.in_flight == 0
+
+    # A losing hedge holds one too
+    policy = HedgePolicy(percentile=0.9, budget=1.0)
+    result, hedged, hedge_won = policy.call(slow_then_fast(0.2), delay=0.01, on_abandon=limiter.hold_until_done)
+    assert hedge_won and limiter.concurrency.in_flight == 1
+
+
+def test_hedge_delay_needs_enough_samples():
+    latency = LatencyStats()
+    policy = HedgePolicy(percentile=0.5, min_samples=4, min_delay=0.0)
+    for seconds in (0.1, 0.2, 0.3):
+        latency.record(seconds)
+    assert policy.hedge_delay(latency) is None
+    latency.record(0.4)
+    assert policy.hedge_delay(latency) == pytest.approx(0.3)
+    assert HedgePolicy().hedge_delay(latency) is None
+
+
+def test_hedging_cuts_the_tail_against_outliers_on_the_fake_server(monkeypatch):
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    Image = pytest.importorskip("PIL.Image")
+    from utils import clients, rate_limit, hedging
+    from utils.fake_llm_server import start_fake_server
+    from utils.providers import GPT4oProvider
+
+    server, base_url = start_fake_server(latency_ms=20, latency_dist='fixed', outlier_rate=0.15, outlier_ms=3000, seed=3)
+    monkeypatch.setenv('OPENAI_BASE_URL', base_url)
+    monkeypatch.setattr(clients, 'OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(rate_limit, '_rate_limiters', {})
+    monkeypatch.setattr(hedging, '_hedge_policies', {})
+    hedging.configure_hedging('gpt4o', percentile=0.8, budget=1.0, min_samples=5)
+    clients.close_clients()
+    provider = GPT4oProvider()
+    image = Image.new('RGB', (16, 16))
+    try:
+        # Latency history of earlier, normal calls
+        for _ in range(5):
+            provider.latency.record(0.1)
+        start = time.monotonic()
+        durations = []
+        for _ in range(20):
+            call_start = time.monotonic()
+            assert provider.query(image, 'zero_shot', max_retries=0)['label']
+            durations.append(time.monotonic() - call_start)
+    finally:
+        clients.close_clients()
+        server.shutdown()
+    stats = hedging.get_hedge_policy('gpt4o').stats()
+    assert stats['hedge_wins'] >= 1
+    # Every outlier was cut short by its hedge
+    assert max(durations) < 1.0
+    assert time.monotonic() - start < 5.0
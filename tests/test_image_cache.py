@@ -0,0 +1,80 @@
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.image_cache import ImagePayloadCache, set_payload_cache, get_payload_cache
+from utils.image_utils import encode_image_to_bytes, encode_image_to_base64
+
+
+@pytest.fixture
+def fresh_cache():
+    previous = get_payload_cache()
+    cache = ImagePayloadCache()
+    set_payload_cache(cache)
+    yield cache
+    set_payload_cache(previous)
+
+
+def test_same_file_is_encoded_once(tmp_path, fresh_cache):
+    path = tmp_path / "page.png"
+    Image.new('RGB', (2048, 1024), 'red').save(path)
+
+    first = encode_image_to_bytes(Image.open(path))
+    second = encode_image_to_bytes(Image.open(path))
+    encode_image_to_base64(Image.open(path))
+
+    assert first == second
+    assert Image.open(io.BytesIO(first)).size == (1024, 512)
+    assert fresh_cache.stats()['misses'] == 1
+    assert fresh_cache.stats()['hits'] == 2
+
+
+def test_encoding_parameters_are_part_of_the_key(fresh_cache):
+    image = Image.new('RGB', (64, 64), 'blue')
+    encode_image_to_bytes(image, format='PNG')
+    encode_image_to_bytes(image, format='JPEG')
+    encode_image_to_bytes(image, format='PNG', max_size=32)
+    assert fresh_cache.stats()['misses'] == 3
+
+
+def test_lru_eviction_respects_byte_budget():
+    cache = ImagePayloadCache(max_bytes=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    cache.get('a')
+    cache.put('c', b'12345')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'12345'
+    assert cache.stats()['bytes'] == 10
+
+
+def test_disk_store_survives_a_new_cache(tmp_path):
+    ImagePayloadCache(disk_dir=str(tmp_path)).put('k' * 64, b'payload')
+    reloaded = ImagePayloadCache(disk_dir=str(tmp_path))
+    assert reloaded.get('k' * 64) == b'payload'
+    assert reloaded.stats()['disk_hits'] == 1
+
+
+def test_concurrent_misses_build_payload_once():
+    cache = ImagePayloadCache()
+    calls = []
+    gate = threading.Event()
+
+    def factory():
+        calls.append(1)
+        gate.wait(1)
+        return b'data'
+
+    threads = [threading.Thread(target=cache.get_or_create, args=('key', factory)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
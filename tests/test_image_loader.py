@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.image_utils import list_image_paths, iter_images
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    for name in ('b.png', 'a.jpg', 'c.PNG', 'notes.txt'):
+        if name.endswith('.txt'):
+            (tmp_path / name).write_text('not an image')
+        else:
+            Image.new('RGB', (8, 8)).save(tmp_path / name, format='JPEG' if name.endswith('.jpg') else 'PNG')
+    (tmp_path / 'sub').mkdir()
+    Image.new('RGB', (8, 8)).save(tmp_path / 'sub' / 'd.png')
+    (tmp_path / 'broken.png').write_bytes(b'not really a png')
+    return tmp_path
+
+
+def test_listing_is_sorted_and_optionally_recursive(image_dir):
+    names = [os.path.relpath(p, image_dir) for p in list_image_paths(str(image_dir))]
+    assert names == ['a.jpg', 'b.png', 'broken.png', 'c.PNG']
+    recursive = [os.path.relpath(p, image_dir) for p in list_image_paths(str(image_dir), recursive=True)]
+    assert recursive == names + [os.path.join('sub', 'd.png')]
+
+
+def test_iter_images_decodes_in_order_and_skips_unreadable(image_dir):
+    loaded = list(iter_images(list_image_paths(str(image_dir))))
+    assert [os.path.basename(p) for p, _ in loaded] == ['a.jpg', 'b.png', 'c.PNG']
+    for _, img in loaded:
+        # Pixel data is decoded and the file handle released
+        assert img.size == (8, 8)
+        assert getattr(img, 'fp', None) is None
+
+
+def test_prefetch_bounds_how_far_the_loader_runs_ahead(tmp_path):
+    for i in range(10):
+        Image.new('RGB', (4, 4)).save(tmp_path / f"{i:02d}.png")
+    loaded = []
+    lock = threading.Lock()
+
+    def preprocess(img):
+        with lock:
+            loaded.append(img)
+        return img
+
+    images = iter_images(list_image_paths(str(tmp_path)), prefetch=2, preprocess=preprocess)
+    next(images)
+    time.sleep(0.2)
+    # One consumed, two queued and at most one more waiting to be queued
+    assert len(loaded) <= 4
+    images.close()
+    assert len(loaded) <= 4
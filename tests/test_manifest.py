@@ -0,0 +1,104 @@
+import os
+import csv
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import utils.manifest as manifest_module
+from utils.manifest import Manifest
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def files(directory):
+    return [(str(directory / name), name) for name in sorted(os.listdir(directory))]
+
+
+def test_only_new_and_changed_files_are_reported(tmp_path, monkeypatch):
+    images = tmp_path / 'images'
+    images.mkdir()
+    (images / 'a.png').write_bytes(b'a')
+    (images / 'b.png').write_bytes(b'b')
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+    assert [name for _, name in manifest.changes(files(images))] == ['a.png', 'b.png']
+    manifest.mark_done('a.png')
+    manifest.mark_done('b.png')
+    manifest.close()
+
+    hashed = []
+    real_hash = manifest_module.file_content_hash
+    monkeypatch.setattr(manifest_module, 'file_content_hash', lambda path: hashed.append(path) or real_hash(path))
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+    assert len(manifest) == 2
+    # Unchanged files are skipped on their size and mtime alone
+    assert manifest.changes(files(images)) == [] and hashed == []
+
+    stat = os.stat(images / 'a.png')
+    os.utime(images / 'a.png', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))   # touched, same content
+    (images / 'b.png').write_bytes(b'bb')
+    (images / 'c.png').write_bytes(b'c')
+    assert [name for _, name in manifest.changes(files(images))] == ['b.png', 'c.png']
+    assert len(hashed) == 3
+    manifest.mark_done('c.png')
+
+    # b.png was not marked done, so it is reported again; a.png's new mtime was remembered
+    hashed.clear()
+    assert [name for _, name in manifest.changes(files(images))] == ['b.png']
+    assert [os.path.basename(path) for path in hashed] == ['b.png']
+    manifest.close()
+
+
+def test_watch_mode_annotates_only_the_changes(tmp_path, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("rich")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    import main
+
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    Image.new('RGB', (16, 16), 'red').save(images_dir / 'a.png')
+    Image.new('RGB', (16, 16), 'blue').save(images_dir / 'b.png')
+    output = tmp_path / 'rolling.csv'
+
+    def run(output, *extra):
+        main.main(['--temperature', '0', '--images-dir', str(images_dir), '--models', 'stub', '--output', str(output),
+                   '--no-response-cache', '--quiet', '--few-shot-dir', str(images_dir), '--prompt-types', 'zero_shot',
+                   *extra])
+
+    real_sleep = time.sleep
+
+    def sleep(seconds):
+        if seconds != 0.125:
+            return real_sleep(seconds)
+        # New pages arrive between two scans, and one page is replaced
+        Image.new('RGB', (16, 16), 'green').save(images_dir / 'c.png')
+        Image.new('RGB', (24, 24), 'red').save(images_dir / 'a.png')
+    monkeypatch.setattr(main.time, 'sleep', sleep)
+    run(output, '--watch', '0.125', '--watch-cycles', '2')
+
+    # Rows are written in the order images finish, so compare each pass as a set
+    names = [row['image_name'] for row in read_csv(output)]
+    assert sorted(names[:2]) == ['a.png', 'b.png'] and sorted(names[2:]) == ['a.png', 'c.png']
+    manifest = tmp_path / 'rolling.manifest.sqlite'
+    assert manifest.exists()
+
+    # A later one-off run with the same manifest has nothing to do
+    again = tmp_path / 'again.csv'
+    run(again, '--manifest', str(manifest))
+    assert read_csv(again) == []
+
+
+def test_watch_output_is_never_the_latest_run(tmp_path):
+    from utils.checkpoint import latest_run, run_paths
+    watch_csv, _ = run_paths('watch', results_dir=str(tmp_path))
+    assert os.path.basename(watch_csv) == 'results_watch.csv'
+    for path in (tmp_path / 'results_20240610_153045.csv', watch_csv):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('image_name\n')
+    assert latest_run(str(tmp_path)) == str(tmp_path / 'results_20240610_153045.csv')
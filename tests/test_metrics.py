@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.metrics import Metrics, request_size, start_metrics_server, set_metrics, get_metrics
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    previous = get_metrics()
+    metrics = Metrics(trace_path=str(tmp_path / 'trace.jsonl'))
+    set_metrics(metrics)
+    yield metrics
+    metrics.close()
+    set_metrics(previous)
+
+
+def read_trace(tmp_path):
+    with open(tmp_path / 'trace.jsonl', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_stages_are_aggregated_in_pipeline_order(metrics):
+    metrics.record_stage('write', 0.01)
+    with metrics.stage('load', image='a.png'):
+        pass
+    metrics.record_stage('network', 0.2, model='gpt4o')
+    metrics.record_stage('network', 0.4, model='gpt4o')
+    summary = metrics.stage_summary()
+    assert list(summary) == ['load', 'network', 'write']
+    assert summary['network']['calls'] == 2
+    assert summary['network']['total'] == pytest.approx(0.6)
+    assert 'network' in metrics.summary_table()
+
+
+def test_trace_holds_stage_spans_and_call_records(metrics, tmp_path):
+    metrics.record_stage('parse', 0.001, model='gemini')
+    metrics.record_call('gpt4o', 'zero_shot', 'ok', attempts=2, seconds=1.5, bytes_sent=2048,
+                        prompt_tokens=900, completion_tokens=12)
+    metrics.record_call('gpt4o', 'few_shot', 'cached')
+    metrics.close()
+    stage, call, cached = read_trace(tmp_path)
+    assert stage['type'] == 'stage' and stage['stage'] == 'parse' and stage['model'] == 'gemini'
+    assert call['type'] == 'call' and call['attempts'] == 2 and call['bytes_sent'] == 2048
+    assert (call['prompt_tokens'], call['completion_tokens']) == (900, 12)
+    assert cached['status'] == 'cached'
+    counters = metrics.call_summary()['gpt4o']
+    assert counters['calls'] == 2 and counters['retries'] == 1 and counters['cached'] == 1
+    assert counters['prompt_tokens'] == 900
+
+
+def test_prometheus_endpoint_serves_the_process_metrics(metrics):
+    metrics.record_stage('encode', 0.05)
+    metrics.record_call('gemini', 'cot', 'failed', attempts=3, bytes_sent=10)
+    server = start_metrics_server(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5) as response:
+            text = response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+    assert 'annotator_stage_seconds_count{stage="encode"} 1' in text
+    assert 'annotator_failed_total{model="gemini"} 1' in text
+    assert 'annotator_attempts_total{model="gemini"} 3' in text
+
+
+def test_request_size_counts_text_and_image_bytes():
+    request = {'contents': [{'text': 'صف'}, {'inline_data': {'data': b'\x00' * 100}}]}
+    assert request_size(request) > 100 + len('صف'.encode('utf-8'))
+
+
+def test_provider_query_records_stages_and_call(metrics, tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    from utils.providers import StubProvider
+
+    result = StubProvider().query(Image.new('RGB', (8, 8)), 'zero_shot', max_retries=0)
+    assert result['label']
+    stages = metrics.stage_summary()
+    assert {'build', 'network', 'parse'} <= set(stages)
+    call = [record for record in read_trace(tmp_path) if record['type'] == 'call'][0]
+    assert call['model'] == 'stub' and call['status'] == 'ok' and call['attempts'] == 1
+    assert call['bytes_sent'] > 0
@@ -13,7 +13,9 @@ if 'PIL' not in sys.modules:
     sys.modules['PIL'] = dummy
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from utils.prompt_utils import normalize_emotion
+import random
+import re
+from utils.prompt_utils import normalize_emotion, normalize_many, EMOTION_LABELS_EN_AR, EMOTION_VARIATIONS
 
 @pytest.mark.parametrize(
     "inp,expected",
@@ -34,3 +36,40 @@ from utils.prompt_utils import normalize_emotion
 )
 def test_normalize_emotion_variations(inp, expected):
     assert normalize_emotion(inp) == expected
+
+
+def reference_normalize_emotion(text):
+    """The original, uncompiled implementation, kept as the compatibility reference."""
+    if text is None:
+        return None
+    text = re.sub(r'[^\w\s]', '', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = text.replace('أ', 'ا').replace('إ', 'ا').replace('آ', 'ا')
+    text = re.sub(r'[\u064B-\u065F\u0670]', '', text)
+    if text in EMOTION_VARIATIONS:
+        return EMOTION_VARIATIONS[text]
+    all_emotions = list(EMOTION_LABELS_EN_AR.values())
+    if text in all_emotions:
+        return text
+    for emotion in all_emotions:
+        if text.startswith(emotion[:2]):
+            return emotion
+    return text
+
+
+def test_compiled_normalizer_matches_the_reference_on_random_answers():
+    rng = random.Random(0)
+    pieces = (list(EMOTION_LABELS_EN_AR.values()) + list(EMOTION_VARIATIONS) +
+              ['الشعور:', 'ً', 'ٌ', 'ٰ', 'أ', 'إ', 'آ', '.', '!', '،', ' ', '\t', '\n', '\u00a0', '\x1c',
+               'a', 'Joy', '_', '5', '٣', 'ـ', '"', '*'])
+    answers = ['', ' ', '!!', 'س', None]
+    for _ in range(20000):
+        answers.append(''.join(rng.choice(pieces) for _ in range(rng.randint(1, 4))))
+    for answer in answers:
+        assert normalize_emotion(answer) == reference_normalize_emotion(answer), repr(answer)
+    assert normalize_many(answers) == [reference_normalize_emotion(answer) for answer in answers]
+
+
+def test_normalize_many_keeps_order_and_none():
+    assert normalize_many(['فرح', None, 'غضب.', 'فرح']) == ['سعادة', None, 'غضب', 'سعادة']
+    assert normalize_many([]) == []
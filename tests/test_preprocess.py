@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.image_cache import ImagePayloadCache, get_payload_cache, set_payload_cache
+from utils.image_utils import encode_image_to_bytes, render_payload
+from utils.preprocess import iter_prepared_images
+
+
+@pytest.fixture
+def fresh_cache():
+    previous = get_payload_cache()
+    cache = ImagePayloadCache()
+    set_payload_cache(cache)
+    yield cache
+    set_payload_cache(previous)
+
+
+def test_pool_payloads_feed_the_request_stage_cache(tmp_path, fresh_cache):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"{i}.png"
+        Image.new('RGB', (1500, 700), (i * 50, 10, 10)).save(path)
+        paths.append(str(path))
+    paths.insert(2, str(tmp_path / 'missing.png'))
+
+    prepared = list(iter_prepared_images(paths, workers=2, queue_size=2))
+
+    assert [path for path, _ in prepared] == [p for p in paths if not p.endswith('missing.png')]
+    for path, img in prepared:
+        # The builders find the worker's payload without decoding the image again
+        payload = encode_image_to_bytes(img)
+        assert payload == render_payload(Image.open(path))
+    assert fresh_cache.stats()['misses'] == 0
+    assert fresh_cache.stats()['hits'] == 5
@@ -0,0 +1,88 @@
+import os
+import csv
+import sys
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("rich")
+pytest.importorskip("openai")
+pytest.importorskip("google.generativeai")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import main
+from utils import providers
+from utils.providers import Provider, StubProvider, LatencyStats, register_provider
+
+
+class EchoProvider(Provider):
+    name = 'echo'
+    model_name = 'echo-1'
+    title = 'Echo'
+
+    def build_request(self, image, prompt_type, few_shot_examples=None):
+        return {'size': image.size}, f'echo {prompt_type}'
+
+    def invoke(self, request, temperature):
+        return 'محايد', {'prompt_tokens': 10, 'completion_tokens': 1}
+
+
+@pytest.fixture
+def echo_provider():
+    yield register_provider(EchoProvider())
+    del providers.PROVIDERS['echo']
+
+
+def test_default_schema_matches_the_original_columns():
+    assert main.build_fieldnames(['gpt4o', 'gemini'], main.PROMPT_TYPE_DISPLAY) == [
+        'image_name',
+        'gpt4o_zero_shot', 'gpt4o_few_shot', 'gpt4o_cot', 'gpt4o_cot_reasoning',
+        'gemini_zero_shot', 'gemini_few_shot', 'gemini_cot', 'gemini_cot_reasoning',
+        'gpt4o_zero_shot_request', 'gpt4o_few_shot_request', 'gpt4o_cot_request',
+        'gemini_zero_shot_request', 'gemini_few_shot_request', 'gemini_cot_request',
+        'gpt4o_zero_shot_raw', 'gpt4o_few_shot_raw', 'gpt4o_cot_raw',
+        'gemini_zero_shot_raw', 'gemini_few_shot_raw', 'gemini_cot_raw',
+        'timestamp',
+    ]
+    assert main.build_fieldnames(['stub'], ['chain_of_thought']) == [
+        'image_name', 'stub_cot', 'stub_cot_reasoning', 'stub_cot_request', 'stub_cot_raw', 'timestamp']
+
+
+def test_stub_provider_is_deterministic_and_times_its_calls():
+    stub = StubProvider()
+    image = Image.new('RGB', (32, 32), 'blue')
+    first = stub.query(image, 'chain_of_thought', max_retries=0)
+    assert first == stub.query(image, 'chain_of_thought', max_retries=0)
+    assert first['reasoning'] and first['label']
+    assert stub.latency.summary()['calls'] == 2
+
+
+def test_registered_provider_runs_end_to_end(tmp_path, echo_provider):
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    Image.new('RGB', (16, 16)).save(images_dir / 'a.png')
+    output = tmp_path / 'out.csv'
+    main.main(['--temperature', '0', '--images-dir', str(images_dir), '--models', 'echo', 'stub',
+               '--prompt-types', 'zero_shot', '--output', str(output), '--no-response-cache', '--quiet'])
+
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == ['image_name', 'echo_zero_shot', 'stub_zero_shot',
+                             'echo_zero_shot_request', 'stub_zero_shot_request',
+                             'echo_zero_shot_raw', 'stub_zero_shot_raw', 'timestamp']
+    assert rows[0]['echo_zero_shot'] == 'محايد'
+    assert rows[0]['echo_zero_shot_request'] == 'echo zero_shot'
+    assert rows[0]['stub_zero_shot']
+    assert echo_provider.latency.summary()['calls'] == 1
+
+
+def test_latency_stats_percentiles():
+    stats = LatencyStats()
+    for ms in range(1, 101):
+        stats.record(ms / 1000)
+    stats.record(5.0, error=True)
+    summary = stats.summary()
+    assert summary['calls'] == 101
+    assert summary['errors'] == 1
+    assert summary['p50'] == pytest.approx(0.051)
+    assert summary['max'] == 5.0
@@ -0,0 +1,161 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.rate_limit import (
+    TokenBucket,
+    AdaptiveConcurrency,
+    ProviderRateLimiter,
+    backoff_delay,
+    is_rate_limit_error,
+    retry_after_seconds,
+    estimate_request_tokens,
+)
+
+
+class FakeClock:
+    """Simulated monotonic clock: sleeping advances time instantly."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TooManyRequests(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__('429 Too Many Requests')
+        self.status_code = 429
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(headers=headers)
+
+
+class FakeServer:
+    """Answers like a provider that throttles the first `throttle_count` calls."""
+
+    def __init__(self, throttle_count, retry_after=None):
+        self.throttle_count = throttle_count
+        self.retry_after = retry_after
+        self.calls = 0
+
+    def call(self):
+        self.calls += 1
+        if self.calls <= self.throttle_count:
+            raise TooManyRequests(self.retry_after)
+        return 'ok'
+
+
+def test_token_bucket_paces_requests_to_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(60, capacity=1, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        bucket.acquire()
+    # One request per second after the initial burst of one
+    assert clock.now == pytest.approx(4.0)
+
+
+def test_token_bucket_allows_burst_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(600, clock=clock, sleep=clock.sleep)
+    for _ in range(600):
+        bucket.acquire()
+    assert clock.now == 0.0
+    assert bucket.try_acquire(10) == pytest.approx(1.0)
+
+
+def test_declined_extra_request_keeps_the_request_budget():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter(rpm=2, tpm=1000, clock=clock, sleep=clock.sleep)
+    assert limiter.try_extra_request(tokens=600)
+    # Not enough tokens left for this hedge: its request token is given back
+    assert not limiter.try_extra_request(tokens=500)
+    assert limiter.try_extra_request(tokens=300)
+    assert not limiter.try_extra_request(tokens=0)
+
+
+def test_low_detail_images_are_estimated_at_85_tokens():
+    assert estimate_request_tokens(4) == 4 * 765 + 200 + 256
+    assert estimate_request_tokens(4, detail='low') == 4 * 85 + 200 + 256
+
+
+def test_backoff_grows_exponentially_caps_and_honours_retry_after():
+    full = lambda: 1.0
+    assert backoff_delay(0, rng=full) == pytest.approx(1.0)
+    assert backoff_delay(3, rng=full) == pytest.approx(8.0)
+    assert backoff_delay(10, cap=30, rng=full) == pytest.approx(30.0)
+    assert backoff_delay(0, retry_after=12, rng=lambda: 0.0) == 12
+
+
+def test_aimd_halves_on_throttle_and_recovers_additively():
+    limit = AdaptiveConcurrency(8, minimum=1, maximum=8)
+    limit.on_throttle()
+    limit.on_throttle()
+    assert int(limit.limit) == 2
+    for _ in range(2):
+        limit.on_success()
+    assert int(limit.limit) == 3
+
+
+def test_rate_limit_detection_and_retry_after_parsing():
+    assert is_rate_limit_error(TooManyRequests())
+    assert is_rate_limit_error(SimpleNamespace(code=429))
+    assert not is_rate_limit_error(ValueError('bad input'))
+    assert retry_after_seconds(TooManyRequests(retry_after=7)) == 7.0
+    assert retry_after_seconds(ValueError()) is None
+
+
+def test_limiter_backs_off_through_429s_from_fake_server():
+    clock = FakeClock()
+    limiter = ProviderRateLimiter(rpm=120, max_concurrency=8, clock=clock, sleep=clock.sleep, rng=lambda: 0.5)
+    server = FakeServer(throttle_count=3, retry_after=5)
+
+    for attempt in range(10):
+        try:
+            with limiter.request():
+                result = server.call()
+            limiter.on_success()
+            break
+        except Exception as e:
+            limiter.on_error(e, attempt)
+
+    assert result == 'ok'
+    assert server.calls == 4
+    assert limiter.throttled == 3
+    # 8 halved three times to 1, then one additive step after the success
+    assert int(limiter.concurrency.limit) == 2
+    # Every retry waited at least the server's Retry-After
+    assert clock.sleeps == [5, 5, 5]
+
+
+def test_query_gpt4o_retries_throttled_calls_with_backoff(monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    from utils import providers
+    from utils import rate_limit
+
+    clock = FakeClock()
+    server = FakeServer(throttle_count=2, retry_after=3)
+
+    def create(**kwargs):
+        server.call()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='حزن'))])
+
+    monkeypatch.setattr(providers, 'get_openai_client', lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    monkeypatch.setattr(rate_limit, '_rate_limiters', {})
+    limiter = rate_limit.configure_rate_limiter('gpt4o', rpm=600, clock=clock, sleep=clock.sleep, rng=lambda: 0.0)
+
+    result = providers.query_gpt4o(Image.new('RGB', (8, 8)), None, 'zero_shot')
+    assert result['label'] == 'حزن'
+    assert server.calls == 3
+    assert clock.sleeps == [3, 3]
+    assert limiter.stats()['throttled'] == 2
@@ -0,0 +1,94 @@
+import os
+import csv
+import sys
+import json
+import socket
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.replay import replay_results, answer_columns
+
+
+def write_csv(path, fieldnames, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def test_answer_columns_map_back_to_models_and_prompt_types():
+    fieldnames = ['image_name', 'gpt4o_zero_shot', 'my_model_cot', 'my_model_cot_reasoning',
+                  'gpt4o_zero_shot_request', 'my_model_cot_raw', 'timestamp']
+    assert answer_columns(fieldnames) == [('gpt4o_zero_shot', 'gpt4o', 'zero_shot'),
+                                          ('my_model_cot', 'my_model', 'chain_of_thought')]
+
+
+def test_replay_rederives_labels_and_reasoning_from_raw_answers(tmp_path):
+    fieldnames = ['image_name', 'gpt4o_zero_shot', 'gpt4o_cot', 'gpt4o_cot_reasoning',
+                  'gpt4o_zero_shot_request', 'gpt4o_cot_request', 'gpt4o_zero_shot_raw', 'gpt4o_cot_raw', 'timestamp']
+    source = tmp_path / 'results.csv'
+    write_csv(source, fieldnames, [
+        # Stale labels from an older normalizer
+        {'image_name': 'a.png', 'gpt4o_zero_shot': 'فرح!', 'gpt4o_cot': 'old', 'gpt4o_cot_reasoning': 'old',
+         'gpt4o_zero_shot_raw': 'فرح!', 'gpt4o_cot_raw': 'الوجه عابس.\nالشعور: حُزن', 'timestamp': 't'},
+        # A failed call has no raw answer and is left alone
+        {'image_name': 'b.png', 'gpt4o_zero_shot': '', 'gpt4o_zero_shot_raw': '', 'gpt4o_cot': 'غضب',
+         'gpt4o_cot_raw': 'غضب', 'timestamp': 't'},
+    ])
+    output = tmp_path / 'replayed.csv'
+    assert replay_results(str(source), str(output)) == 2
+
+    first, second = read_csv(output)
+    assert (first['gpt4o_zero_shot'], first['gpt4o_cot'], first['gpt4o_cot_reasoning']) == ('سعادة', 'حزن', 'الوجه عابس.')
+    assert first['gpt4o_cot_raw'] == 'الوجه عابس.\nالشعور: حُزن'
+    assert second['gpt4o_zero_shot'] == '' and second['gpt4o_cot'] == 'غضب'
+
+
+def test_replay_falls_back_to_the_cell_checkpoint_for_old_files(tmp_path):
+    fieldnames = ['image_name', 'gemini_zero_shot', 'gemini_zero_shot_request', 'timestamp']
+    source = tmp_path / 'results.csv'
+    write_csv(source, fieldnames, [{'image_name': 'a.png', 'gemini_zero_shot': 'stale', 'timestamp': 't'}])
+    cells = tmp_path / 'results.cells.jsonl'
+    cells.write_text(json.dumps({'image_path': 'images/a.png', 'model': 'gemini', 'prompt_type': 'zero_shot',
+                                 'result': {'label': 'ذهول', 'raw_answer': 'ذهول'}}, ensure_ascii=False) + '\n',
+                     encoding='utf-8')
+    output = tmp_path / 'replayed.csv'
+    replay_results(str(source), str(output), cells_path=str(cells))
+
+    row, = read_csv(output)
+    assert row['gemini_zero_shot'] == 'مفاجأة'
+    assert row['gemini_zero_shot_raw'] == 'ذهول'
+    assert list(row)[-2:] == ['gemini_zero_shot_raw', 'timestamp']
+
+
+def test_replay_command_never_touches_the_network(tmp_path, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("rich")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    import main
+
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    Image.new('RGB', (16, 16), 'red').save(images_dir / 'a.png')
+    output = tmp_path / 'out.csv'
+    main.main(['--temperature', '0', '--images-dir', str(images_dir), '--models', 'stub',
+               '--output', str(output), '--no-response-cache', '--quiet', '--few-shot-dir', str(images_dir),
+               '--prompt-types', 'zero_shot', 'chain_of_thought'])
+
+    def no_network(*args, **kwargs):
+        raise AssertionError('replay opened a network connection')
+    monkeypatch.setattr(socket.socket, 'connect', no_network)
+    replayed = tmp_path / 'replayed.csv'
+    main.main(['--replay', str(output), '--output', str(replayed), '--images-dir', str(images_dir), '--quiet'])
+
+    original, = read_csv(output)
+    row, = read_csv(replayed)
+    assert row == original
+    assert row['stub_cot_raw'] and row['stub_zero_shot_raw']
@@ -0,0 +1,111 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("openai")
+pytest.importorskip("google.generativeai")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils import providers
+from utils.response_cache import ResponseCache
+
+
+class FakeCompletions:
+    """Answers chain-of-thought prompts with `cot_answer` and the others with `answer`."""
+
+    def __init__(self, answer, cot_answer=None):
+        self.answer = answer
+        self.cot_answer = cot_answer or answer
+        self.calls = 0
+        self.temperatures = []
+
+    def create(self, **kwargs):
+        self.calls += 1
+        self.temperatures.append(kwargs['temperature'])
+        answer = self.cot_answer if 'الخطوات' in str(kwargs['messages']) else self.answer
+        # A list gives the answers of successive calls
+        message = SimpleNamespace(content=answer.pop(0) if isinstance(answer, list) else answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    completions = FakeCompletions("حزن", "وصف قصير\nالشعور: حزن")
+    monkeypatch.setattr(providers, 'get_openai_client', lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return completions
+
+
+def test_identical_request_is_served_from_cache(tmp_path, fake_openai):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    image = Image.new('RGB', (32, 32), 'green')
+
+    first = providers.query_gpt4o(image, None, 'chain_of_thought', response_cache=cache)
+    second = providers.query_gpt4o(image, None, 'chain_of_thought', response_cache=cache)
+
+    assert fake_openai.calls == 1
+    assert second == first
+    assert second['label'] == 'حزن'
+    assert second['reasoning'] == 'وصف قصير'
+    assert second['raw_answer'] == "وصف قصير\nالشعور: حزن"
+
+
+def test_cache_survives_reopen_and_keys_on_image_and_prompt_type(tmp_path, fake_openai):
+    path = str(tmp_path / "responses.sqlite")
+    image = Image.new('RGB', (32, 32), 'green')
+    providers.query_gpt4o(image, None, 'zero_shot', response_cache=ResponseCache(path))
+
+    reopened = ResponseCache(path)
+    providers.query_gpt4o(image, None, 'zero_shot', response_cache=reopened)
+    assert fake_openai.calls == 1
+
+    providers.query_gpt4o(image, None, 'chain_of_thought', response_cache=reopened)
+    providers.query_gpt4o(Image.new('RGB', (32, 32), 'red'), None, 'zero_shot', response_cache=reopened)
+    assert fake_openai.calls == 3
+
+
+def test_nonzero_temperature_bypasses_cache(tmp_path, fake_openai):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    image = Image.new('RGB', (32, 32), 'green')
+    providers.query_gpt4o(image, None, 'zero_shot', temperature=0.7, response_cache=cache)
+    providers.query_gpt4o(image, None, 'zero_shot', temperature=0.7, response_cache=cache)
+    assert fake_openai.calls == 2
+    assert cache.count() == 0
+
+
+def test_refusals_and_unparsed_answers_are_not_cached(tmp_path, fake_openai):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    image = Image.new('RGB', (32, 32), 'green')
+    fake_openai.answer = 'عذرا، لا أستطيع تحليل الصور'
+    providers.query_gpt4o(image, None, 'zero_shot', max_retries=0, response_cache=cache)
+    fake_openai.answer = 'المشهد يوحي بشيء ما'
+    providers.query_gpt4o(image, None, 'zero_shot', max_retries=0, response_cache=cache)
+    assert cache.count() == 0
+
+    fake_openai.answer = 'حزن'
+    assert providers.query_gpt4o(image, None, 'zero_shot', max_retries=0, response_cache=cache)['label'] == 'حزن'
+    assert cache.count() == 1
+
+
+def test_answers_from_a_raised_retry_temperature_are_not_cached(tmp_path, fake_openai):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    image = Image.new('RGB', (32, 32), 'green')
+    fake_openai.answer = ['عذرا، لا أستطيع تحليل الصور', 'حزن']
+    assert providers.query_gpt4o(image, None, 'zero_shot', max_retries=1, response_cache=cache)['label'] == 'حزن'
+    assert fake_openai.temperatures == [0.0, 0.1]
+    assert cache.count() == 0
+
+
+def test_invalidate_by_model_and_prompt_version(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    result = {'label': 'حزن', 'reasoning': None, 'request_json': '[]', 'raw_answer': 'حزن'}
+    cache.put('a', 'gpt-4o', 'zero_shot', '1', 0.0, result)
+    cache.put('b', 'gpt-4o', 'zero_shot', '2', 0.0, result)
+    cache.put('c', 'gemini-1.5-pro', 'zero_shot', '1', 0.0, result)
+
+    assert cache.invalidate(model='gpt-4o', prompt_version='1') == 1
+    assert cache.get('a') is None
+    assert cache.invalidate(model='gemini-1.5-pro') == 1
+    assert cache.get('b') == result
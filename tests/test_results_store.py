@@ -0,0 +1,117 @@
+import os
+import csv
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.results_store import ResultsStore
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def result(label, prompt_type, template='{"prompt": "%s"}'):
+    return {'label': label, 'reasoning': 'وجه عابس' if prompt_type == 'chain_of_thought' else None,
+            'raw_answer': label, 'request_json': template % prompt_type}
+
+
+def fill_store(store, images=50):
+    store.start_run('run1', ['gpt4o', 'gemini'], ['zero_shot', 'chain_of_thought'])
+    for i in range(images):
+        cells = {(model, prompt_type): ('حزن' if i % 2 else 'سعادة', result('حزن', prompt_type))
+                 for model in ('gpt4o', 'gemini') for prompt_type in ('zero_shot', 'chain_of_thought')}
+        store.add_image('run1', f"{i:03d}.png", cells, '2024-06-10 15:30:45')
+
+
+def test_request_templates_are_stored_once(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.sqlite'))
+    fill_store(store)
+    assert store.stats() == {'runs': 1, 'images': 50, 'cells': 200, 'requests': 2}
+    store.close()
+
+
+def test_queries_by_model_prompt_type_and_image(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.sqlite'))
+    fill_store(store, images=4)
+    cells = store.cells(model='gemini', prompt_type='chain_of_thought')
+    assert [cell['image_name'] for cell in cells] == ['000.png', '001.png', '002.png', '003.png']
+    assert cells[1]['label'] == 'حزن' and cells[1]['reasoning'] == 'وجه عابس'
+    assert cells[1]['request_json'] == '{"prompt": "chain_of_thought"}'
+    assert len(store.cells(image_name='002.png')) == 4
+    assert store.label_counts('run1')[('gpt4o', 'zero_shot', 'سعادة')] == 2
+    store.close()
+
+
+def test_rewriting_an_image_replaces_its_cells(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.sqlite'))
+    store.start_run('run1', ['gpt4o'], ['zero_shot'])
+    store.add_image('run1', 'a.png', {('gpt4o', 'zero_shot'): (None, result(None, 'zero_shot'))})
+    store.add_image('run1', 'a.png', {('gpt4o', 'zero_shot'): ('غضب', result('غضب', 'zero_shot'))})
+    cell, = store.cells(run='run1')
+    assert cell['label'] == 'غضب'
+    store.close()
+
+
+def test_export_matches_the_results_csv_and_imports_back(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.sqlite'))
+    fill_store(store, images=3)
+    exported = tmp_path / 'results_run1.csv'
+    assert store.export_csv('run1', str(exported)) == 3
+    rows = read_csv(exported)
+    assert list(rows[0])[:4] == ['image_name', 'gpt4o_zero_shot', 'gpt4o_cot', 'gpt4o_cot_reasoning']
+    assert rows[1]['gemini_cot'] == 'حزن' and rows[1]['gemini_cot_request'] == '{"prompt": "chain_of_thought"}'
+
+    other = ResultsStore(str(tmp_path / 'imported.sqlite'))
+    assert other.import_csv(str(exported)) == ('results_run1', 3)
+    reexported = tmp_path / 'again.csv'
+    other.export_csv('results_run1', str(reexported))
+    assert read_csv(reexported) == rows
+    assert other.stats()['requests'] == 2
+    store.close()
+    other.close()
+
+
+def test_cli_reports_a_missing_run_instead_of_a_traceback(tmp_path, capsys):
+    from utils import results_store
+    path = str(tmp_path / 'results.sqlite')
+    with pytest.raises(SystemExit):
+        results_store.main([path, '--export-csv', str(tmp_path / 'out.csv')])
+    assert 'No runs in' in capsys.readouterr().err
+
+    store = ResultsStore(path)
+    fill_store(store, images=1)
+    store.close()
+    with pytest.raises(SystemExit):
+        results_store.main([path, '--run', 'run2', '--model', 'gpt4o'])
+    assert "No run 'run2'" in capsys.readouterr().err
+    results_store.main([path, '--export-csv', str(tmp_path / 'out.csv')])
+    assert len(read_csv(tmp_path / 'out.csv')) == 1
+
+
+def test_main_writes_the_store_alongside_the_csv(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("rich")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    import main
+
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    for name in ('a.png', 'b.png'):
+        Image.new('RGB', (16, 16), 'red').save(images_dir / name)
+    output = tmp_path / 'out.csv'
+    db = tmp_path / 'results.sqlite'
+    main.main(['--temperature', '0', '--images-dir', str(images_dir), '--models', 'stub',
+               '--output', str(output), '--no-response-cache', '--quiet', '--few-shot-dir', str(images_dir),
+               '--prompt-types', 'zero_shot', 'chain_of_thought', '--results-db', str(db)])
+
+    store = ResultsStore(str(db))
+    assert store.runs() == ['out']
+    exported = tmp_path / 'exported.csv'
+    store.export_csv('out', str(exported))
+    key = lambda row: row['image_name']
+    assert sorted(read_csv(exported), key=key) == sorted(read_csv(output), key=key)
+    store.close()
@@ -0,0 +1,136 @@
+import os
+import csv
+import sys
+import argparse
+import subprocess
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+from utils.sharding import parse_shard, shard_of, select_shard, WorkQueue, merge_results
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def write_csv(path, fieldnames, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_parse_shard_validates_the_index():
+    assert parse_shard('2/4') == (2, 4)
+    for value in ('4/4', '-1/4', '1/0', 'a/b', '3'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(value)
+
+
+def test_shards_partition_the_names():
+    names = [f"book_{i}/page_{i}.png" for i in range(2000)]
+    shards = [select_shard(names, (index, 4)) for index in range(4)]
+    assert sorted(sum(shards, [])) == sorted(names)
+    assert all(400 < len(shard) < 600 for shard in shards)
+    # Windows-style separators land in the same shard
+    assert shard_of('book_1\\page_1.png', 4) == shard_of('book_1/page_1.png', 4)
+
+
+def test_work_queue_claims_each_image_once(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    first, second = WorkQueue(path), WorkQueue(path)
+    assert first.add(['a.png', 'b.png', 'c.png']) == 3
+    assert second.add(['a.png', 'b.png', 'c.png']) == 0
+    claimed = [first.claim('w1'), second.claim('w2'), first.claim('w1')]
+    assert sorted(claimed) == ['a.png', 'b.png', 'c.png']
+    assert second.claim('w2') is None
+    for name in claimed:
+        first.complete(name)
+    assert second.stats() == {'pending': 0, 'claimed': 0, 'done': 3, 'given_up': 0, 'workers': 2}
+    first.close()
+    second.close()
+
+
+def test_expired_leases_are_reclaimed_until_max_attempts(tmp_path):
+    now = [0.0]
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease=10, max_attempts=2, clock=lambda: now[0])
+    queue.add(['a.png'])
+    assert queue.claim('dead worker') == 'a.png'
+    now[0] = 5
+    assert queue.claim('w2') is None
+    now[0] = 11
+    assert queue.claim('w2') == 'a.png'
+    now[0] = 30
+    assert queue.claim('w3') is None
+    assert queue.stats()['given_up'] == 1 and queue.remaining() == 0
+    queue.close()
+
+
+def test_merge_drops_duplicates_and_reports_gaps(tmp_path):
+    fieldnames = ['image_name', 'gpt4o_zero_shot', 'gpt4o_zero_shot_request', 'gpt4o_zero_shot_raw', 'timestamp']
+    first, second = tmp_path / 'shard0.csv', tmp_path / 'shard1.csv'
+    write_csv(first, fieldnames, [{'image_name': 'b.png', 'gpt4o_zero_shot': '', 'timestamp': '2024-06-10 15:00:00'},
+                                  {'image_name': 'a.png', 'gpt4o_zero_shot': 'حزن', 'timestamp': '2024-06-10 15:00:00'}])
+    write_csv(second, ['image_name', 'gemini_zero_shot', 'timestamp'],
+              [{'image_name': 'b.png', 'gemini_zero_shot': 'غضب', 'timestamp': '2024-06-10 14:00:00'}])
+    output = tmp_path / 'merged.csv'
+    result = merge_results([str(first), str(second)], str(output), expected=['a.png', 'b.png', 'c.png'])
+    assert result == {'rows': 2, 'duplicates': 1, 'missing': ['c.png']}
+    rows = read_csv(output)
+    assert [row['image_name'] for row in rows] == ['a.png', 'b.png']
+    assert rows[1]['gemini_zero_shot'] == 'غضب' and rows[1]['gpt4o_zero_shot'] == ''
+    assert list(rows[0])[:3] == ['image_name', 'gpt4o_zero_shot', 'gemini_zero_shot']
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("rich")
+    pytest.importorskip("openai")
+    pytest.importorskip("google.generativeai")
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    names = [f"book_page_{i:02d}.png" for i in range(12)]
+    for i, name in enumerate(names):
+        Image.new('RGB', (16, 16), (i * 20, 0, 0)).save(images_dir / name)
+    return images_dir, names
+
+
+def run_args(images_dir, output):
+    return ['--temperature', '0', '--images-dir', str(images_dir), '--models', 'stub', '--output', str(output),
+            '--no-response-cache', '--quiet', '--few-shot-dir', str(images_dir), '--prompt-types', 'zero_shot']
+
+
+def test_static_shards_merge_into_the_full_run(tmp_path, corpus):
+    import main
+    images_dir, names = corpus
+    outputs = [tmp_path / f"shard{index}.csv" for index in range(3)]
+    for index, output in enumerate(outputs):
+        main.main(run_args(images_dir, output) + ['--shard', f"{index}/3"])
+    assert sum(len(read_csv(output)) for output in outputs) == len(names)
+
+    merged = tmp_path / 'merged.csv'
+    assert merge_results([str(output) for output in outputs], str(merged), expected=names) == \
+        {'rows': len(names), 'duplicates': 0, 'missing': []}
+    assert [row['image_name'] for row in read_csv(merged)] == names
+
+
+def test_worker_processes_share_a_work_queue(tmp_path, corpus):
+    images_dir, names = corpus
+    queue = tmp_path / 'queue.sqlite'
+    outputs = [tmp_path / f"worker{index}.csv" for index in range(3)]
+    workers = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')] + run_args(images_dir, output) +
+                                ['--work-queue', str(queue)], cwd=tmp_path,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for output in outputs]
+    assert [worker.wait(timeout=120) for worker in workers] == [0, 0, 0]
+
+    rows = [row['image_name'] for output in outputs for row in read_csv(output)]
+    assert sorted(rows) == names
+    assert WorkQueue(str(queue)).stats()['done'] == len(names)
+    merged = tmp_path / 'merged.csv'
+    assert merge_results([str(output) for output in outputs], str(merged),
+                         expected=names)['missing'] == []
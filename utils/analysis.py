@@ -0,0 +1,340 @@
+import os
+import csv
+import sys
+import json
+import argparse
+import warnings
+import numpy as np
+from utils.prompt_utils import EMOTION_LABELS_EN_AR
+from utils.checkpoint import answer_columns
+
+# Label codes: the index of each label in EMOTION_LABELS_EN_AR; -1 is a missing or unknown label
+LABELS = list(EMOTION_LABELS_EN_AR.values())
+LABELS_EN = list(EMOTION_LABELS_EN_AR)
+MISSING = -1
+
+def book_of(image_name):
+    """
+    The book an image belongs to: its sub-folder for recursive runs, otherwise the file
+    name up to '_page_' (e.g. 'open_tap_page_11.png' -> 'open_tap').
+    """
+    if '/' in image_name or '\\' in image_name:
+        return image_name.replace('\\', '/').split('/', 1)[0]
+    book, page, _ = image_name.partition('_page_')
+    return book if page else os.path.splitext(image_name)[0]
+
+def factorize(values):
+    """
+    Distinct values in first-seen order and the index of each value among them. A dict pass
+    is much faster than np.unique, which sorts, on arrays of Python strings.
+
+    Returns:
+        (uniques, inverse) with inverse an int64 array shaped like values
+    """
+    values = np.asarray(values, dtype=object)
+    index = {}
+    inverse = np.fromiter((index.setdefault(value, len(index)) for value in values.ravel()),
+                          dtype=np.int64, count=values.size)
+    return list(index), inverse.reshape(values.shape)
+
+def encode_labels(values):
+    """
+    Map label strings to codes in one vectorized pass: the values are cast to fixed-width
+    strings one character wider than the longest label, so no longer value is cut down to a
+    label, and looked up in the sorted labels.
+
+    Returns:
+        int8 array of codes, MISSING for empty or non-canonical labels
+    """
+    values = np.asarray(values).astype(_LABEL_DTYPE, copy=False)
+    positions = np.minimum(np.searchsorted(_SORTED_LABELS, values), len(LABELS) - 1)
+    return np.where(_SORTED_LABELS[positions] == values, _SORTED_CODES[positions], MISSING).astype(np.int8)
+
+_LABEL_DTYPE = f"U{max(len(label) for label in LABELS) + 1}"
+_SORTED_CODES = np.argsort(np.array(LABELS, dtype=_LABEL_DTYPE))
+_SORTED_LABELS = np.array(LABELS, dtype=_LABEL_DTYPE)[_SORTED_CODES]
+
+class ResultTable:
+    """
+    Labels of one or more results files as a dense code matrix.
+
+    Attributes:
+        image_names: Array of image names, one per row
+        sources: Array with the results file of each row
+        annotators: List of (model, prompt_type), one per column
+        codes: int8 array of shape (rows, annotators), MISSING where there is no label
+    """
+
+    def __init__(self, image_names, sources, annotators, codes):
+        self.image_names = np.asarray(image_names, dtype=object)
+        self.sources = np.asarray(sources, dtype=object)
+        self.annotators = list(annotators)
+        self.codes = np.asarray(codes, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def column(self, model, prompt_type):
+        return self.codes[:, self.annotators.index((model, prompt_type))]
+
+    def books(self):
+        return np.array([book_of(name) for name in self.image_names], dtype=object)
+
+def read_columns(path, indices):
+    """
+    Read some columns of a CSV (after its header) as an object array of strings. The file is
+    tokenized in C by np.loadtxt, which builds no strings for the other columns, so the wide
+    request and raw columns cost only a scan. Files with short rows (e.g. a row torn by a
+    crash) fall back to csv.reader, with '' for the missing cells.
+
+    Returns:
+        Object array of shape (rows, len(indices))
+    """
+    try:
+        with warnings.catch_warnings():
+            # A header-only file is not an error
+            warnings.simplefilter('ignore', UserWarning)
+            return np.loadtxt(path, dtype=object, delimiter=',', quotechar='"', comments=None, skiprows=1,
+                              usecols=indices, encoding='utf-8', ndmin=2)
+    except ValueError:
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            rows = [[row[i] if i < len(row) else '' for i in indices] for row in reader if row]
+        return np.array(rows, dtype=object).reshape(len(rows), len(indices))
+
+def load_results(paths):
+    """
+    Load the label columns of one or many results CSVs. Only the image name and label
+    columns are read; request, raw and reasoning columns are skipped by the tokenizer.
+
+    Files with different models or prompt types are aligned on the union of their
+    (model, prompt_type) columns; cells a file does not have are MISSING.
+
+    Returns:
+        ResultTable
+    """
+    annotators, parts = [], []
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            header = next(csv.reader(f), [])
+        columns = answer_columns(header)
+        values = np.empty((0, len(columns) + 1), dtype=object)
+        if header:
+            values = read_columns(path, [header.index('image_name')] + [header.index(column) for column, _, _ in columns])
+        for _, model, prompt_type in columns:
+            if (model, prompt_type) not in annotators:
+                annotators.append((model, prompt_type))
+        parts.append((path, [(model, prompt_type) for _, model, prompt_type in columns], values))
+
+    total = sum(len(values) for _, _, values in parts)
+    codes = np.full((total, len(annotators)), MISSING, dtype=np.int8)
+    image_names, sources = [], []
+    start = 0
+    for path, file_annotators, values in parts:
+        if not len(values):
+            continue
+        positions = [annotators.index(annotator) for annotator in file_annotators]
+        codes[start:start + len(values), positions] = encode_labels(values[:, 1:])
+        image_names.extend(values[:, 0])
+        sources.extend([path] * len(values))
+        start += len(values)
+    return ResultTable(image_names, sources, annotators, codes)
+
+def label_counts(codes, num_labels=len(LABELS)):
+    """
+    Per-row vote counts.
+
+    Returns:
+        int array of shape (rows, num_labels)
+    """
+    codes = np.asarray(codes)
+    rows = np.repeat(np.arange(codes.shape[0]), codes.shape[1])
+    flat = codes.ravel().astype(np.int64)
+    valid = flat >= 0
+    return np.bincount(rows[valid] * num_labels + flat[valid],
+                       minlength=codes.shape[0] * num_labels).reshape(codes.shape[0], num_labels)
+
+def majority_labels(codes):
+    """
+    The most frequent label of each row across annotators.
+
+    Returns:
+        (labels, votes): label codes, MISSING where no label has a strict plurality
+        (ties or no labels), and the number of votes for the winning label
+    """
+    counts = label_counts(codes)
+    labels = counts.argmax(axis=1)
+    votes = counts[np.arange(len(counts)), labels]
+    tied = (counts == votes[:, None]).sum(axis=1) > 1
+    labels = np.where(tied | (votes == 0), MISSING, labels)
+    return labels.astype(np.int8), votes
+
+def confusion_matrix(a, b, num_labels=len(LABELS)):
+    """
+    Confusion matrix of two annotators over the rows both labelled.
+
+    Returns:
+        int array of shape (num_labels, num_labels); rows are `a`, columns are `b`
+    """
+    a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+    valid = (a >= 0) & (b >= 0)
+    return np.bincount(a[valid] * num_labels + b[valid], minlength=num_labels * num_labels).reshape(num_labels, num_labels)
+
+def cohen_kappa(a, b=None):
+    """
+    Cohen's kappa of two annotators, or of a precomputed confusion matrix when `b` is None.
+    Returns nan when there are no rows both labelled.
+    """
+    matrix = np.asarray(a if b is None else confusion_matrix(a, b), dtype=float)
+    total = matrix.sum()
+    if total == 0:
+        return float('nan')
+    observed = np.trace(matrix) / total
+    expected = (matrix.sum(axis=0) @ matrix.sum(axis=1)) / total ** 2
+    if expected == 1:
+        return 1.0
+    return float((observed - expected) / (1 - expected))
+
+def fleiss_kappa(codes):
+    """
+    Fleiss' kappa over the rows that every annotator labelled.
+
+    Args:
+        codes: Array of shape (rows, annotators)
+    """
+    codes = np.asarray(codes)
+    complete = codes[(codes >= 0).all(axis=1)]
+    return fleiss_kappa_counts(label_counts(complete))
+
+def fleiss_kappa_counts(counts):
+    """
+    Fleiss' kappa from a (rows, labels) matrix of vote counts with the same number of raters per row.
+    Returns nan for fewer than two raters or no rows.
+    """
+    counts = np.asarray(counts, dtype=float)
+    if counts.size == 0:
+        return float('nan')
+    raters = counts[0].sum()
+    if raters < 2:
+        return float('nan')
+    p_label = counts.sum(axis=0) / counts.sum()
+    p_row = ((counts ** 2).sum(axis=1) - raters) / (raters * (raters - 1))
+    observed, expected = p_row.mean(), (p_label ** 2).sum()
+    if expected == 1:
+        return 1.0
+    return float((observed - expected) / (1 - expected))
+
+def pairwise_kappa(table):
+    """
+    Cohen's kappa of every pair of annotators.
+
+    Returns:
+        float array of shape (annotators, annotators) with 1.0 on the diagonal
+    """
+    n = len(table.annotators)
+    kappas = np.eye(n)
+    for i in range(n):
+        for j in range(i + 1, n):
+            kappas[i, j] = kappas[j, i] = cohen_kappa(table.codes[:, i], table.codes[:, j])
+    return kappas
+
+def group_distribution(codes, groups, num_labels=len(LABELS)):
+    """
+    Label counts per group (e.g. per book) over every annotator's labels.
+
+    Returns:
+        (group_names, counts) with groups in sorted order and counts of shape (groups, num_labels)
+    """
+    codes = np.asarray(codes)
+    names, group_index = factorize(groups)
+    order = sorted(range(len(names)), key=names.__getitem__)
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[order] = np.arange(len(names))
+    names, group_index = [names[i] for i in order], rank[group_index]
+    flat_groups = np.repeat(group_index, codes.shape[1] if codes.ndim == 2 else 1)
+    flat = codes.ravel().astype(np.int64)
+    valid = flat >= 0
+    counts = np.bincount(flat_groups[valid] * num_labels + flat[valid],
+                         minlength=len(names) * num_labels).reshape(len(names), num_labels)
+    return list(names), counts
+
+def evaluate(table):
+    """
+    The full agreement report of a ResultTable as a JSON-serializable dict.
+    """
+    annotators = [f"{model}/{prompt_type}" for model, prompt_type in table.annotators]
+    majority, votes = majority_labels(table.codes)
+    has_majority = majority >= 0
+    agreement_with_majority = {}
+    for index, name in enumerate(annotators):
+        column = table.codes[:, index]
+        rows = has_majority & (column >= 0)
+        agreement_with_majority[name] = float((column[rows] == majority[rows]).mean()) if rows.any() else None
+    kappas = pairwise_kappa(table)
+    books, book_counts = group_distribution(table.codes, table.books())
+    majority_counts = np.bincount(majority[has_majority].astype(np.int64), minlength=len(LABELS))
+
+    def nan_to_none(value):
+        return None if np.isnan(value) else float(value)
+
+    return {
+        'rows': len(table),
+        'annotators': annotators,
+        'labels': LABELS,
+        'missing': {name: int((table.codes[:, i] < 0).sum()) for i, name in enumerate(annotators)},
+        'fleiss_kappa': nan_to_none(fleiss_kappa(table.codes)),
+        'complete_rows': int((table.codes >= 0).all(axis=1).sum()),
+        'pairwise_kappa': [[nan_to_none(value) for value in row] for row in kappas],
+        'agreement_with_majority': agreement_with_majority,
+        'majority_distribution': dict(zip(LABELS, majority_counts.tolist())),
+        'no_majority': int((~has_majority).sum()),
+        'book_distribution': {book: dict(zip(LABELS, counts.tolist())) for book, counts in zip(books, book_counts)},
+        'confusion_matrices': {
+            f"{annotators[i]} vs {annotators[j]}": confusion_matrix(table.codes[:, i], table.codes[:, j]).tolist()
+            for i in range(len(annotators)) for j in range(i + 1, len(annotators))
+        },
+    }
+
+def format_report(report):
+    """
+    Render an evaluate() report as plain-text tables.
+    """
+    def fmt(value):
+        return '   -' if value is None else f"{value:5.2f}"
+
+    names = report['annotators']
+    width = max([len(name) for name in names] + [10])
+    lines = [f"Rows: {report['rows']}  (all annotators labelled: {report['complete_rows']}, no majority: {report['no_majority']})",
+             f"Fleiss' kappa: {fmt(report['fleiss_kappa'])}", '', "Cohen's kappa"]
+    lines.append(' ' * (width + 4) + ' ' + ' '.join(f"{i + 1:>5}" for i in range(len(names))))
+    for i, (name, row) in enumerate(zip(names, report['pairwise_kappa'])):
+        lines.append(f"{i + 1:>2}. {name}".ljust(width + 4) + ' ' + ' '.join(fmt(value) for value in row))
+    lines += ['', 'Agreement with the majority label, missing labels']
+    for name in names:
+        lines.append(f"  {name.ljust(width)} {fmt(report['agreement_with_majority'][name])}  {report['missing'][name]:>6}")
+    lines += ['', 'Label distribution per book (all annotators)']
+    lines.append(' ' * width + ' ' + ' '.join(f"{label[:5]:>6}" for label in LABELS_EN))
+    for book, counts in report['book_distribution'].items():
+        lines.append(book.ljust(width)[:width] + ' ' + ' '.join(f"{counts[label]:>6}" for label in LABELS))
+    majority = report['majority_distribution']
+    lines.append('majority'.ljust(width) + ' ' + ' '.join(f"{majority[label]:>6}" for label in LABELS))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inter-model agreement report over one or more results CSVs.')
+    parser.add_argument('paths', nargs='+', help='Results CSV files')
+    parser.add_argument('--json', metavar='FILE', help="Also write the full report (with confusion matrices) as JSON; '-' for stdout")
+    args = parser.parse_args(argv)
+    table = load_results(args.paths)
+    report = evaluate(table)
+    if args.json == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        return
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
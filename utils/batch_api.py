@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import logging
+from utils.model_utils import build_gpt4o_request, parse_answer, prompt_text
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+CUSTOM_ID_SEPARATOR = '::'
+# Per-file limits of the Batch API; larger job matrices are split over several batches
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 200 * 1000 * 1000
+
+def make_custom_id(image_name, prompt_type):
+    return f"{image_name}{CUSTOM_ID_SEPARATOR}{prompt_type}"
+
+def split_custom_id(custom_id):
+    image_name, prompt_type = custom_id.rsplit(CUSTOM_ID_SEPARATOR, 1)
+    return image_name, prompt_type
+
+def build_batch_lines(images, prompt_types, temperature=0.0, few_shot_examples=None, image_root=None, completed=None):
+    """
+    Turn the GPT-4o job matrix into OpenAI Batch API request lines, reusing the live request builders.
+    Each image is closed once its lines are built.
+
+    Args:
+        images: Iterable of (image_path, PIL.Image) tuples
+        prompt_types: Prompt types to request for every image
+        temperature: Sampling temperature
+        few_shot_examples: Few-shot examples, required if 'few_shot' is requested
+        image_root: If given, images are named by their path relative to it instead of their file name
+        completed: Optional dict mapping image_path to {(model, prompt_type): result} for cells
+            finished in an earlier run; they are not requested again
+
+    Yields:
+        Dicts in the Batch API input format, one per (image, prompt_type)
+    """
+    for image_path, image in images:
+        image_name = os.path.relpath(image_path, image_root) if image_root else os.path.basename(image_path)
+        done = (completed or {}).get(image_path, {})
+        for prompt_type in prompt_types:
+            if ('gpt4o', prompt_type) in done:
+                continue
+            messages, _ = build_gpt4o_request(image, prompt_type, few_shot_examples)
+            yield {
+                'custom_id': make_custom_id(image_name, prompt_type),
+                'method': 'POST',
+                'url': BATCH_ENDPOINT,
+                'body': {'model': 'gpt-4o', 'messages': messages, 'max_tokens': 256, 'temperature': temperature},
+            }
+        image.close()
+
+def write_batch_files(path_prefix, lines, max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES):
+    """
+    Stream batch request lines to JSONL files named <path_prefix>.<n>.jsonl, starting a new
+    file before one would exceed `max_requests` lines or `max_bytes` bytes.
+
+    Returns:
+        List of (path, number of lines) per file
+    """
+    files = []
+    f = None
+    try:
+        for line in lines:
+            data = (json.dumps(line, ensure_ascii=False) + '\n').encode('utf-8')
+            if f is None or files[-1][1] >= max_requests or size + len(data) > max_bytes:
+                if f is not None:
+                    f.close()
+                files.append((f"{path_prefix}.{len(files) + 1}.jsonl", 0))
+                f = open(files[-1][0], 'wb')
+                size = 0
+            f.write(data)
+            size += len(data)
+            files[-1] = (files[-1][0], files[-1][1] + 1)
+    finally:
+        if f is not None:
+            f.close()
+    return files
+
+def submit_batch(client, input_path, metadata=None):
+    """
+    Upload a batch input file and create the batch.
+
+    Returns:
+        The created Batch object
+    """
+    with open(input_path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    return client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                 completion_window='24h', metadata=metadata)
+
+def wait_for_batch(client, batch_id, poll_interval=60.0, timeout=None, sleep=time.sleep):
+    """
+    Poll a batch until it reaches a terminal status.
+
+    Returns:
+        The final Batch object
+    """
+    started = time.monotonic()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        logging.info(f"Batch {batch_id}: {batch.status}" + (f" ({counts.completed}/{counts.total} done)" if counts else ''))
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout} seconds")
+        sleep(poll_interval)
+
+def download_batch_output(client, batch):
+    """
+    Download the output lines of a finished batch, followed by the lines of its error file
+    (requests that failed), which parse_batch_output turns into failed results.
+
+    Returns:
+        List of parsed output records
+    """
+    file_ids = [file_id for file_id in (batch.output_file_id, getattr(batch, 'error_file_id', None)) if file_id]
+    if not file_ids:
+        raise RuntimeError(f"Batch {batch.id} finished with status '{batch.status}' and no output file")
+    records = []
+    for file_id in file_ids:
+        content = client.files.content(file_id)
+        records.extend(json.loads(line) for line in content.text.splitlines() if line.strip())
+    return records
+
+def parse_batch_output(records):
+    """
+    Convert batch output records into per-image query results, parsed exactly like live calls.
+
+    Returns:
+        Dict mapping image_name to {('gpt4o', prompt_type): result}
+    """
+    results = {}
+    for record in records:
+        image_name, prompt_type = split_custom_id(record['custom_id'])
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            logging.error(f"Batch request {record['custom_id']} failed: {record.get('error') or response.get('status_code')}")
+            result = {'label': None, 'reasoning': None, 'request_json': None}
+        else:
+            answer = response['body']['choices'][0]['message']['content'].strip()
+            result = parse_answer(answer, prompt_type, prompt_text('gpt-4o', prompt_type))
+        results.setdefault(image_name, {})[('gpt4o', prompt_type)] = result
+    return results
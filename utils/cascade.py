@@ -0,0 +1,103 @@
+import argparse
+from collections import Counter
+from utils.prompt_utils import clean_emotion
+from utils.model_utils import is_refusal_message
+
+# Prompt types from cheapest to most expensive: few-shot sends four extra images, CoT writes long answers
+PROMPT_TYPE_COST_ORDER = ('zero_shot', 'few_shot', 'chain_of_thought')
+
+def parse_cascade_stage(value):
+    """
+    Parse one --cascade stage: comma-separated cells, each 'model/prompt_type' or a bare
+    prompt type for every model, e.g. 'zero_shot' or 'gpt4o/few_shot,gemini/zero_shot'.
+
+    Returns:
+        List of (model or None, prompt_type); None stands for every model
+    """
+    cells = []
+    for item in value.split(','):
+        model, _, prompt_type = item.strip().rpartition('/')
+        if prompt_type not in PROMPT_TYPE_COST_ORDER:
+            raise argparse.ArgumentTypeError(f"Unknown prompt type '{prompt_type}' in cascade stage '{value}'")
+        cells.append((model or None, prompt_type))
+    return cells
+
+def answer_vote(result):
+    """
+    The label an answer votes for, or None if it is not a clean label or looks like a refusal.
+    """
+    if result is None or is_refusal_message(result.get('raw_answer')):
+        return None
+    return clean_emotion(result.get('label'))
+
+class CascadePolicy:
+    """
+    Run an image's (model, prompt type) calls in stages, cheapest first, and stop as soon
+    as the answers so far settle the label.
+
+    An image is settled when the most voted clean label is at least `margin` votes ahead
+    of the runner-up. Answers that are not clean labels (see answer_vote) or are refusals
+    cast no vote. With the default margin of 2, two agreeing cheap answers settle an
+    image; a disagreement or a refusal escalates it to the next stage.
+
+    Args:
+        stages: List of stages, each a list of (model or None, prompt_type) as returned by
+            parse_cascade_stage. Cells in no stage are never run. The default is one stage
+            per prompt type, cheapest first, each covering every model.
+        margin: Votes the winning label needs over the runner-up
+    """
+
+    def __init__(self, stages=None, margin=2):
+        self.stages = stages
+        self.margin = margin
+        self.images = 0
+        self.calls = 0
+        self.full_calls = 0
+        self.settled_at = Counter()   # stage number (1-based) -> images; 0 for never settled
+
+    def plan(self, models, prompt_types):
+        """
+        The concrete stages for the configured models and prompt types.
+
+        Returns:
+            List of non-empty lists of (model, prompt_type)
+        """
+        if self.stages is None:
+            stages = [[(None, prompt_type)] for prompt_type in PROMPT_TYPE_COST_ORDER]
+        else:
+            stages = self.stages
+        planned, seen = [], set()
+        for stage in stages:
+            cells = []
+            for model, prompt_type in stage:
+                for candidate in ([model] if model else models):
+                    cell = (candidate, prompt_type)
+                    if candidate in models and prompt_type in prompt_types and cell not in seen:
+                        seen.add(cell)
+                        cells.append(cell)
+            if cells:
+                planned.append(cells)
+        return planned
+
+    def settled(self, results):
+        votes = Counter(vote for vote in map(answer_vote, results.values()) if vote is not None)
+        ranked = votes.most_common(2) + [(None, 0), (None, 0)]
+        return ranked[0][1] - ranked[1][1] >= self.margin
+
+    def record(self, results, stage, total_cells):
+        """
+        Account for a finished image: its calls, the calls a full run would have made, and
+        the stage (1-based) that settled it.
+        """
+        self.images += 1
+        self.calls += len(results)
+        self.full_calls += total_cells
+        self.settled_at[stage if self.settled(results) else 0] += 1
+
+    def stats(self):
+        saved = 1 - self.calls / self.full_calls if self.full_calls else 0.0
+        return {'images': self.images, 'calls': self.calls, 'full_calls': self.full_calls,
+                'calls_per_image': round(self.calls / self.images, 2) if self.images else 0.0,
+                'saved': round(saved, 3),
+                'settled_at_stage': {stage: count for stage, count in sorted(self.settled_at.items()) if stage},
+                'unsettled': self.settled_at.get(0, 0)}
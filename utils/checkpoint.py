@@ -0,0 +1,215 @@
+import os
+import re
+import csv
+import json
+import glob
+from datetime import datetime
+
+# CSV column suffix of each prompt type, in column order
+PROMPT_TYPE_COLUMNS = {'zero_shot': 'zero_shot', 'few_shot': 'few_shot', 'chain_of_thought': 'cot'}
+
+def result_column(model, prompt_type):
+    """
+    The results CSV label column of a (model, prompt type) cell, e.g. 'gpt4o_cot'.
+    """
+    return f"{model}_{PROMPT_TYPE_COLUMNS[prompt_type]}"
+
+def answer_columns(fieldnames):
+    """
+    Find the label columns of a results CSV header.
+
+    Returns:
+        List of (column, model, prompt_type), e.g. ('gpt4o_cot', 'gpt4o', 'chain_of_thought')
+    """
+    columns = []
+    for column in fieldnames:
+        for prompt_type, suffix in PROMPT_TYPE_COLUMNS.items():
+            if column.endswith('_' + suffix):
+                columns.append((column, column[:-len(suffix) - 1], prompt_type))
+                break
+    return columns
+
+def build_fieldnames(models, prompt_types):
+    """
+    CSV columns for the configured models and prompt types: one label column per
+    (model, prompt type), a reasoning column for chain-of-thought, then the request columns
+    and the raw model answers (which --replay re-parses).
+    """
+    label_columns, request_columns, raw_columns = [], [], []
+    for model in models:
+        for prompt_type in PROMPT_TYPE_COLUMNS:
+            if prompt_type not in prompt_types:
+                continue
+            column = result_column(model, prompt_type)
+            label_columns.append(column)
+            if prompt_type == 'chain_of_thought':
+                label_columns.append(f"{column}_reasoning")
+            request_columns.append(f"{column}_request")
+            raw_columns.append(f"{column}_raw")
+    return ['image_name'] + label_columns + request_columns + raw_columns + ['timestamp']
+
+def run_paths(run, results_dir='results'):
+    """
+    Resolve a run identifier to its (csv_path, cells_path) pair.
+
+    Args:
+        run: A run timestamp (e.g. '20240610_153045'), a results CSV path, or None for a new run
+        results_dir: Directory holding the results files
+
+    Returns:
+        (csv_path, cells_path) where cells_path is the per-cell JSONL checkpoint next to the CSV
+    """
+    if run is None:
+        run = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if run.endswith('.csv'):
+        csv_path = run
+    elif run.endswith('.cells.jsonl'):
+        csv_path = run[:-len('.cells.jsonl')] + '.csv'
+    else:
+        csv_path = os.path.join(results_dir, f"results_{run}.csv")
+    return csv_path, csv_path[:-len('.csv')] + '.cells.jsonl'
+
+# Timestamp-named runs, optionally with a name suffix ('_shard1of4'); sidecar files such as
+# results_<ts>.replay.csv or results_<ts>.duplicates.csv have a second extension and are not runs
+_RUN_NAME_RE = re.compile(r'results_\d{8}_\d{6}[^.]*\.csv')
+
+def latest_run(results_dir='results'):
+    """
+    Return the CSV path of the most recent timestamp-named run in results_dir, or None if there is none.
+    """
+    runs = sorted(path for path in glob.glob(os.path.join(results_dir, 'results_*.csv'))
+                  if _RUN_NAME_RE.fullmatch(os.path.basename(path)))
+    return runs[-1] if runs else None
+
+def _read_cells(cells_path):
+    """
+    Read a cell checkpoint written by RunWriter, ignoring a torn final line (from a crash
+    mid-write). A cell recorded more than once keeps its last record.
+
+    Returns:
+        Dict mapping image_path to {(model, prompt_type): result}
+    """
+    cells = {}
+    if not os.path.exists(cells_path):
+        return cells
+    with open(cells_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            cells.setdefault(record['image_path'], {})[(record['model'], record['prompt_type'])] = record['result']
+    return cells
+
+def load_completed_cells(cells_path):
+    """
+    Read the finished cells of a cell checkpoint written by RunWriter.
+
+    Failed calls (label None) are not counted as done so a resumed run retries them.
+
+    Returns:
+        Dict mapping image_path to {(model, prompt_type): result}
+    """
+    completed = {}
+    for image_path, cells in _read_cells(cells_path).items():
+        done = {cell: result for cell, result in cells.items() if result.get('label') is not None}
+        if done:
+            completed[image_path] = done
+    return completed
+
+def load_failed_images(cells_path):
+    """
+    Return the set of image paths with at least one failed cell (label None) in a cell checkpoint.
+    """
+    return {image_path for image_path, cells in _read_cells(cells_path).items()
+            if any(result.get('label') is None for result in cells.values())}
+
+def load_written_images(csv_path):
+    """
+    Return the set of image names that already have a row in a results CSV.
+    """
+    if not os.path.exists(csv_path):
+        return set()
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return {row['image_name'] for row in csv.DictReader(f) if row.get('image_name')}
+
+def drop_rows(csv_path, image_names):
+    """
+    Remove the rows of the given images from a results CSV, so the rows a resumed run writes
+    for them replace the old ones. The file is rewritten atomically.
+
+    Returns:
+        Number of rows removed
+    """
+    if not image_names or not os.path.exists(csv_path):
+        return 0
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+    kept = [row for row in rows if row.get('image_name') not in image_names]
+    if len(kept) == len(rows):
+        return 0
+    temp_path = csv_path + '.tmp'
+    with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(kept)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, csv_path)
+    return len(rows) - len(kept)
+
+class RunWriter:
+    """
+    Streams a run to disk as it progresses.
+
+    Every finished (image, model, prompt_type) cell is appended to a JSONL
+    checkpoint and every finished image is appended to the results CSV. Both
+    are flushed and fsync'd, so a crash loses at most the calls in flight.
+    """
+
+    def __init__(self, csv_path, fieldnames, cells_path):
+        self.csv_path = csv_path
+        self.cells_path = cells_path
+        directory = os.path.dirname(csv_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        self._csv_file = open(csv_path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._csv_file, fieldnames=fieldnames)
+        if write_header:
+            self._writer.writeheader()
+            self._sync(self._csv_file)
+        self._cells_file = open(cells_path, 'a', encoding='utf-8')
+        if self._cells_file.tell() > 0:
+            with open(cells_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+            if torn:
+                # Terminate a line torn by a crash so the next record starts cleanly
+                self._cells_file.write('\n')
+
+    @staticmethod
+    def _sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def write_cell(self, image_path, model, prompt_type, result):
+        record = {'image_path': image_path, 'model': model, 'prompt_type': prompt_type, 'result': result}
+        self._cells_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._sync(self._cells_file)
+
+    def write_row(self, row):
+        self._writer.writerow(row)
+        self._sync(self._csv_file)
+
+    def close(self):
+        self._csv_file.close()
+        self._cells_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,141 @@
+import time
+import logging
+import threading
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a provider whose circuit is open. The job should be
+    deferred and tried again after `retry_in` seconds.
+    """
+
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} circuit is open; retry in {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    Closed: calls go through; `failure_threshold` consecutive failed calls open the circuit.
+    A call counts once, when its retries are exhausted, not once per attempt.
+    Open: calls fail fast with CircuitOpen for `reset_timeout` seconds.
+    Half-open: one probe call is let through; success closes the circuit, failure reopens it.
+
+    `clock` is injectable so the breaker can be driven by a simulated clock in tests.
+
+    Args:
+        name: Provider name, for log messages
+        failure_threshold: Consecutive failures that open the circuit; None never opens it
+        reset_timeout: Seconds the circuit stays open before a probe is allowed
+    """
+
+    def __init__(self, name='provider', failure_threshold=None, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if a call may go ahead. In the half-open state only one probe is in flight at a time.
+        """
+        if self.failure_threshold is None:
+            return True
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self.probing):
+                self.probing = self.state == HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        """
+        Seconds until the circuit lets a probe through (0 if it is closed).
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            if self.state == HALF_OPEN:
+                return self.reset_timeout
+            return max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+
+    def release(self):
+        """
+        Give back a half-open probe that ended without an outcome (a request that could not be
+        built or was never sent), so another call may probe.
+        """
+        with self._lock:
+            self.probing = False
+
+    def on_attempt_failure(self):
+        """
+        Record a failed attempt of a call that may still retry. Failures are counted per call
+        (on_failure), but a half-open probe is a single attempt: its failure reopens the circuit
+        instead of letting the same call probe again.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open()
+
+    def on_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.warning(f"{self.name} recovered; circuit closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def on_failure(self):
+        if self.failure_threshold is None:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    logging.warning(f"{self.name} failed {self.failures} times in a row; circuit open for "
+                                    f"{self.reset_timeout:g}s, its jobs are deferred")
+                    self.opened += 1
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.probing = False
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'opened': self.opened, 'rejected': self.rejected}
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(provider):
+    """
+    Return the process-wide circuit breaker for a provider, creating one that never opens on first use.
+    """
+    with _circuit_breakers_lock:
+        if provider not in _circuit_breakers:
+            _circuit_breakers[provider] = CircuitBreaker(provider)
+        return _circuit_breakers[provider]
+
+def configure_circuit_breaker(provider, **kwargs):
+    """
+    Replace the process-wide circuit breaker for a provider (see CircuitBreaker for options).
+    """
+    breaker = CircuitBreaker(provider, **kwargs)
+    with _circuit_breakers_lock:
+        _circuit_breakers[provider] = breaker
+    return breaker
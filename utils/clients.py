@@ -0,0 +1,106 @@
+import os
+import threading
+import openai
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+# Load API keys from .env
+load_dotenv()
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+
+GEMINI_MODEL = 'gemini-1.5-pro'
+
+# Seconds; the read timeout bounds how long a single model call may take
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_POOL_SIZE = 4
+
+_settings = {'pool_size': DEFAULT_POOL_SIZE, 'timeout': DEFAULT_TIMEOUT, 'connect_timeout': DEFAULT_CONNECT_TIMEOUT}
+_clients = {}
+_clients_lock = threading.Lock()
+
+def configure_clients(pool_size=None, timeout=None, connect_timeout=None):
+    """
+    Set the connection pool size and timeouts for the shared provider clients.
+    Existing clients are closed and rebuilt with the new settings on next use.
+
+    Args:
+        pool_size: Keep-alive connections in the OpenAI pool; size it to the GPT-4o concurrency
+            (Gemini's gRPC channel multiplexes all calls over one connection)
+        timeout: Seconds a single call may take before it is abandoned
+        connect_timeout: Seconds allowed for the TCP/TLS connect
+    """
+    for name, value in (('pool_size', pool_size), ('timeout', timeout), ('connect_timeout', connect_timeout)):
+        if value is not None:
+            _settings[name] = value
+    close_clients()
+
+def _create_openai_client():
+    # DEFAULT_CONNECTION_LIMITS is an instance of the Limits class of whichever HTTP library
+    # this openai release is built on, so build ours from the same type
+    limits = type(openai.DEFAULT_CONNECTION_LIMITS)(max_connections=_settings['pool_size'],
+                                                    max_keepalive_connections=_settings['pool_size'])
+    timeout = openai.Timeout(_settings['timeout'], connect=_settings['connect_timeout'])
+    return openai.OpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=os.getenv('OPENAI_BASE_URL') or None,
+        timeout=timeout,
+        # Retries, backoff and rate limiting are handled by query_gpt4o and the rate limiter
+        max_retries=0,
+        http_client=openai.DefaultHttpxClient(limits=limits, timeout=timeout),
+    )
+
+def _create_gemini_model():
+    base_url = os.getenv('GEMINI_BASE_URL')
+    if base_url:
+        # A compatible endpoint such as the fake server; only the REST transport takes a custom URL
+        genai.configure(api_key=GOOGLE_API_KEY, transport='rest', client_options={'api_endpoint': base_url})
+    else:
+        genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+_FACTORIES = {
+    'openai': _create_openai_client,
+    'gemini': _create_gemini_model,
+}
+
+def _get_client(name):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = _FACTORIES[name]()
+    return client
+
+def get_openai_client():
+    """
+    The process-wide OpenAI client, created on first use. Its keep-alive pool is shared
+    by every worker thread, so connections and TLS sessions are reused across calls.
+    """
+    return _get_client('openai')
+
+def get_gemini_model():
+    """
+    The process-wide Gemini model, configured once and created on first use.
+    """
+    return _get_client('gemini')
+
+def gemini_request_options():
+    """
+    Per-call options for generate_content (the Gemini SDK takes its timeout per request).
+    """
+    return {'timeout': _settings['timeout']}
+
+def close_clients():
+    """
+    Close the shared clients' connection pools; they are recreated on next use.
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,146 @@
+import os
+import csv
+import numpy as np
+from PIL import Image
+from utils.image_utils import ensure_decoded
+
+HASH_BITS = 64
+_SIDE = 8
+_BIT_WEIGHTS = 1 << np.arange(HASH_BITS - 1, -1, -1, dtype=np.uint64)
+
+def _pack_bits(bits):
+    """
+    Pack a boolean array of HASH_BITS bits (most significant first) into an int.
+    """
+    return int(np.bitwise_or.reduce(_BIT_WEIGHTS[bits.ravel()])) if bits.any() else 0
+
+def average_hash(image):
+    """
+    aHash: an 8x8 grayscale thumbnail thresholded at its mean.
+    """
+    ensure_decoded(image)
+    pixels = np.asarray(image.convert('L').resize((_SIDE, _SIDE), Image.Resampling.BOX), dtype=np.float32)
+    return _pack_bits(pixels > pixels.mean())
+
+def difference_hash(image):
+    """
+    dHash: whether each pixel of a 9x8 grayscale thumbnail is brighter than its right-hand
+    neighbour. Robust to re-export, rescaling and small brightness or compression changes.
+    """
+    ensure_decoded(image)
+    pixels = np.asarray(image.convert('L').resize((_SIDE + 1, _SIDE), Image.Resampling.BOX), dtype=np.int16)
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+HASH_FUNCTIONS = {'dhash': difference_hash, 'ahash': average_hash}
+
+class HashIndex:
+    """
+    Index of perceptual hashes for Hamming-distance lookups within `threshold` bits.
+
+    The 64 bits are split into threshold + 1 bands. Two hashes within `threshold` bits of
+    each other must agree exactly on at least one band (pigeonhole), so a lookup only
+    compares against hashes that share a band value instead of scanning the whole index.
+    """
+
+    def __init__(self, threshold=4):
+        self.threshold = threshold
+        bands = min(threshold + 1, HASH_BITS)
+        edges = [HASH_BITS * band // bands for band in range(bands + 1)]
+        self._masks = [(((1 << (stop - start)) - 1) << (HASH_BITS - stop), HASH_BITS - stop)
+                       for start, stop in zip(edges[:-1], edges[1:])]
+        self._bands = [{} for _ in self._masks]
+        self.hashes = []
+        self.keys = []
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, value, key):
+        position = len(self.hashes)
+        self.hashes.append(value)
+        self.keys.append(key)
+        for band, (mask, shift) in zip(self._bands, self._masks):
+            band.setdefault((value & mask) >> shift, []).append(position)
+
+    def nearest(self, value):
+        """
+        The closest indexed hash within the threshold.
+
+        Returns:
+            (key, distance), or None if no indexed hash is close enough
+        """
+        candidates = set()
+        for band, (mask, shift) in zip(self._bands, self._masks):
+            candidates.update(band.get((value & mask) >> shift, ()))
+        best = None
+        for position in sorted(candidates):
+            distance = bin(self.hashes[position] ^ value).count('1')
+            if distance <= self.threshold and (best is None or distance < best[1]):
+                best = (self.keys[position], distance)
+        return best
+
+class NearDuplicateFilter:
+    """
+    Dedup stage between the image stream and the request stage.
+
+    Every image is hashed. The first image of each group of near-duplicates (within
+    `threshold` bits) is canonical and passes through to be annotated. Later images
+    whose hash is close to a canonical one are held back, and reuse the canonical
+    image's annotations once they are known.
+
+    Args:
+        threshold: Maximum Hamming distance (of 64 bits) for two images to be near-duplicates
+        method: 'dhash' or 'ahash'
+    """
+
+    def __init__(self, threshold=4, method='dhash'):
+        self.hash_image = HASH_FUNCTIONS[method]
+        self.index = HashIndex(threshold)
+        self.duplicates = {}   # canonical path -> [(duplicate path, distance)]
+        self.finished = {}     # canonical path -> results, once annotated
+        self.ready = []        # (duplicate path, canonical path, distance, results) waiting to be written
+
+    def filter(self, images):
+        """
+        Yield the canonical (path, image) pairs of a stream, holding back near-duplicates.
+        """
+        for path, image in images:
+            value = self.hash_image(image)
+            match = self.index.nearest(value)
+            if match is None:
+                self.index.add(value, path)
+                yield path, image
+                continue
+            canonical, distance = match
+            image.close()
+            if canonical in self.finished:
+                self.ready.append((path, canonical, distance, self.finished[canonical]))
+            else:
+                self.duplicates.setdefault(canonical, []).append((path, distance))
+
+    def resolve(self, canonical, results):
+        """
+        Record the annotations of a canonical image, releasing its held-back duplicates.
+        """
+        self.finished[canonical] = results
+        for path, distance in self.duplicates.pop(canonical, []):
+            self.ready.append((path, canonical, distance, results))
+
+    def pop_ready(self):
+        """
+        Return and clear the duplicates whose annotations are now known, as
+        (path, canonical path, distance, results) tuples.
+        """
+        ready, self.ready = self.ready, []
+        return ready
+
+def append_duplicates(path, duplicates):
+    """
+    Append (image_name, duplicate_of, distance) rows to a run's duplicates CSV.
+    """
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(['image_name', 'duplicate_of', 'distance'])
+        writer.writerows(duplicates)
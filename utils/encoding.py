@@ -0,0 +1,152 @@
+import base64
+import math
+from collections import namedtuple
+from utils.image_cache import get_payload_cache, image_content_hash, payload_cache_key
+from utils.image_utils import resize_image_preserve_aspect_ratio, render_payload, ensure_decoded
+
+# How an image is put on the wire. quality only applies to JPEG/WEBP; detail is the OpenAI
+# image detail level (None leaves it to the API default); max_bytes turns on the byte budget.
+EncodingProfile = namedtuple('EncodingProfile', ['format', 'max_size', 'quality', 'detail', 'max_bytes'],
+                             defaults=(1024, None, None, None))
+
+PROFILES = {
+    'png': EncodingProfile('PNG', 1024),                                    # Lossless, the original wire format
+    'jpeg': EncodingProfile('JPEG', 1024, quality=85, detail='high'),
+    'webp': EncodingProfile('WEBP', 1024, quality=80, detail='high'),
+    'low': EncodingProfile('JPEG', 512, quality=85, detail='low'),          # A single 512px tile on OpenAI
+    'auto': EncodingProfile('JPEG', 1024, quality=90, detail='high', max_bytes=300_000),
+}
+DEFAULT_PROFILE = 'png'
+
+MIME_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+# Byte-budget search: drop the quality in these steps, then shrink the long edge by this factor
+QUALITY_STEP = 10
+MIN_QUALITY = 40
+EDGE_SHRINK = 0.75
+MIN_EDGE = 256
+
+def parse_encoding_profile(spec):
+    """
+    Parse an encoding profile spec: a profile name, optionally followed by overrides,
+    e.g. 'jpeg', 'webp:quality=70' or 'auto:max_bytes=150000,max_size=768'.
+
+    Returns:
+        EncodingProfile
+    """
+    name, _, overrides = spec.partition(':')
+    if name.lower() not in PROFILES:
+        raise ValueError(f"Unknown encoding profile '{name}' (choose from {', '.join(PROFILES)})")
+    profile = PROFILES[name.lower()]
+    for override in filter(None, overrides.split(',')):
+        field, _, value = override.partition('=')
+        field = field.strip()
+        if field not in EncodingProfile._fields:
+            raise ValueError(f"Unknown encoding setting '{field}' in '{spec}'")
+        if field == 'format':
+            value = value.strip().upper()
+            if value not in MIME_TYPES:
+                raise ValueError(f"Unsupported image format '{value}' (choose from {', '.join(MIME_TYPES)})")
+        elif field == 'detail':
+            value = value.strip().lower()
+            if value not in ('low', 'high', 'auto'):
+                raise ValueError(f"Invalid detail level '{value}' (choose from low, high, auto)")
+        else:
+            value = int(value)
+        profile = profile._replace(**{field: value})
+    return profile
+
+_encoding_profile = PROFILES[DEFAULT_PROFILE]
+
+def get_encoding_profile():
+    return _encoding_profile
+
+def set_encoding_profile(profile):
+    """
+    Replace the process-wide encoding profile used by the request builders.
+    """
+    global _encoding_profile
+    _encoding_profile = profile
+
+def profile_cache_key(content_hash, profile):
+    """
+    Payload cache key for an image encoded with a profile. The default PNG profile
+    maps to the same key as encode_image_to_bytes(image, 'PNG', 1024).
+    """
+    params = {name: value for name, value in (('quality', profile.quality), ('max_bytes', profile.max_bytes))
+              if value is not None}
+    return payload_cache_key(content_hash, profile.max_size, profile.format, **params)
+
+def render_for_profile(image, profile):
+    """
+    Resize and encode an image according to a profile, without consulting the payload cache.
+
+    With a byte budget (max_bytes), the quality is lowered step by step and then the long
+    edge shrunk until the payload fits; if nothing fits, the smallest attempt is returned.
+    """
+    if profile.max_bytes is None:
+        return render_payload(image, format=profile.format, max_size=profile.max_size, quality=profile.quality)
+    lossy = profile.format != 'PNG'
+    qualities = list(range(profile.quality or 90, MIN_QUALITY - 1, -QUALITY_STEP)) if lossy else [None]
+    edge = profile.max_size
+    smallest = None
+    while True:
+        resized = resize_image_preserve_aspect_ratio(image, max_size=edge)
+        for quality in qualities:
+            payload = render_payload(resized, format=profile.format, max_size=edge, quality=quality)
+            if len(payload) <= profile.max_bytes:
+                return payload
+            if smallest is None or len(payload) < len(smallest):
+                smallest = payload
+        if edge <= MIN_EDGE:
+            return smallest
+        edge = max(MIN_EDGE, int(edge * EDGE_SHRINK))
+
+def encode_image_payload(image, profile=None):
+    """
+    Encode an image with a profile (default: the active profile), through the payload cache.
+
+    Returns:
+        Encoded image bytes
+    """
+    profile = profile or _encoding_profile
+
+    def encode():
+        # Images opened lazily are decoded here, only on a cache miss
+        ensure_decoded(image)
+        return render_for_profile(image, profile)
+    key = profile_cache_key(image_content_hash(image), profile)
+    return get_payload_cache().get_or_create(key, encode)
+
+def openai_image_part(image, profile=None):
+    """
+    Build an OpenAI chat content part carrying the image as a data URL.
+    """
+    profile = profile or _encoding_profile
+    img_b64 = base64.b64encode(encode_image_payload(image, profile)).decode('utf-8')
+    image_url = {"url": f"data:{MIME_TYPES[profile.format]};base64,{img_b64}"}
+    if profile.detail:
+        image_url["detail"] = profile.detail
+    return {"type": "image_url", "image_url": image_url}
+
+def gemini_image_part(image, profile=None):
+    """
+    Build a Gemini inline_data part carrying the image bytes.
+    """
+    profile = profile or _encoding_profile
+    return {"inline_data": {"mime_type": MIME_TYPES[profile.format], "data": encode_image_payload(image, profile)}}
+
+def openai_image_tokens(width, height, detail='high'):
+    """
+    Estimate the prompt tokens OpenAI bills for an image of the given size.
+
+    Low detail is a flat 85 tokens. Otherwise the image is scaled to fit 2048x2048, then so
+    its short side is at most 768, and billed 85 + 170 per 512px tile.
+    """
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
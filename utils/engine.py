@@ -0,0 +1,241 @@
+import time
+import heapq
+import logging
+import itertools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.circuit_breaker import CircuitOpen
+
+# One unit of work: a single (image, model, prompt_type) API call
+AnnotationJob = namedtuple('AnnotationJob', ['image_index', 'image_path', 'model', 'prompt_type'])
+
+PROMPT_TYPES = ('zero_shot', 'few_shot', 'chain_of_thought')
+
+# Maximum number of in-flight API calls per provider
+DEFAULT_CONCURRENCY = {
+    'gpt4o': 4,
+    'gemini': 4,
+}
+
+FAILED_RESULT = {'label': None, 'reasoning': None, 'request_json': None}
+
+def _run_job(query_fn, image, job):
+    try:
+        return query_fn(image, job.prompt_type)
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        logging.error(f"Job {job.model}/{job.prompt_type} failed for {job.image_path}: {e}")
+        return dict(FAILED_RESULT)
+
+def _close_image(image):
+    # Release the file handle of a lazily opened image; plain test objects have nothing to close
+    close = getattr(image, 'close', None)
+    if close is not None:
+        close()
+
+def _run_batch(batch_fn, images, jobs):
+    try:
+        return batch_fn(images)
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        logging.error(f"Batch {jobs[0].model}/{jobs[0].prompt_type} failed for "
+                      f"{', '.join(job.image_path for job in jobs)}: {e}")
+        return [dict(FAILED_RESULT) for _ in jobs]
+
+def run_annotation_jobs(images, query_fns, prompt_types=PROMPT_TYPES, concurrency=None,
+                        max_pending_images=8, on_result=None, completed=None,
+                        max_deferred_images=64, max_deferrals=10, cascade=None,
+                        batch_fns=None, batch_size=1):
+    """
+    Run every (image, model, prompt_type) job on per-provider worker pools.
+
+    Each provider gets its own thread pool, so a slow or throttled provider never
+    starves the other one. Images are pulled lazily from `images` and at most
+    `max_pending_images` images are in flight at once, which keeps memory bounded
+    regardless of corpus size.
+
+    A job whose provider's circuit breaker is open (CircuitOpen) is deferred rather than
+    failed: it is queued and resubmitted once the circuit allows a probe, while the other
+    providers keep working. Images waiting only on deferred jobs do not count towards
+    `max_pending_images`; up to `max_deferred_images` of them are held.
+
+    Args:
+        images: Iterable of (image_path, PIL.Image) tuples; each image is closed once its jobs are done
+        query_fns: Dict mapping model name to a callable(image, prompt_type) -> result dict
+        prompt_types: Prompt types to run for every model
+        concurrency: Dict mapping model name to its maximum number of concurrent calls
+        max_pending_images: Maximum number of images with unfinished jobs
+        on_result: Optional callback(job, result) invoked in the caller's thread as each job finishes
+        completed: Optional dict mapping image_path to {(model, prompt_type): result} for jobs
+            already finished in an earlier run; only the missing jobs are executed
+        max_deferred_images: Stop pulling new images while this many wait on deferred jobs
+        max_deferrals: Times a job may be deferred before it is recorded as failed
+        cascade: Optional CascadePolicy; an image's jobs then run stage by stage and stop
+            once its answers settle the label, so its results may not cover every cell
+        batch_fns: Optional dict mapping (model, prompt_type) to a callable(images) -> list of
+            result dicts; jobs of these cells are grouped up to `batch_size` images per call.
+            A partial group is sent once its provider has nothing else in flight or the
+            images run out, so a provider never idles waiting for a full group.
+        batch_size: Images per batched call
+
+    Yields:
+        (image_index, image_path, results) tuples as images complete, where results maps
+        (model, prompt_type) to the result dict returned by the query function.
+    """
+    batch_fns = (batch_fns or {}) if batch_size > 1 else {}
+    # Room for a full group to fill while the previous one is in flight
+    max_pending_images = max(max_pending_images, 2 * batch_size) if batch_fns else max_pending_images
+    limits = dict(DEFAULT_CONCURRENCY)
+    limits.update(concurrency or {})
+    executors = {
+        model: ThreadPoolExecutor(max_workers=max(1, limits.get(model, 1)), thread_name_prefix=f'{model}-worker')
+        for model in query_fns
+    }
+    image_iter = iter(enumerate(images, 1))
+    pending = {}      # future -> list of jobs sent together
+    batches = {}      # (model, prompt_type) -> jobs waiting to be grouped into a batched call
+    remaining = {}    # image_index -> number of unfinished jobs
+    collected = {}    # image_index -> {(model, prompt_type): result}
+    ready = []        # images whose jobs were all completed in an earlier run
+    images_by_index = {}  # image_index -> image, kept until all its jobs are done
+    deferred = []     # heap of (resubmit_at, sequence, jobs) for calls whose provider circuit was open
+    deferrals = {}    # tuple of jobs -> times deferred
+    sequence = itertools.count()
+    exhausted = False
+    cells = [(model, prompt_type) for model in query_fns for prompt_type in prompt_types]
+    stages = cascade.plan(list(query_fns), prompt_types) if cascade is not None else [cells]
+    stage_of = {}     # image_index -> index of the stage whose jobs are running
+
+    def submit(job):
+        cell = (job.model, job.prompt_type)
+        if cell not in batch_fns:
+            send([job])
+            return
+        batch = batches.setdefault(cell, [])
+        batch.append(job)
+        if len(batch) >= batch_size:
+            send(batches.pop(cell))
+
+    def send(jobs):
+        model, prompt_type = jobs[0].model, jobs[0].prompt_type
+        if len(jobs) == 1:
+            future = executors[model].submit(_run_job, query_fns[model], images_by_index[jobs[0].image_index], jobs[0])
+        else:
+            future = executors[model].submit(_run_batch, batch_fns[(model, prompt_type)],
+                                             [images_by_index[job.image_index] for job in jobs], jobs)
+        pending[future] = jobs
+
+    def flush_batches():
+        busy = {jobs[0].model for jobs in pending.values()}
+        for cell in list(batches):
+            if exhausted or cell[0] not in busy:
+                send(batches.pop(cell))
+
+    def submit_next_image():
+        nonlocal exhausted
+        try:
+            image_index, (image_path, image) = next(image_iter)
+        except StopIteration:
+            exhausted = True
+            return
+        done_results = dict((completed or {}).get(image_path, {}))
+        jobs = next_stage_jobs(image_index, image_path, done_results)
+        if not jobs:
+            _close_image(image)
+            ready.append(finish_image(image_index, image_path, done_results))
+            return
+        remaining[image_index] = len(jobs)
+        collected[image_index] = done_results
+        images_by_index[image_index] = image
+        for job in jobs:
+            submit(job)
+
+    def next_stage_jobs(image_index, image_path, results):
+        """
+        Jobs of the image's next stage that still has missing cells, or [] once the image is
+        done: every stage ran, or the cascade settled it.
+        """
+        stage = stage_of.get(image_index, -1)
+        while True:
+            stage += 1
+            if stage >= len(stages) or (stage > 0 and cascade is not None and cascade.settled(results)):
+                return []
+            stage_of[image_index] = stage
+            jobs = [AnnotationJob(image_index, image_path, model, prompt_type)
+                    for model, prompt_type in stages[stage] if (model, prompt_type) not in results]
+            if jobs:
+                return jobs
+
+    def finish_image(image_index, image_path, results):
+        stage = stage_of.pop(image_index, 0)
+        if cascade is not None:
+            cascade.record(results, stage + 1, len(cells))
+        return image_index, image_path, results
+
+    def complete_job(job, result):
+        if on_result is not None:
+            on_result(job, result)
+        collected[job.image_index][(job.model, job.prompt_type)] = result
+        remaining[job.image_index] -= 1
+        if remaining[job.image_index] > 0:
+            return
+        # Escalate to the next stage, or hand back the finished image
+        jobs = next_stage_jobs(job.image_index, job.image_path, collected[job.image_index])
+        if jobs:
+            remaining[job.image_index] = len(jobs)
+            for next_job in jobs:
+                submit(next_job)
+            return
+        del remaining[job.image_index]
+        _close_image(images_by_index.pop(job.image_index))
+        yield finish_image(job.image_index, job.image_path, collected.pop(job.image_index))
+
+    def can_pull_image():
+        if exhausted:
+            return False
+        # Images waiting only on deferred jobs don't hold up the other providers, up to a cap
+        running = len({job.image_index for jobs in (*pending.values(), *batches.values()) for job in jobs})
+        return running < max_pending_images and len(remaining) - running < max_deferred_images
+
+    try:
+        while True:
+            while can_pull_image():
+                submit_next_image()
+                while ready:
+                    yield ready.pop(0)
+            flush_batches()
+            while deferred and deferred[0][0] <= time.monotonic():
+                send(heapq.heappop(deferred)[2])
+            if not pending and not deferred:
+                break
+            timeout = max(0.0, deferred[0][0] - time.monotonic()) if deferred else None
+            if not pending:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                jobs = pending.pop(future)
+                key = tuple(jobs)
+                try:
+                    results = future.result()
+                    if len(jobs) == 1:
+                        results = [results]
+                except CircuitOpen as e:
+                    deferrals[key] = deferrals.get(key, 0) + 1
+                    if deferrals[key] <= max_deferrals:
+                        heapq.heappush(deferred, (time.monotonic() + e.retry_in, next(sequence), jobs))
+                        continue
+                    for job in jobs:
+                        logging.error(f"Job {job.model}/{job.prompt_type} failed for {job.image_path}: "
+                                      f"deferred {max_deferrals} times, {job.model} is still unavailable")
+                    results = [dict(FAILED_RESULT) for _ in jobs]
+                deferrals.pop(key, None)
+                for job, result in zip(jobs, results):
+                    yield from complete_job(job, result)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+        for image in images_by_index.values():
+            _close_image(image)
@@ -0,0 +1,26 @@
+import re
+import json
+import hashlib
+
+# The nine labels the prompts ask for, in prompt order
+FAKE_LABELS = ['سعادة', 'ثقة', 'خوف', 'مفاجأة', 'حزن', 'قرف', 'غضب', 'ترقب', 'محايد']
+
+# Numbered target images of a batched prompt ('الصورة رقم 1:', ...)
+BATCH_IMAGE_RE = re.compile(r'الصورة رقم (\d+):')
+
+def fake_label(text):
+    return FAKE_LABELS[hashlib.sha256(text.encode('utf-8')).digest()[0] % len(FAKE_LABELS)]
+
+def fake_answer(body_text):
+    """
+    Deterministic answer for a request: the label is derived from a hash of the request,
+    and chain-of-thought prompts get a reasoning line plus the 'الشعور:' suffix. Batched
+    prompts get a JSON object with a label per image number.
+    """
+    numbers = BATCH_IMAGE_RE.findall(body_text)
+    if numbers:
+        return json.dumps({number: fake_label(f"{body_text}#{number}") for number in numbers}, ensure_ascii=False)
+    label = fake_label(body_text)
+    if 'الخطوات' in body_text:
+        return f"تعابير الوجه توحي بالشعور.\nالشعور: {label}"
+    return label
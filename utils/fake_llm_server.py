@@ -0,0 +1,357 @@
+import re
+import json
+import math
+import time
+import sys
+import random
+import hashlib
+import argparse
+import threading
+import email.parser
+import email.policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utils.fake_answers import FAKE_LABELS, fake_answer
+
+def chat_completion_response(request_body):
+    """
+    Build an OpenAI chat.completion object answering a chat completions request body.
+    """
+    body_text = json.dumps(request_body.get('messages', []), ensure_ascii=False)
+    answer = fake_answer(body_text)
+    return {
+        'id': f"chatcmpl-{hashlib.sha1(body_text.encode('utf-8')).hexdigest()[:24]}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': request_body.get('model', 'gpt-4o'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': answer},
+            'finish_reason': 'stop',
+        }],
+        'usage': {'prompt_tokens': len(body_text) // 4, 'completion_tokens': len(answer) // 4,
+                  'total_tokens': (len(body_text) + len(answer)) // 4},
+    }
+
+def gemini_response(request_body):
+    """
+    Build a Gemini generateContent response answering a REST request body.
+    """
+    body_text = json.dumps(request_body.get('contents', []), ensure_ascii=False)
+    answer = fake_answer(body_text)
+    return {
+        'candidates': [{
+            'content': {'parts': [{'text': answer}], 'role': 'model'},
+            'finishReason': 'STOP',
+            'index': 0,
+        }],
+        'usageMetadata': {'promptTokenCount': len(body_text) // 4, 'candidatesTokenCount': len(answer) // 4,
+                          'totalTokenCount': (len(body_text) + len(answer)) // 4},
+    }
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+class FakeLLMState:
+    """
+    In-memory files and batches of a fake OpenAI- and Gemini-compatible server, plus the
+    simulated latency and failures applied to every model call.
+
+    Args:
+        latency_ms: Mean added latency per model call in milliseconds
+        latency_dist: 'fixed', 'uniform' (0 to twice the mean) or 'lognormal' (long tail, see latency_sigma)
+        latency_sigma: Shape of the lognormal distribution; larger means a heavier tail
+        error_rate: Fraction of model calls answered with HTTP 500
+        throttle_rate: Fraction of model calls answered with HTTP 429
+        retry_after: Retry-After seconds sent with 429 responses
+        outlier_rate: Fraction of model calls that stall for an extra outlier_ms (tail-latency spikes)
+        outlier_ms: Extra delay of a stalled call in milliseconds
+        seed: Seed for the latency and failure draws, so runs are reproducible
+    """
+
+    def __init__(self, latency_ms=0.0, latency_dist='fixed', latency_sigma=0.5, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1.0, outlier_rate=0.0, outlier_ms=0.0, seed=0):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{latency_dist}' (choose from {', '.join(LATENCY_DISTRIBUTIONS)})")
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.outlier_rate = outlier_rate
+        self.outlier_ms = outlier_ms
+        self.rng = random.Random(seed)
+        self.calls = {'ok': 0, 'throttled': 0, 'errors': 0}
+        self.lock = threading.Lock()
+        self.files = {}      # file_id -> (filename, purpose, bytes)
+        self.batches = {}    # batch_id -> batch dict
+        self.counter = 0
+        self.requests = 0
+        self.connections = set()  # client (host, port) pairs seen, to check connection reuse
+
+    def sample_latency(self):
+        """
+        Draw the delay in seconds for one model call.
+        """
+        with self.lock:
+            delay_ms = 0.0
+            if self.outlier_rate and self.rng.random() < self.outlier_rate:
+                delay_ms = self.outlier_ms
+            if self.latency_ms <= 0:
+                return delay_ms / 1000.0
+            if self.latency_dist == 'uniform':
+                delay_ms += self.rng.uniform(0, 2 * self.latency_ms)
+            elif self.latency_dist == 'lognormal':
+                # Parameterized so the mean stays latency_ms whatever the sigma
+                mu = math.log(self.latency_ms) - self.latency_sigma ** 2 / 2
+                delay_ms += self.rng.lognormvariate(mu, self.latency_sigma)
+            else:
+                delay_ms += self.latency_ms
+        return delay_ms / 1000.0
+
+    def draw_outcome(self):
+        """
+        Decide how one model call ends: 'ok', 'throttled' or 'errors'.
+        """
+        with self.lock:
+            roll = self.rng.random()
+            if roll < self.throttle_rate:
+                outcome = 'throttled'
+            elif roll < self.throttle_rate + self.error_rate:
+                outcome = 'errors'
+            else:
+                outcome = 'ok'
+            self.calls[outcome] += 1
+        return outcome
+
+    def new_id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}-{self.counter:06d}"
+
+    def add_file(self, filename, purpose, data):
+        file_id = self.new_id('file')
+        with self.lock:
+            self.files[file_id] = (filename, purpose, data)
+        return self.file_object(file_id)
+
+    def file_object(self, file_id):
+        filename, purpose, data = self.files[file_id]
+        return {'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+
+    def run_batch(self, batch_id):
+        """
+        Execute every request line of a batch input file and store the output file. Requests
+        that draw a throttled or error outcome go to the error file instead, as on the real API.
+        """
+        batch = self.batches[batch_id]
+        _, _, data = self.files[batch['input_file_id']]
+        output_lines, error_lines = [], []
+        total = 0
+        for line in data.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            total += 1
+            request = json.loads(line)
+            outcome = self.draw_outcome()
+            if outcome == 'ok':
+                response = {'status_code': 200, 'request_id': f"req_{total}",
+                            'body': chat_completion_response(request['body'])}
+            else:
+                status = 429 if outcome == 'throttled' else 500
+                response = {'status_code': status, 'request_id': f"req_{total}",
+                            'body': {'error': {'message': 'Simulated failure', 'type': 'server_error'}}}
+            (output_lines if outcome == 'ok' else error_lines).append(json.dumps({
+                'id': f"batch_req_{total}",
+                'custom_id': request['custom_id'],
+                'response': response,
+                'error': None,
+            }, ensure_ascii=False))
+        update = {
+            'status': 'completed',
+            'output_file_id': None,
+            'error_file_id': None,
+            'completed_at': int(time.time()),
+            'request_counts': {'total': total, 'completed': len(output_lines), 'failed': len(error_lines)},
+        }
+        for key, name, lines in (('output_file_id', 'batch_output.jsonl', output_lines),
+                                 ('error_file_id', 'batch_errors.jsonl', error_lines)):
+            if lines:
+                update[key] = self.add_file(name, 'batch_output', ('\n'.join(lines) + '\n').encode('utf-8'))['id']
+        with self.lock:
+            batch.update(update)
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeLLM/1.0'
+    # Keep-alive, like the real APIs; every response carries a Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _answer_model_call(self, build_response, request_body, gemini=False):
+        """
+        Answer a chat completion or generateContent call after the simulated latency,
+        or fail it with a 429 or 500 in the provider's error format.
+        """
+        time.sleep(self.state.sample_latency())
+        outcome = self.state.draw_outcome()
+        if outcome == 'throttled':
+            message = 'Rate limit exceeded (simulated)'
+            error = ({'code': 429, 'message': message, 'status': 'RESOURCE_EXHAUSTED'} if gemini
+                     else {'message': message, 'type': 'rate_limit_error', 'code': 'rate_limit_exceeded'})
+            self._send_json({'error': error}, 429, headers={'Retry-After': f"{self.state.retry_after:g}"})
+        elif outcome == 'errors':
+            message = 'Internal server error (simulated)'
+            error = ({'code': 500, 'message': message, 'status': 'INTERNAL'} if gemini
+                     else {'message': message, 'type': 'server_error'})
+            self._send_json({'error': error}, 500)
+        else:
+            self._send_json(build_response(request_body))
+
+    def _send_bytes(self, data, content_type='application/octet-stream'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _not_found(self):
+        self._send_json({'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}}, 404)
+
+    def do_POST(self):
+        body = self._read_body()
+        with self.state.lock:
+            self.state.requests += 1
+            self.state.connections.add(self.client_address)
+        path = self.path.split('?')[0]
+        if path.endswith('/chat/completions'):
+            self._answer_model_call(chat_completion_response, json.loads(body))
+        elif path.endswith(':generateContent'):
+            self._answer_model_call(gemini_response, json.loads(body), gemini=True)
+        elif path.endswith('/files'):
+            # Parse the multipart upload with the stdlib email parser
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8')
+            message = email.parser.BytesParser(policy=email.policy.default).parsebytes(header + body)
+            fields, filename, data = {}, 'upload.jsonl', b''
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if part.get_filename():
+                    filename, data = part.get_filename(), part.get_payload(decode=True)
+                else:
+                    fields[name] = part.get_content().strip()
+            self._send_json(self.state.add_file(filename, fields.get('purpose', 'batch'), data))
+        elif path.endswith('/batches'):
+            request = json.loads(body)
+            batch_id = self.state.new_id('batch')
+            batch = {
+                'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'],
+                'input_file_id': request['input_file_id'], 'completion_window': request['completion_window'],
+                'status': 'in_progress', 'created_at': int(time.time()), 'metadata': request.get('metadata'),
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            }
+            with self.state.lock:
+                self.state.batches[batch_id] = batch
+            threading.Thread(target=self.state.run_batch, args=(batch_id,), daemon=True).start()
+            self._send_json(batch)
+        else:
+            self._not_found()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        match = re.search(r'/files/([^/]+)/content$', path)
+        if match and match.group(1) in self.state.files:
+            self._send_bytes(self.state.files[match.group(1)][2])
+            return
+        match = re.search(r'/files/([^/]+)$', path)
+        if match and match.group(1) in self.state.files:
+            self._send_json(self.state.file_object(match.group(1)))
+            return
+        match = re.search(r'/batches/([^/]+)$', path)
+        if match and match.group(1) in self.state.batches:
+            with self.state.lock:
+                self._send_json(dict(self.state.batches[match.group(1)]))
+            return
+        self._not_found()
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on stalled calls (hedging, deadlines); that is not a server error
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+def start_fake_server(host='127.0.0.1', port=0, **options):
+    """
+    Start a fake LLM server on a background thread. `options` configure the simulated
+    latency and failures (see FakeLLMState).
+
+    Returns:
+        (server, base_url) where base_url is suitable for openai.OpenAI(base_url=...);
+        the Gemini endpoint is the same URL without the '/v1' suffix (GEMINI_BASE_URL).
+        Call server.shutdown() to stop it.
+    """
+    server = FakeLLMServer((host, port), FakeLLMHandler)
+    server.state = FakeLLMState(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def add_fault_arguments(parser):
+    """
+    Add the simulated latency and failure options to an argument parser.
+    """
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Mean added latency per model call (default: 0)')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='lognormal',
+                        help='Latency distribution (default: lognormal)')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Lognormal shape; larger means a heavier tail')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of model calls failed with HTTP 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of model calls throttled with HTTP 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s (default: 1)')
+    parser.add_argument('--outlier-rate', type=float, default=0.0,
+                        help='Fraction of model calls that stall for an extra --outlier-ms (default: 0)')
+    parser.add_argument('--outlier-ms', type=float, default=0.0, help='Extra delay of a stalled call (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the latency and failure draws')
+
+def fault_options(args):
+    return {'latency_ms': args.latency_ms, 'latency_dist': args.latency_dist, 'latency_sigma': args.latency_sigma,
+            'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate, 'retry_after': args.retry_after,
+            'outlier_rate': args.outlier_rate, 'outlier_ms': args.outlier_ms, 'seed': args.seed}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the OpenAI API (chat completions, files, batches) '
+                                                 'and the Gemini REST API (generateContent).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    add_fault_arguments(parser)
+    args = parser.parse_args(argv)
+    server = FakeLLMServer((args.host, args.port), FakeLLMHandler)
+    server.state = FakeLLMState(**fault_options(args))
+    print(f"Fake LLM server listening: OPENAI_BASE_URL=http://{args.host}:{args.port}/v1 "
+          f"GEMINI_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import time
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when no attempt of a call answered within its deadline.
+    """
+
+class HedgePolicy:
+    """
+    When to send a duplicate (hedged) request for a slow model call, and how many to allow.
+
+    Once `min_samples` calls have been observed, an attempt still running past the `percentile`
+    of the provider's latency gets one duplicate and the first good answer wins. Hedges are
+    capped at `budget` times the number of primary calls, so at most that fraction of extra
+    spend. `deadline` abandons a call (both attempts) after that many seconds, so the normal
+    retry path takes over instead of waiting on a stalled connection.
+
+    Args:
+        percentile: Latency quantile (0..1) after which to hedge; None disables hedging
+        budget: Maximum hedges as a fraction of primary calls
+        deadline: Seconds before a call is abandoned; None waits for the client timeout
+        min_samples: Observed calls needed before the percentile is trusted
+        min_delay: Never hedge sooner than this many seconds
+    """
+
+    def __init__(self, percentile=None, budget=0.05, deadline=None, min_samples=20, min_delay=0.05):
+        if percentile is not None and not 0.0 < percentile < 1.0:
+            raise ValueError(f"Hedge percentile must be between 0 and 1, got {percentile}")
+        self.percentile = percentile
+        self.budget = budget
+        self.deadline = deadline
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadlines = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.percentile is not None or self.deadline is not None
+
+    def hedge_delay(self, latency):
+        """
+        Seconds after which a call should be hedged, given the provider's LatencyStats,
+        or None if hedging is off or too few calls have been seen.
+        """
+        if self.percentile is None or latency.calls < self.min_samples:
+            return None
+        return max(self.min_delay, latency.percentile(self.percentile))
+
+    def try_spend(self):
+        """
+        Take one hedge from the budget. Returns False once hedges would exceed budget x primaries.
+        """
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.primaries:
+                return False
+            self.hedges += 1
+            return True
+
+    def refund(self):
+        """
+        Return a hedge taken with try_spend that was not sent after all.
+        """
+        with self._lock:
+            self.hedges -= 1
+
+    def call(self, fn, delay=None, allow_hedge=None, on_abandon=None):
+        """
+        Run fn(hedge) with hedging and the deadline: fn(False) first, then fn(True) if it is still
+        running after `delay` seconds, the budget allows it and `allow_hedge()` agrees.
+
+        The first attempt to succeed wins; the other one is left to finish in the background.
+        `on_abandon(future)` is called for every attempt still running when the call returns or
+        passes its deadline, e.g. to keep counting it against a concurrency limit until it ends.
+
+        Returns:
+            (result, hedged, hedge_won)
+
+        Raises:
+            The first attempt's exception if every attempt failed, DeadlineExceeded past the deadline
+        """
+        with self._lock:
+            self.primaries += 1
+        start = time.monotonic()
+        running = {_start_attempt(fn, False): False}
+        try:
+            return self._wait(fn, running, start, delay, allow_hedge)
+        finally:
+            if on_abandon is not None:
+                for future in running:
+                    on_abandon(future)
+
+    def _wait(self, fn, running, start, delay, allow_hedge):
+        errors = []
+        hedged = False
+        while running:
+            now = time.monotonic() - start
+            timeouts = []
+            if not hedged and delay is not None:
+                timeouts.append(delay - now)
+            if self.deadline is not None:
+                timeouts.append(self.deadline - now)
+            done, _ = wait(running, timeout=max(0.0, min(timeouts)) if timeouts else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                is_hedge = running.pop(future)
+                if future.exception() is None:
+                    if is_hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result(), hedged, is_hedge
+                errors.append(future.exception())
+            now = time.monotonic() - start
+            if self.deadline is not None and now >= self.deadline:
+                with self._lock:
+                    self.deadlines += 1
+                raise DeadlineExceeded(f"No answer within the {self.deadline:g}s deadline")
+            if running and not hedged and delay is not None and now >= delay:
+                # The budget is checked first: allow_hedge() takes rate-limit capacity
+                if self.try_spend():
+                    if allow_hedge is None or allow_hedge():
+                        hedged = True
+                        running[_start_attempt(fn, True)] = True
+                        continue
+                    self.refund()
+                # No budget or rate headroom: wait on the primary alone
+                delay = None
+        raise errors[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'primaries': self.primaries,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'deadlines': self.deadlines,
+            }
+
+def _start_attempt(fn, hedge):
+    """
+    Run fn(hedge) on a daemon thread, so an abandoned attempt never blocks shutdown.
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(fn(hedge))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name='hedged-call', daemon=True).start()
+    return future
+
+_hedge_policies = {}
+_hedge_policies_lock = threading.Lock()
+
+def get_hedge_policy(provider):
+    """
+    Return the process-wide hedge policy for a provider, creating a disabled one on first use.
+    """
+    with _hedge_policies_lock:
+        if provider not in _hedge_policies:
+            _hedge_policies[provider] = HedgePolicy()
+        return _hedge_policies[provider]
+
+def configure_hedging(provider, **kwargs):
+    """
+    Replace the process-wide hedge policy for a provider (see HedgePolicy for options).
+    """
+    policy = HedgePolicy(**kwargs)
+    with _hedge_policies_lock:
+        _hedge_policies[provider] = policy
+    return policy
@@ -0,0 +1,205 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Memoized file digests keyed on (path, mtime_ns, size) so unchanged files are hashed once
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+def file_content_hash(path):
+    """
+    Return the SHA-256 hex digest of a file's content, memoized on path, mtime and size.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _file_digests_lock:
+        digest = _file_digests.get(memo_key)
+    if digest is not None:
+        return digest
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _file_digests_lock:
+        _file_digests[memo_key] = digest
+    return digest
+
+def record_file_hash(path, digest):
+    """
+    Seed the digest memo with a hash computed elsewhere (e.g. in a preprocessing worker process).
+    """
+    stat = os.stat(path)
+    with _file_digests_lock:
+        _file_digests[(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)] = digest
+
+def image_content_hash(image):
+    """
+    Return a content hash for a PIL Image.
+
+    Images opened from disk are hashed by their file bytes; in-memory images
+    are hashed by their mode, size and pixel data.
+    """
+    filename = getattr(image, 'filename', None)
+    if filename and os.path.isfile(filename):
+        return file_content_hash(filename)
+    sha = hashlib.sha256(f"{image.mode}:{image.size}".encode('utf-8'))
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+def payload_cache_key(content_hash, max_size, format, **params):
+    """
+    Build the cache key for an encoded payload from the source content hash and encoding parameters.
+    """
+    parts = [content_hash, str(max_size), format.upper()]
+    parts.extend(f"{name}={params[name]}" for name in sorted(params))
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+class ImagePayloadCache:
+    """
+    Content-addressed cache of encoded image payloads.
+
+    Entries live in an in-memory LRU bounded by total bytes, and are optionally
+    persisted to `disk_dir` so later runs can skip the resize and encode entirely.
+    Concurrent requests for the same key wait for a single producer, so every
+    payload is built at most once per process.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.build_cpu_seconds = 0.0  # CPU time spent in get_or_create factories (resize and encode)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.bin")
+
+    def _remember(self, key, data):
+        # Caller must hold self._lock
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        if len(data) > self.max_bytes:
+            return
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        """
+        Return the cached payload for `key`, or None if it is not cached in memory or on disk.
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_disk(key)
+        if data is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        """
+        Store a payload in memory and, if configured, on disk.
+        """
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def get_or_create(self, key, factory):
+        """
+        Return the payload for `key`, calling `factory()` to build it on a miss.
+        """
+        while True:
+            data = self.get(key)
+            if data is not None:
+                return data
+            with self._lock:
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    break
+            # Another thread is producing this payload; wait and re-check
+            event.wait()
+        try:
+            with self._lock:
+                self.misses += 1
+            started = time.thread_time()
+            data = factory()
+            with self._lock:
+                self.build_cpu_seconds += time.thread_time() - started
+            self.put(key, data)
+            return data
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def clear(self):
+        """
+        Drop all in-memory entries (the on-disk store is left untouched).
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        Return hit/miss counters and current memory usage.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'build_cpu_seconds': round(self.build_cpu_seconds, 3),
+            }
+
+_payload_cache = ImagePayloadCache()
+
+def get_payload_cache():
+    return _payload_cache
+
+def set_payload_cache(cache):
+    """
+    Replace the process-wide payload cache (e.g. to enable the on-disk store).
+    """
+    global _payload_cache
+    _payload_cache = cache
@@ -2,6 +2,10 @@ import os
 from PIL import Image
 import base64
 import io
+import queue
+import threading
+from utils.image_cache import get_payload_cache, image_content_hash, payload_cache_key
+from utils.metrics import get_metrics
 
 def resize_image_preserve_aspect_ratio(image: Image.Image, max_size: int = 1024) -> Image.Image:
     """
@@ -36,19 +40,148 @@ def resize_image_preserve_aspect_ratio(image: Image.Image, max_size: int = 1024)
     resized_image = image.resize((new_width, new_height), Image.LANCZOS)
     return resized_image
 
-def load_images(directory):
-    images = []
-    for filename in os.listdir(directory):
-        if filename.lower().endswith((
-            '.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.tif', '.webp', '.ico', '.heic'  # Extend as needed
-        )):
-            path = os.path.join(directory, filename)
+SUPPORTED_EXTENSIONS = (
+    '.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.tif', '.webp', '.ico', '.heic'  # Extend as needed
+)
+
+def list_image_paths(directory, recursive=False):
+    """
+    List supported image files in a directory, sorted for a deterministic processing order.
+    
+    Args:
+        directory: Folder to scan
+        recursive: Also walk sub-folders
+        
+    Returns:
+        Sorted list of image paths
+    """
+    if recursive:
+        paths = [
+            os.path.join(root, filename)
+            for root, _, filenames in os.walk(directory)
+            for filename in filenames
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS)
+        ]
+    else:
+        paths = [
+            os.path.join(directory, filename)
+            for filename in os.listdir(directory)
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS)
+        ]
+    return sorted(paths)
+
+def open_image(path, preprocess=None):
+    """
+    Open and fully decode an image, releasing its file handle. Returns None if it cannot be read.
+    """
+    try:
+        with get_metrics().stage('load', image=path):
+            img = Image.open(path)
+            img.load()
+        if preprocess is not None:
+            img = preprocess(img)
+        return img
+    except Exception as e:
+        print(f'Error loading {path}: {e}')
+        return None
+
+def iter_images(paths, prefetch=2, preprocess=None):
+    """
+    Lazily load images one at a time, decoding up to `prefetch` images ahead on a background thread.
+    
+    Only the prefetched images and the ones the caller still holds are in memory, so peak
+    memory does not grow with the number of images. Unreadable files are reported and skipped.
+    
+    Args:
+        paths: Image paths in processing order (see list_image_paths)
+        prefetch: Number of decoded images to keep ready ahead of the consumer
+        preprocess: Optional callable(PIL.Image) -> PIL.Image run on the loader thread
+        
+    Yields:
+        (path, PIL.Image) tuples
+    """
+    ready = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
             try:
-                img = Image.open(path)
-                images.append((path, img))
-            except Exception as e:
-                print(f'Error loading {path}: {e}')
-    return images
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def load_all():
+        for path in paths:
+            img = open_image(path, preprocess)
+            if img is not None and not put((path, img)):
+                return
+        put(done)
+
+    loader = threading.Thread(target=load_all, name='image-prefetch', daemon=True)
+    loader.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        loader.join()
+
+_decode_lock = threading.Lock()
+
+def ensure_decoded(image: Image.Image) -> None:
+    """
+    Decode a lazily opened image. Decoding is serialized so threads never share the file reader.
+    """
+    with _decode_lock:
+        if getattr(image, 'fp', None) is None:
+            image.load()
+            return
+        with get_metrics().stage('load', image=getattr(image, 'filename', None)):
+            image.load()
+
+def render_payload(image: Image.Image, format: str = 'PNG', max_size: int = 1024, quality: int = None) -> bytes:
+    """
+    Resize and encode an image without consulting the payload cache.
+    `quality` only applies to lossy formats (JPEG, WEBP).
+    """
+    metrics = get_metrics()
+    with metrics.stage('resize'):
+        resized_image = resize_image_preserve_aspect_ratio(image, max_size=max_size)
+        if format.upper() in ('JPEG', 'JPG') and resized_image.mode not in ('RGB', 'L'):
+            # JPEG has no alpha channel or palette
+            resized_image = resized_image.convert('RGB')
+    with metrics.stage('encode', format=format):
+        save_params = {'quality': quality} if quality is not None else {}
+        buffered = io.BytesIO()
+        resized_image.save(buffered, format=format, **save_params)
+        return buffered.getvalue()
+
+def encode_image_to_bytes(image: Image.Image, format: str = 'PNG', max_size: int = 1024) -> bytes:
+    """
+    Resize an image to at most max_size pixels on the longer edge and encode it.
+    Payloads are cached by image content and encoding parameters, so each image
+    is resized and encoded once no matter how many prompts it appears in.
+    
+    Args:
+        image: PIL Image object
+        format: Format to encode (default: 'PNG')
+        max_size: Maximum size for the longer edge (default: 1024)
+        
+    Returns:
+        Encoded image bytes
+    """
+    def encode():
+        # Images opened lazily are decoded here, only on a cache miss
+        ensure_decoded(image)
+        return render_payload(image, format=format, max_size=max_size)
+    key = payload_cache_key(image_content_hash(image), max_size, format)
+    return get_payload_cache().get_or_create(key, encode)
 
 def encode_image_to_base64(image: Image.Image, format: str = 'PNG') -> str:
     """
@@ -62,12 +195,6 @@ def encode_image_to_base64(image: Image.Image, format: str = 'PNG') -> str:
     Returns:
         Base64-encoded string of the resized image
     """
-    # Resize image preserving aspect ratio
-    resized_image = resize_image_preserve_aspect_ratio(image, max_size=1024)
-    
-    # Encode the resized image
-    buffered = io.BytesIO()
-    resized_image.save(buffered, format=format)
-    img_bytes = buffered.getvalue()
+    img_bytes = encode_image_to_bytes(image, format=format, max_size=1024)
     img_b64 = base64.b64encode(img_bytes).decode('utf-8')
-    return img_b64 
\ No newline at end of file
+    return img_b64
@@ -0,0 +1,86 @@
+import os
+import time
+import sqlite3
+import threading
+from utils.image_cache import file_content_hash
+
+class Manifest:
+    """
+    Content hashes of the images that have been annotated, for incremental runs.
+
+    A file whose size and modification time match its entry is unchanged without reading
+    it; otherwise it is hashed, and only new content counts as a change. A touched but
+    identical file just has its entry refreshed. So a scan costs one stat per file plus
+    one hash per modified file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' name TEXT PRIMARY KEY,'
+            ' content_hash TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' annotated_at REAL NOT NULL)'
+        )
+        self._entries = {name: (content_hash, size, mtime_ns) for name, content_hash, size, mtime_ns
+                         in self._conn.execute('SELECT name, content_hash, size, mtime_ns FROM files')}
+        self._pending = {}  # name -> (content_hash, size, mtime_ns) of a change not yet annotated
+
+    def __len__(self):
+        return len(self._entries)
+
+    def changes(self, files):
+        """
+        Find the new and changed files.
+
+        Args:
+            files: Iterable of (path, image_name)
+
+        Returns:
+            List of (path, image_name) to annotate, in input order. Call mark_done(image_name)
+            once each one is written.
+        """
+        changed = []
+        refreshed = []
+        for path, name in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = self._entries.get(name)
+            if entry is not None and entry[1:] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            content_hash = file_content_hash(path)
+            if entry is not None and entry[0] == content_hash:
+                refreshed.append((stat.st_size, stat.st_mtime_ns, name))
+                self._entries[name] = (content_hash, stat.st_size, stat.st_mtime_ns)
+                continue
+            self._pending[name] = (content_hash, stat.st_size, stat.st_mtime_ns)
+            changed.append((path, name))
+        if refreshed:
+            with self._lock:
+                self._conn.executemany('UPDATE files SET size = ?, mtime_ns = ? WHERE name = ?', refreshed)
+        return changed
+
+    def mark_done(self, name):
+        """
+        Record the content found by changes() for an image whose results were written.
+        """
+        entry = self._pending.pop(name, None)
+        if entry is None:
+            return
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', (name, *entry, time.time()))
+        self._entries[name] = entry
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,248 @@
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Pipeline stages in the order they happen; anything else recorded is listed after these
+STAGES = ('load', 'resize', 'encode', 'build', 'rate_limit_wait', 'network', 'retry', 'parse', 'normalize', 'write')
+
+class LatencyStats:
+    """
+    Thread-safe record of durations: counts, totals and percentiles.
+    Keeps the most recent `max_samples` durations for percentiles.
+    """
+
+    def __init__(self, max_samples=10000):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=max_samples)
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.total_seconds += seconds
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """
+        The p-th quantile (0..1) of the recent durations, or None before the first record.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def summary(self):
+        """
+        Return call and error counts plus total, mean, p50, p95, p99 and max in seconds.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            calls, errors, total = self.calls, self.errors, self.total_seconds
+        if not samples:
+            return {'calls': calls, 'errors': errors}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+        return {
+            'calls': calls,
+            'errors': errors,
+            'total': round(total, 4),
+            'mean': round(total / calls, 4),
+            'p50': round(percentile(0.50), 4),
+            'p95': round(percentile(0.95), 4),
+            'p99': round(percentile(0.99), 4),
+            'max': round(samples[-1], 4),
+        }
+
+def request_size(request):
+    """
+    Approximate bytes sent for a built request: text as UTF-8, image data as raw bytes.
+    """
+    if isinstance(request, (bytes, bytearray)):
+        return len(request)
+    if isinstance(request, str):
+        return len(request.encode('utf-8'))
+    if isinstance(request, dict):
+        return sum(request_size(key) + request_size(value) for key, value in request.items())
+    if isinstance(request, (list, tuple)):
+        return sum(request_size(item) for item in request)
+    return len(str(request))
+
+# Per-model counters kept from the call records
+CALL_COUNTERS = ('calls', 'attempts', 'retries', 'hedges', 'failed', 'cached', 'deferred', 'bytes_sent',
+                 'prompt_tokens', 'completion_tokens')
+
+class Metrics:
+    """
+    Per-stage timings and per-call records for one run.
+
+    Stage durations are aggregated in memory and, if `trace_path` is given, every stage span
+    and call record is also appended to a JSONL trace.
+    """
+
+    def __init__(self, trace_path=None):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._calls = {}
+        self._trace = open(trace_path, 'a', encoding='utf-8', buffering=1) if trace_path else None
+        self.started = time.time()
+
+    def _emit(self, record):
+        if self._trace is None:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._trace is not None:
+                self._trace.write(line + '\n')
+
+    def record_stage(self, stage, seconds, **fields):
+        """
+        Add one duration to a stage; extra fields (model, image, ...) only go to the trace.
+        """
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = LatencyStats()
+        stats.record(seconds)
+        if self._trace is not None:
+            self._emit({'type': 'stage', 'ts': round(time.time(), 6), 'stage': stage, 'seconds': round(seconds, 6), **fields})
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        """
+        Time the body of a with block as one span of `stage`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - start, **fields)
+
+    def record_call(self, model, prompt_type, status, attempts=0, seconds=0.0, bytes_sent=0,
+                    prompt_tokens=None, completion_tokens=None, hedges=0, **fields):
+        """
+        Record the outcome of one (image, model, prompt_type) query.
+
+        Args:
+            status: 'ok', 'failed', 'cached' or 'deferred' (circuit open, to be retried later)
+            attempts: API calls made, including retries and hedges
+            seconds: Wall time of the whole query, including retries and waits
+            bytes_sent: Request bytes over all attempts
+            prompt_tokens, completion_tokens: Usage reported by the API, if any
+            hedges: Duplicate requests sent for slow attempts
+        """
+        with self._lock:
+            counters = self._calls.setdefault(model, dict.fromkeys(CALL_COUNTERS, 0))
+            counters['deferred'] += int(status == 'deferred')
+            counters['calls'] += int(status != 'deferred')
+            counters['attempts'] += attempts
+            counters['retries'] += max(0, attempts - hedges - 1)
+            counters['hedges'] += hedges
+            counters['failed'] += int(status == 'failed')
+            counters['cached'] += int(status == 'cached')
+            counters['bytes_sent'] += bytes_sent
+            counters['prompt_tokens'] += prompt_tokens or 0
+            counters['completion_tokens'] += completion_tokens or 0
+        self._emit({'type': 'call', 'ts': round(time.time(), 6), 'model': model, 'prompt_type': prompt_type,
+                    'status': status, 'attempts': attempts, 'hedges': hedges, 'seconds': round(seconds, 6),
+                    'bytes_sent': bytes_sent, 'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, **fields})
+
+    def stage_summary(self):
+        with self._lock:
+            stages = dict(self._stages)
+        ordered = [name for name in STAGES if name in stages] + sorted(set(stages) - set(STAGES))
+        return {name: stages[name].summary() for name in ordered}
+
+    def call_summary(self):
+        with self._lock:
+            return {model: dict(counters) for model, counters in self._calls.items()}
+
+    def summary_table(self):
+        """
+        Plain-text tables of the stage timings and per-model call totals.
+        """
+        lines = [f"{'stage':<16} {'count':>7} {'total s':>9} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for name, stats in self.stage_summary().items():
+            lines.append(f"{name:<16} {stats['calls']:>7} {stats['total']:>9.2f} {1000 * stats['mean']:>9.1f} "
+                         f"{1000 * stats['p95']:>9.1f} {1000 * stats['max']:>9.1f}")
+        lines.append('')
+        lines.append(f"{'model':<8} {'calls':>6} {'retries':>7} {'hedges':>6} {'failed':>6} {'cached':>6} "
+                     f"{'MB sent':>8} {'tok in':>9} {'tok out':>8}")
+        for model, counters in self.call_summary().items():
+            lines.append(f"{model:<8} {counters['calls']:>6} {counters['retries']:>7} {counters['hedges']:>6} "
+                         f"{counters['failed']:>6} {counters['cached']:>6} {counters['bytes_sent'] / 1e6:>8.2f} "
+                         f"{counters['prompt_tokens']:>9} {counters['completion_tokens']:>8}")
+        return '\n'.join(lines)
+
+    def prometheus_text(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP annotator_stage_seconds Time spent per pipeline stage.',
+            '# TYPE annotator_stage_seconds summary',
+        ]
+        for name, stats in self.stage_summary().items():
+            for quantile in ('p50', 'p95', 'p99'):
+                lines.append(f'annotator_stage_seconds{{stage="{name}",quantile="0.{quantile[1:]}"}} {stats[quantile]}')
+            lines.append(f'annotator_stage_seconds_sum{{stage="{name}"}} {stats["total"]}')
+            lines.append(f'annotator_stage_seconds_count{{stage="{name}"}} {stats["calls"]}')
+        for counter in CALL_COUNTERS:
+            metric = f'annotator_{counter}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for model, counters in self.call_summary().items():
+                lines.append(f'{metric}{{model="{model}"}} {counters[counter]}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+_metrics = Metrics()
+
+def get_metrics():
+    return _metrics
+
+def set_metrics(metrics):
+    """
+    Replace the process-wide metrics (e.g. to write a trace file).
+    """
+    global _metrics
+    _metrics = metrics
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = get_metrics().prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """
+    Serve the process-wide metrics at http://host:port/metrics on a background thread.
+
+    Returns:
+        The server; call server.shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
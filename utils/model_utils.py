@@ -1,18 +1,18 @@
-import os
 from PIL import Image
-from utils.image_utils import encode_image_to_base64, resize_image_preserve_aspect_ratio
-import openai
-import google.generativeai as genai
-from dotenv import load_dotenv
-import io
+from utils.image_cache import image_content_hash
+from utils.encoding import get_encoding_profile, profile_cache_key, openai_image_part, gemini_image_part
+from utils.clients import OPENAI_API_KEY, GOOGLE_API_KEY
 import json
 
-# Load API keys from .env
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+# Recorded with every cached response; bump when the prompt builders below change
+PROMPT_VERSION = '1'
 
-openai.api_key = OPENAI_API_KEY
+# Prompt types that can label several images in one request, and the most images per request
+BATCH_PROMPT_TYPES = ('zero_shot', 'few_shot')
+MAX_IMAGES_PER_REQUEST = 20
+# Introduces each numbered target image of a batched prompt
+BATCH_IMAGE_MARKER = 'الصورة رقم'
+_ARABIC_INDIC_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
 
 def is_refusal_message(text):
     """
@@ -35,13 +35,57 @@ def is_refusal_message(text):
     # If multiple patterns match, it's likely a refusal
     return match_count >= 2
 
+def parse_answer(answer, prompt_type, request_json_str):
+    """
+    Split a raw model answer into label and (for chain-of-thought) reasoning.
+    """
+    if prompt_type == 'chain_of_thought' and 'الشعور:' in answer:
+        reasoning, label = answer.rsplit('الشعور:', 1)
+        return {'label': label.strip(), 'reasoning': reasoning.strip(), 'request_json': request_json_str, 'raw_answer': answer}
+    return {'label': answer, 'reasoning': None, 'request_json': request_json_str, 'raw_answer': answer}
+
+def parse_batch_answer(answer, count):
+    """
+    Split a batched answer, a JSON object mapping image numbers to labels, into one label
+    per image. Code fences, surrounding text and Arabic-Indic digits in the keys are tolerated.
+
+    Returns:
+        List of `count` labels in image order, None where an image's label is missing or unreadable
+    """
+    labels = [None] * count
+    start, end = (answer.find('{'), answer.rfind('}')) if answer else (-1, -1)
+    if start == -1 or end < start:
+        return labels
+    try:
+        parsed = json.loads(answer[start:end + 1])
+    except json.JSONDecodeError:
+        return labels
+    if not isinstance(parsed, dict):
+        return labels
+    by_number = {str(key).strip().translate(_ARABIC_INDIC_DIGITS): value for key, value in parsed.items()}
+    for index in range(count):
+        value = by_number.get(str(index + 1))
+        if isinstance(value, str) and value.strip():
+            labels[index] = value.strip()
+    return labels
+
+def request_image_hashes(image, prompt_type, few_shot_examples=None):
+    """
+    Hashes of every image payload sent for a request, in prompt order. They cover the image
+    content and the active encoding profile, since the model only sees the encoded payload.
+    `image` is the target image, or the list of target images of a batched request.
+    """
+    images = [example for _, example in few_shot_examples] if prompt_type == 'few_shot' and few_shot_examples else []
+    images.extend(image if isinstance(image, list) else [image])
+    profile = get_encoding_profile()
+    return [profile_cache_key(image_content_hash(img), profile) for img in images]
+
 def build_gpt4o_zero_shot_message(image):
-    img_b64 = encode_image_to_base64(image, format='PNG')
     return [
         {"role": "system", "content": "أنت خبير في علم النفس العاطفي للأطفال."},
         {"role": "user", "content": [
             {"type": "text", "text": "انظر إلى الصورة التالية ثم أجب عن السؤال."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}},
+            openai_image_part(image),
             {"type": "text", "text": "السؤال: ما هو الشعور الأساسي الظاهر في هذا المشهد؟\nاختر كلمة واحدة فقط من القائمة التالية :\nسعادة، ثقة، خوف، مفاجأة، حزن، قرف، غضب، ترقب، محايد.\nأجب بالكلمة المختارة فقط دون أي شرح إضافي."}
         ]}
     ]
@@ -60,13 +104,13 @@ def build_gpt4o_few_shot_message(image, few_shot_examples):
     user_content = []
     # Example 1: حزن
     user_content.append({"type": "text", "text": "أمثلة توضيحية:\nمثال ١"})
-    user_content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image_to_base64(few_shot_examples[0][1], format='PNG')}"}})
+    user_content.append(openai_image_part(few_shot_examples[0][1]))
     user_content.append({"type": "text", "text": "السؤال: ما الشعور الأساسي؟\nالإجابة: حزن\nمثال ٢"})
-    user_content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image_to_base64(few_shot_examples[1][1], format='PNG')}"}})
+    user_content.append(openai_image_part(few_shot_examples[1][1]))
     user_content.append({"type": "text", "text": "السؤال: ما الشعور الأساسي؟\nالإجابة: مفاجأة\nمثال ٣"})
-    user_content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image_to_base64(few_shot_examples[2][1], format='PNG')}"}})
+    user_content.append(openai_image_part(few_shot_examples[2][1]))
     user_content.append({"type": "text", "text": "السؤال: ما الشعور الأساسي؟\nالإجابة: قرف\nالآن حلل الصورة الجديدة وأجب بالشعور الأساسي بكلمة واحدة فقط."})
-    user_content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image_to_base64(image, format='PNG')}"}})
+    user_content.append(openai_image_part(image))
     user_content.append({"type": "text", "text": "السؤال: ما الشعور الأساسي؟\nاختر من: سعادة، ثقة، خوف، مفاجأة، حزن، قرف، غضب، ترقب، محايد."})
     return [
         {"role": "system", "content": "أنت خبير في علم النفس العاطفي للأطفال."},
@@ -74,31 +118,23 @@ def build_gpt4o_few_shot_message(image, few_shot_examples):
     ]
 
 def build_gpt4o_cot_message(image):
-    img_b64 = encode_image_to_base64(image, format='PNG')
     return [
         {"role": "system", "content": "أنت خبير في علم النفس العاطفي للأطفال."},
         {"role": "user", "content": [
             {"type": "text", "text": "انظر إلى هذه الصورة ثم أجب عن المطلوب."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}},
+            openai_image_part(image),
             {"type": "text", "text": "الخطوات:\n١( فكِّر خطوة بخطوة: صف بإيجاز تعابير الوجه أو لغة الجسد والعناصر السياقية التي تدل على الشعور )سطرين على الأكثر(.\n٢( استنتج الشعور الأساسي الظاهر باستخدام كلمة واحدة فقط من القائمة:\nسعادة، ثقة، خوف، مفاجأة، حزن، قرف، غضب، ترقب، محايد.\n٣( اطبع الإجابة النهائية في سطر منفصل بصيغة:\nالشعور: >الكلمة<\nابدأ الآن."}
         ]}
     ]
 
 def build_gemini_zero_shot_content(image):
-    def image_to_binary(img):
-        # Resize image before converting to binary
-        resized_img = resize_image_preserve_aspect_ratio(img, max_size=1024)
-        img_byte_arr = io.BytesIO()
-        resized_img.save(img_byte_arr, format='PNG')
-        return img_byte_arr.getvalue()
-    img_binary = image_to_binary(image)
     system_prompt = "أنت خبير في علم النفس العاطفي للأطفال."
     user_prompt = "انظر إلى الصورة التالية ثم أجب عن السؤال.\nالسؤال: ما هو الشعور الأساسي الظاهر في هذا المشهد؟\nاختر كلمة واحدة فقط من القائمة التالية :\nسعادة، ثقة، خوف، مفاجأة، حزن، قرف، غضب، ترقب، محايد.\nأجب بالكلمة المختارة فقط دون أي شرح إضافي."
     return [
         {"role": "model", "parts": [{"text": system_prompt}]},
         {"role": "user", "parts": [
             {"text": user_prompt},
-            {"inline_data": {"mime_type": "image/png", "data": img_binary}}
+            gemini_image_part(image)
         ]}
     ]
 
@@ -113,24 +149,17 @@ def build_gemini_few_shot_content(image, few_shot_examples):
     - This approach avoids ambiguity and ensures the model always understands the task, reducing refusals.
     - Even small changes in order, grouping, or newlines can cause refusals or unreliable answers from vision models.
     """
-    def image_to_binary(img):
-        # Resize image before converting to binary
-        resized_img = resize_image_preserve_aspect_ratio(img, max_size=1024)
-        img_byte_arr = io.BytesIO()
-        resized_img.save(img_byte_arr, format='PNG')
-        return img_byte_arr.getvalue()
-    
     system_prompt = "أنت خبير في علم النفس العاطفي للأطفال."
     content_parts = []
     # Example 1: حزن
     content_parts.append({"text": "أمثلة توضيحية:\nمثال ١"})
-    content_parts.append({"inline_data": {"mime_type": "image/png", "data": image_to_binary(few_shot_examples[0][1])}})
+    content_parts.append(gemini_image_part(few_shot_examples[0][1]))
     content_parts.append({"text": "السؤال: ما الشعور الأساسي؟\nالإجابة: حزن\nمثال ٢"})
-    content_parts.append({"inline_data": {"mime_type": "image/png", "data": image_to_binary(few_shot_examples[1][1])}})
+    content_parts.append(gemini_image_part(few_shot_examples[1][1]))
     content_parts.append({"text": "السؤال: ما الشعور الأساسي؟\nالإجابة: مفاجأة\nمثال ٣"})
-    content_parts.append({"inline_data": {"mime_type": "image/png", "data": image_to_binary(few_shot_examples[2][1])}})
+    content_parts.append(gemini_image_part(few_shot_examples[2][1]))
     content_parts.append({"text": "السؤال: ما الشعور الأساسي؟\nالإجابة: قرف\nالآن حلل الصورة الجديدة وأجب بالشعور الأساسي بكلمة واحدة فقط."})
-    content_parts.append({"inline_data": {"mime_type": "image/png", "data": image_to_binary(image)}})
+    content_parts.append(gemini_image_part(image))
     content_parts.append({"text": "السؤال: ما الشعور الأساسي؟\nاختر من: سعادة، ثقة، خوف، مفاجأة، حزن، قرف، غضب، ترقب، محايد."})
     
     return [
@@ -139,128 +168,186 @@ def build_gemini_few_shot_content(image, few_shot_examples):
     ]
 
 def build_gemini_cot_content(image):
-    def image_to_binary(img):
-        # Resize image before converting to binary
-        resized_img = resize_image_preserve_aspect_ratio(img, max_size=1024)
-        img_byte_arr = io.BytesIO()
-        resized_img.save(img_byte_arr, format='PNG')
-        return img_byte_arr.getvalue()
-    img_binary = image_to_binary(image)
     system_prompt = "أنت خبير في علم النفس العاطفي للأطفال."
     user_prompt = "انظر إلى هذه الصورة ثم أجب عن المطلوب.\nالخطوات:\n١( فكِّر خطوة بخطوة: صف بإيجاز تعابير الوجه أو لغة الجسد والعناصر السياقية التي تدل على الشعور )سطرين على الأكثر(.\n٢( استنتج الشعور الأساسي الظاهر باستخدام كلمة واحدة فقط من القائمة:\nسعادة، ثقة، خوف، مفاجأة، حزن، قرف، غضب، ترقب، محايد.\n٣( اطبع الإجابة النهائية في سطر منفصل بصيغة:\nالشعور: >الكلمة<\nابدأ الآن."
     return [
         {"role": "model", "parts": [{"text": system_prompt}]},
         {"role": "user", "parts": [
             {"text": user_prompt},
-            {"inline_data": {"mime_type": "image/png", "data": img_binary}}
+            gemini_image_part(image)
         ]}
     ]
 
-def query_gpt4o(image: Image.Image, prompt, prompt_type: str, max_retries=3, temperature=0.0, few_shot_examples=None) -> dict:
-    for attempt in range(max_retries + 1):
-        try:
-            if prompt_type == 'zero_shot':
-                messages = build_gpt4o_zero_shot_message(image)
-            elif prompt_type == 'few_shot':
-                messages = build_gpt4o_few_shot_message(image, few_shot_examples)
-            elif prompt_type == 'chain_of_thought':
-                messages = build_gpt4o_cot_message(image)
-            else:
-                raise ValueError(f"Unknown prompt_type: {prompt_type}")
-                
-            # Create a simplified version of the request JSON for logging
-            # Remove base64 image data to prevent bloat
-            request_json = []
-            for msg in messages:
-                if msg['role'] == 'user' and isinstance(msg['content'], list):
-                    # For messages with image content, replace base64 with placeholder
-                    simplified_content = []
-                    for item in msg['content']:
-                        if item['type'] == 'image_url':
-                            simplified_content.append({'type': 'image_url', 'image_url': {'url': '[BASE64_IMAGE_DATA]'}})
-                        else:
-                            simplified_content.append(item)
-                    simplified_msg = {'role': msg['role'], 'content': simplified_content}
-                    request_json.append(simplified_msg)
-                else:
-                    request_json.append(msg)
-            
-            # Convert to JSON string for storage
-            request_json_str = json.dumps(request_json, ensure_ascii=False, indent=2)
-            
-            response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=256,
-                temperature=temperature + (attempt * 0.1)
-            )
-            answer = response.choices[0].message.content.strip()
-            if is_refusal_message(answer) and attempt < max_retries:
-                print(f"Refusal detected: '{answer}'. Retrying with same prompt (attempt {attempt+1}/{max_retries})...")
-                continue
-            if prompt_type == 'chain_of_thought':
-                if 'الشعور:' in answer:
-                    reasoning, label = answer.rsplit('الشعور:', 1)
-                    return {'label': label.strip(), 'reasoning': reasoning.strip(), 'request_json': request_json_str}
+def build_gpt4o_request(image, prompt_type, few_shot_examples=None):
+    """
+    Build the GPT-4o messages for a prompt type.
+    
+    Returns:
+        (messages, request_json_str) where request_json_str is the request with image data stripped
+    """
+    if prompt_type == 'zero_shot':
+        messages = build_gpt4o_zero_shot_message(image)
+    elif prompt_type == 'few_shot':
+        messages = build_gpt4o_few_shot_message(image, few_shot_examples)
+    elif prompt_type == 'chain_of_thought':
+        messages = build_gpt4o_cot_message(image)
+    else:
+        raise ValueError(f"Unknown prompt_type: {prompt_type}")
+        
+    return messages, gpt4o_request_json(messages)
+
+def gpt4o_request_json(messages):
+    """
+    The GPT-4o messages as a JSON string with base64 image data replaced by a placeholder.
+    """
+    # Create a simplified version of the request JSON for logging
+    # Remove base64 image data to prevent bloat
+    request_json = []
+    for msg in messages:
+        if msg['role'] == 'user' and isinstance(msg['content'], list):
+            # For messages with image content, replace base64 with placeholder
+            simplified_content = []
+            for item in msg['content']:
+                if item['type'] == 'image_url':
+                    simplified_item = {'type': 'image_url', 'image_url': {'url': '[BASE64_IMAGE_DATA]'}}
+                    if 'detail' in item['image_url']:
+                        simplified_item['image_url']['detail'] = item['image_url']['detail']
+                    simplified_content.append(simplified_item)
                 else:
-                    return {'label': answer, 'reasoning': None, 'request_json': request_json_str}
-            else:
-                return {'label': answer, 'reasoning': None, 'request_json': request_json_str}
-        except Exception as e:
-            print(f"[ERROR] GPT-4o API call failed: {e}")
-            if attempt < max_retries:
-                print(f"Retrying due to error (attempt {attempt+1}/{max_retries})...")
-                continue
-            return {'label': None, 'reasoning': None, 'request_json': None}
-    return {'label': "لم يتمكن النموذج من تحليل الصورة", 'reasoning': None, 'request_json': None}
+                    simplified_content.append(item)
+            simplified_msg = {'role': msg['role'], 'content': simplified_content}
+            request_json.append(simplified_msg)
+        else:
+            request_json.append(msg)
+    
+    # Convert to JSON string for storage
+    return json.dumps(request_json, ensure_ascii=False, indent=2)
+
+def build_gemini_request(image, prompt_type, few_shot_examples=None):
+    """
+    Build the Gemini contents for a prompt type.
+    
+    Returns:
+        (contents, request_json_str) where request_json_str is the request with image data stripped
+    """
+    if prompt_type == 'zero_shot':
+        contents = build_gemini_zero_shot_content(image)
+    elif prompt_type == 'few_shot':
+        contents = build_gemini_few_shot_content(image, few_shot_examples)
+    elif prompt_type == 'chain_of_thought':
+        contents = build_gemini_cot_content(image)
+    else:
+        raise ValueError(f"Unknown prompt_type: {prompt_type}")
+        
+    return contents, gemini_request_json(contents)
 
-def query_gemini(image: Image.Image, prompt, prompt_type: str, max_retries=3, temperature=0.0, few_shot_examples=None) -> dict:
-    for attempt in range(max_retries + 1):
-        try:
-            genai.configure(api_key=GOOGLE_API_KEY)
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            if prompt_type == 'zero_shot':
-                contents = build_gemini_zero_shot_content(image)
-            elif prompt_type == 'few_shot':
-                contents = build_gemini_few_shot_content(image, few_shot_examples)
-            elif prompt_type == 'chain_of_thought':
-                contents = build_gemini_cot_content(image)
-            else:
-                raise ValueError(f"Unknown prompt_type: {prompt_type}")
-                
-            # Create a simplified version of the request JSON for logging
-            # Remove binary image data to prevent bloat
-            request_json = []
-            for msg in contents:
-                if 'parts' in msg:
-                    simplified_parts = []
-                    for part in msg['parts']:
-                        if 'inline_data' in part:
-                            simplified_parts.append({'inline_data': {'mime_type': 'image/png', 'data': '[BINARY_IMAGE_DATA]'}})
-                        else:
-                            simplified_parts.append(part)
-                    simplified_msg = {'role': msg['role'], 'parts': simplified_parts}
-                    request_json.append(simplified_msg)
+def gemini_request_json(contents):
+    """
+    The Gemini contents as a JSON string with binary image data replaced by a placeholder.
+    """
+    # Create a simplified version of the request JSON for logging
+    # Remove binary image data to prevent bloat
+    request_json = []
+    for msg in contents:
+        if 'parts' in msg:
+            simplified_parts = []
+            for part in msg['parts']:
+                if 'inline_data' in part:
+                    simplified_parts.append({'inline_data': {'mime_type': part['inline_data']['mime_type'], 'data': '[BINARY_IMAGE_DATA]'}})
                 else:
-                    request_json.append(msg)
-                    
-            # Convert to JSON string for storage
-            request_json_str = json.dumps(request_json, ensure_ascii=False, indent=2)
+                    simplified_parts.append(part)
+            simplified_msg = {'role': msg['role'], 'parts': simplified_parts}
+            request_json.append(simplified_msg)
+        else:
+            request_json.append(msg)
             
-            response = model.generate_content(contents, generation_config={"temperature": temperature})
-            answer = response.text.strip()
-            if prompt_type == 'chain_of_thought':
-                if 'الشعور:' in answer:
-                    reasoning, label = answer.rsplit('الشعور:', 1)
-                    return {'label': label.strip(), 'reasoning': reasoning.strip(), 'request_json': request_json_str}
-                else:
-                    return {'label': answer, 'reasoning': None, 'request_json': request_json_str}
-            else:
-                return {'label': answer, 'reasoning': None, 'request_json': request_json_str}
-        except Exception as e:
-            print(f"[ERROR] Gemini API call failed: {e}")
-            if attempt < max_retries:
-                print(f"Retrying due to network error (attempt {attempt+1}/{max_retries})...")
-                continue
-            return {'label': None, 'reasoning': None, 'request_json': None}
-    return {'label': "لم يتمكن النموذج من تحليل الصورة", 'reasoning': None, 'request_json': None} 
\ No newline at end of file
+    # Convert to JSON string for storage
+    return json.dumps(request_json, ensure_ascii=False, indent=2)
+
+def build_batch_parts(images, prompt_type, few_shot_examples, text_part, image_part):
+    """
+    The user parts of a batched prompt: the instructions (and few-shot examples) once, then
+    every target image after its number, then the question asking for a JSON object that maps
+    each number to its label. Provider-neutral: `text_part(text)` and `image_part(image)` build
+    the provider's parts. Only zero-shot and few-shot prompts can be batched.
+    """
+    count = len(images)
+    if prompt_type == 'few_shot':
+        parts = [
+            text_part("أمثلة توضيحية:\nمثال ١"),
+            image_part(few_shot_examples[0][1]),
+            text_part("السؤال: ما الشعور الأساسي؟\nالإجابة: حزن\nمثال ٢"),
+            image_part(few_shot_examples[1][1]),
+            text_part("السؤال: ما الشعور الأساسي؟\nالإجابة: مفاجأة\nمثال ٣"),
+            image_part(few_shot_examples[2][1]),
+            text_part(f"السؤال: ما الشعور الأساسي؟\nالإجابة: قرف\nالآن حلل الصور الجديدة ({count}) وأجب عن كل صورة بالشعور الأساسي بكلمة واحدة فقط."),
+        ]
+    elif prompt_type == 'zero_shot':
+        parts = [text_part(f"انظر إلى الصور التالية ({count}) ثم أجب عن السؤال لكل صورة على حدة.")]
+    else:
+        raise ValueError(f"Prompt type {prompt_type} cannot be batched")
+    for index, image in enumerate(images, 1):
+        parts.append(text_part(f"{BATCH_IMAGE_MARKER} {index}:"))
+        parts.append(image_part(image))
+    parts.append(text_part("السؤال: ما هو الشعور الأساسي الظاهر في كل صورة؟\nاختر لكل صورة كلمة واحدة فقط من القائمة التالية :\nسعادة، ثقة، خوف، مفاجأة، حزن، قرف، غضب، ترقب، محايد.\nأجب بكائن JSON فقط دون أي شرح إضافي، مفاتيحه أرقام الصور وقيمه الكلمات المختارة، مثل: {\"1\": \"حزن\", \"2\": \"محايد\"}"))
+    return parts
+
+def build_gpt4o_batch_request(images, prompt_type, few_shot_examples=None):
+    """
+    Build one GPT-4o request labelling several images (see build_batch_parts).
+
+    Returns:
+        (messages, request_json_str) where request_json_str is the request with image data stripped
+    """
+    messages = [
+        {"role": "system", "content": "أنت خبير في علم النفس العاطفي للأطفال."},
+        {"role": "user", "content": build_batch_parts(images, prompt_type, few_shot_examples,
+                                                      lambda text: {"type": "text", "text": text}, openai_image_part)}
+    ]
+    return messages, gpt4o_request_json(messages)
+
+def build_gemini_batch_request(images, prompt_type, few_shot_examples=None):
+    """
+    Build one Gemini request labelling several images (see build_batch_parts).
+
+    Returns:
+        (contents, request_json_str) where request_json_str is the request with image data stripped
+    """
+    contents = [
+        {"role": "model", "parts": [{"text": "أنت خبير في علم النفس العاطفي للأطفال."}]},
+        {"role": "user", "parts": build_batch_parts(images, prompt_type, few_shot_examples,
+                                                    lambda text: {"text": text}, gemini_image_part)}
+    ]
+    return contents, gemini_request_json(contents)
+
+REQUEST_BUILDERS = {
+    'gpt-4o': build_gpt4o_request,
+    'gemini-1.5-pro': build_gemini_request,
+}
+
+_prompt_texts = {}
+
+def prompt_text(model_name, prompt_type, builder=None):
+    """
+    The image-independent request text for a model, prompt type and encoding profile (request_json with image data stripped).
+    Built once from placeholder images so cache lookups never have to encode the real images.
+    `builder` defaults to the REQUEST_BUILDERS entry for model_name.
+    """
+    key = (model_name, prompt_type, get_encoding_profile())
+    if key not in _prompt_texts:
+        placeholder = Image.new('RGB', (1, 1))
+        examples = [(None, placeholder)] * 3
+        _, request_json_str = (builder or REQUEST_BUILDERS[model_name])(placeholder, prompt_type, examples)
+        _prompt_texts[key] = request_json_str
+    return _prompt_texts[key]
+
+def batch_prompt_text(model_name, prompt_type, count, builder):
+    """
+    The image-independent text of a batched request for `count` images, like prompt_text.
+    """
+    key = (model_name, prompt_type, count, get_encoding_profile())
+    if key not in _prompt_texts:
+        placeholder = Image.new('RGB', (1, 1))
+        _, request_json_str = builder([placeholder] * count, prompt_type, [(None, placeholder)] * 3)
+        _prompt_texts[key] = request_json_str
+    return _prompt_texts[key]
@@ -0,0 +1,76 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from utils.image_cache import file_content_hash, record_file_hash, get_payload_cache
+from utils.encoding import get_encoding_profile, profile_cache_key, render_for_profile
+from utils.metrics import Metrics, get_metrics, set_metrics
+
+def prepare_payload(path, profile):
+    """
+    Hash, decode, resize and encode one image file with an encoding profile. Runs in a worker process.
+
+    Returns:
+        (path, content_hash, payload_bytes, {stage: seconds})
+    """
+    # Fresh metrics per image: a forked worker must not write to the parent's trace
+    metrics = Metrics()
+    set_metrics(metrics)
+    digest = file_content_hash(path)
+    with Image.open(path) as img:
+        with metrics.stage('load'):
+            img.load()
+        payload = render_for_profile(img, profile)
+    timings = {stage: stats['total'] for stage, stats in metrics.stage_summary().items()}
+    return path, digest, payload, timings
+
+def iter_prepared_images(paths, workers=None, profile=None, queue_size=None):
+    """
+    Resize and encode images in a process pool, ahead of the request stage.
+
+    The CPU-bound LANCZOS resize and encode run on all cores outside the GIL. At most
+    `queue_size` images are in the pool or waiting to be consumed, so the stage never
+    runs far ahead of the network. Finished payloads are stored in the payload cache,
+    where the request builders pick them up.
+
+    Args:
+        paths: Image paths in processing order
+        workers: Number of worker processes (default: CPU count)
+        profile: EncodingProfile for the payloads (default: the active profile)
+        queue_size: Maximum number of images in flight (default: 2 x workers)
+
+    Yields:
+        (path, PIL.Image) tuples in input order. The images are opened lazily and only
+        decoded again if their payload is evicted from the cache; each holds its file open
+        until the consumer closes it (run_annotation_jobs does once the image's jobs are done).
+    """
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or 2 * workers
+    profile = profile or get_encoding_profile()
+    cache = get_payload_cache()
+    metrics = get_metrics()
+
+    def finish(path, future):
+        try:
+            _, digest, payload, timings = future.result()
+        except Exception as e:
+            print(f'Error preprocessing {path}: {e}')
+            return None
+        for stage, seconds in timings.items():
+            metrics.record_stage(stage, seconds, image=path, worker=True)
+        record_file_hash(path, digest)
+        cache.put(profile_cache_key(digest, profile), payload)
+        return path, Image.open(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        for path in paths:
+            window.append((path, pool.submit(prepare_payload, path, profile)))
+            if len(window) >= queue_size:
+                item = finish(*window.popleft())
+                if item is not None:
+                    yield item
+        while window:
+            item = finish(*window.popleft())
+            if item is not None:
+                yield item
@@ -14,6 +14,67 @@ EMOTION_LABELS_EN_AR = {
     'Neutral': 'محايد',
 }
 
+# Direct mapping for common variations (keys are already normalized)
+EMOTION_VARIATIONS = {
+    # Common variations of سعادة (joy)
+    'سعاده': 'سعادة',
+    'فرح': 'سعادة',
+    'فرحة': 'سعادة',
+    'سرور': 'سعادة',
+    'بهجة': 'سعادة',
+    
+    # Common variations of ثقة (trust)
+    'ثقه': 'ثقة',
+    'امان': 'ثقة',
+    'اطمئنان': 'ثقة',
+    
+    # Common variations of خوف (fear)
+    'رعب': 'خوف',
+    'فزع': 'خوف',
+    'خشية': 'خوف',
+    
+    # Common variations of مفاجأة (surprise)
+    'مفاجاة': 'مفاجأة',
+    'دهشة': 'مفاجأة',
+    'ذهول': 'مفاجأة',
+    
+    # Common variations of حزن (sadness)
+    'اسى': 'حزن',
+    'كابة': 'حزن',
+    'كآبة': 'حزن',
+    'حسرة': 'حزن',
+    
+    # Common variations of قرف (disgust)
+    'اشمئزاز': 'قرف',
+    'استياء': 'قرف',
+    
+    # Common variations of غضب (anger)
+    'سخط': 'غضب',
+    'غيظ': 'غضب',
+    
+    # Common variations of ترقب (anticipation)
+    'انتظار': 'ترقب',
+    'توقع': 'ترقب',
+    
+    # Common variations of محايد (neutral)
+    'حيادي': 'محايد',
+    'محايدة': 'محايد',
+}
+
+# Precompiled normalization tables
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+# Alef variants map to a bare alef; diacritics (tashkeel) are deleted
+_ARABIC_TABLE = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا',
+                               **{chr(c): None for c in [*range(0x064B, 0x0660), 0x0670]}})
+
+# Exact answers: the variations, then the labels themselves
+_EXACT_INDEX = {**{label: label for label in EMOTION_LABELS_EN_AR.values()}, **EMOTION_VARIATIONS}
+# Labels are matched on their first two characters; the first label in list order wins
+_PREFIX_LENGTH = 2
+_PREFIX_INDEX = {}
+for _label in EMOTION_LABELS_EN_AR.values():
+    _PREFIX_INDEX.setdefault(_label[:_PREFIX_LENGTH], _label)
+
 def normalize_emotion(text):
     """
     Normalize Arabic emotion text by removing diacritics, normalizing alefs,
@@ -29,78 +90,56 @@ def normalize_emotion(text):
         return None
         
     # Remove punctuation and extra spaces
-    text = re.sub(r'[^\w\s]', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = ' '.join(_PUNCTUATION_RE.sub('', text).split())
     
-    # Normalize alefs and other Arabic characters
-    text = text.replace('أ', 'ا').replace('إ', 'ا').replace('آ', 'ا')
+    # Normalize alefs and remove diacritics
+    text = text.translate(_ARABIC_TABLE)
     
-    # Remove diacritics (tashkeel)
-    text = re.sub(r'[\u064B-\u065F\u0670]', '', text)
-    
-    # Direct mapping for common variations
-    variations = {
-        # Common variations of سعادة (joy)
-        'سعاده': 'سعادة',
-        'فرح': 'سعادة',
-        'فرحة': 'سعادة',
-        'سرور': 'سعادة',
-        'بهجة': 'سعادة',
-        
-        # Common variations of ثقة (trust)
-        'ثقه': 'ثقة',
-        'امان': 'ثقة',
-        'اطمئنان': 'ثقة',
-        
-        # Common variations of خوف (fear)
-        'رعب': 'خوف',
-        'فزع': 'خوف',
-        'خشية': 'خوف',
-        
-        # Common variations of مفاجأة (surprise)
-        'مفاجاة': 'مفاجأة',
-        'دهشة': 'مفاجأة',
-        'ذهول': 'مفاجأة',
-        
-        # Common variations of حزن (sadness)
-        'اسى': 'حزن',
-        'كابة': 'حزن',
-        'كآبة': 'حزن',
-        'حسرة': 'حزن',
-        
-        # Common variations of قرف (disgust)
-        'اشمئزاز': 'قرف',
-        'استياء': 'قرف',
-        
-        # Common variations of غضب (anger)
-        'سخط': 'غضب',
-        'غيظ': 'غضب',
-        
-        # Common variations of ترقب (anticipation)
-        'انتظار': 'ترقب',
-        'توقع': 'ترقب',
-        
-        # Common variations of محايد (neutral)
-        'حيادي': 'محايد',
-        'محايدة': 'محايد',
-    }
-    
-    if text in variations:
-        return variations[text]
-    
-    # Check if the text is already in our predefined labels
-    all_emotions = list(EMOTION_LABELS_EN_AR.values())
-    if text in all_emotions:
-        return text
+    # Variations and the labels themselves
+    match = _EXACT_INDEX.get(text)
+    if match is not None:
+        return match
     
     # Find closest match based on starting characters
-    for emotion in all_emotions:
-        if text.startswith(emotion[:2]):  # Match first 2 characters
-            return emotion
+    if len(text) >= _PREFIX_LENGTH:
+        match = _PREFIX_INDEX.get(text[:_PREFIX_LENGTH])
+        if match is not None:
+            return match
     
     # No close match found, return as is
     return text
 
+def clean_emotion(text):
+    """
+    The label an answer names exactly (one of the labels or a known variation, ignoring
+    punctuation, diacritics and alef forms), or None if the answer would only match on a
+    prefix guess or not at all.
+    """
+    if text is None:
+        return None
+    text = ' '.join(_PUNCTUATION_RE.sub('', text).split()).translate(_ARABIC_TABLE)
+    return _EXACT_INDEX.get(text)
+
+def normalize_many(texts):
+    """
+    Normalize many answers at once, e.g. to re-normalize stored results.
+    Each distinct answer is normalized only once.
+    
+    Args:
+        texts: Iterable of answer strings (None stays None)
+        
+    Returns:
+        List of normalized labels in input order
+    """
+    memo = {}
+    normalized = []
+    for text in texts:
+        label = memo.get(text, memo)
+        if label is memo:
+            label = memo[text] = normalize_emotion(text)
+        normalized.append(label)
+    return normalized
+
 def get_zero_shot_prompt():
     return (
         "النظام: أنت خبير في علم النفس العاطفي للأطفال.\n"
@@ -0,0 +1,336 @@
+import json
+import time
+import logging
+from utils.model_utils import (build_gpt4o_request, build_gemini_request, parse_answer, is_refusal_message,
+                               request_image_hashes, prompt_text, PROMPT_VERSION, build_gpt4o_batch_request,
+                               build_gemini_batch_request, parse_batch_answer, batch_prompt_text)
+from utils.encoding import get_encoding_profile
+from utils.clients import get_openai_client, get_gemini_model, gemini_request_options
+from utils.rate_limit import get_rate_limiter, estimate_request_tokens
+from utils.hedging import get_hedge_policy
+from utils.circuit_breaker import get_circuit_breaker, CircuitOpen
+from utils.fake_answers import fake_answer
+from utils.metrics import LatencyStats, get_metrics, request_size
+from utils.prompt_utils import clean_emotion
+
+FAILED_RESULT = {'label': None, 'reasoning': None, 'request_json': None}
+
+class Provider:
+    """
+    A model that can label images. Subclasses supply request building, invocation and
+    (optionally) parsing; `query` wraps them with the response cache, rate limiting and retries.
+    """
+    name = None               # CLI, CSV column and rate-limiter key, e.g. 'gpt4o'
+    model_name = None         # API model name, also part of response-cache keys
+    title = None              # Panel title in the console output
+    default_concurrency = 4   # Worker threads unless --concurrency says otherwise
+    retry_on_refusal = False  # Retry when the answer looks like a refusal
+    supports_batch_prompts = False  # Can label several images per request (build_batch_request)
+    temperature_step = 0.0    # Added to the temperature on every retry
+
+    def __init__(self):
+        self.latency = LatencyStats()
+
+    def build_request(self, image, prompt_type, few_shot_examples=None):
+        """
+        Returns:
+            (request, request_json_str) where request_json_str is the request with image data stripped
+        """
+        raise NotImplementedError
+
+    def invoke(self, request, temperature):
+        """
+        Send a built request.
+
+        Returns:
+            (answer_text, usage) where usage is {'prompt_tokens': n, 'completion_tokens': n} or None
+        """
+        raise NotImplementedError
+
+    def parse(self, answer, prompt_type, request_json_str):
+        return parse_answer(answer, prompt_type, request_json_str)
+
+    def prompt_text(self, prompt_type):
+        return prompt_text(self.model_name, prompt_type, self.build_request)
+
+    def build_batch_request(self, images, prompt_type, few_shot_examples=None):
+        """
+        Build one request labelling several images; only for providers with supports_batch_prompts.
+
+        Returns:
+            (request, request_json_str) where request_json_str is the request with image data stripped
+        """
+        raise NotImplementedError
+
+    def query(self, image, prompt_type, max_retries=3, temperature=0.0, few_shot_examples=None, response_cache=None):
+        """
+        Label one image with one prompt type.
+
+        Returns:
+            Result dict with 'label', 'reasoning', 'request_json' and 'raw_answer'
+
+        Raises:
+            CircuitOpen if the provider's circuit breaker is open; the caller should retry later
+        """
+        return self._call(
+            [image], prompt_type, max_retries, temperature, few_shot_examples, response_cache,
+            build=lambda: self.build_request(image, prompt_type, few_shot_examples),
+            parse=lambda answer, request_json_str: self.parse(answer, prompt_type, request_json_str),
+            prompt=lambda: self.prompt_text(prompt_type),
+            cacheable=lambda result: clean_emotion(result['label']) is not None)
+
+    def query_batch(self, images, prompt_type, max_retries=3, temperature=0.0, few_shot_examples=None,
+                    response_cache=None):
+        """
+        Label several images with one zero-shot or few-shot request: the instructions and
+        few-shot examples are sent once and the model answers with a label per image number.
+        Images the answer leaves without a label (including every image of a refusal) fall
+        back to single-image queries; one that the circuit breaker refuses gets a failed result.
+        If the request itself fails, every image gets a failed result. A resumed run retries
+        images with failed results.
+
+        Returns:
+            List of result dicts, one per image in order; a batched label's raw_answer is the
+            label itself, so replays re-derive it like a single answer
+
+        Raises:
+            CircuitOpen if the provider's circuit breaker is open before the batched request;
+            the caller should retry later
+        """
+        if len(images) == 1:
+            return [self.query(images[0], prompt_type, max_retries, temperature, few_shot_examples, response_cache)]
+        batch = self._call(
+            images, prompt_type, max_retries, temperature, few_shot_examples, response_cache,
+            build=lambda: self.build_batch_request(images, prompt_type, few_shot_examples),
+            parse=lambda answer, request_json_str: {'label': None, 'reasoning': None,
+                                                    'request_json': request_json_str, 'raw_answer': answer},
+            prompt=lambda: batch_prompt_text(self.model_name, prompt_type, len(images), self.build_batch_request),
+            cacheable=lambda result: None not in parse_batch_answer(result['raw_answer'], len(images)))
+        if batch.get('raw_answer') is None:
+            # The grouped request itself failed after its retries; asking each page again would
+            # multiply the attempts during an outage
+            return [dict(FAILED_RESULT) for _ in images]
+        labels = parse_batch_answer(batch['raw_answer'], len(images))
+        missing = labels.count(None)
+        if missing:
+            logging.info(f"Batched {self.model_name} answer has no label for {missing} of {len(images)} images; "
+                         f"querying them one by one")
+        results = []
+        for image, label in zip(images, labels):
+            if label is None:
+                try:
+                    results.append(self.query(image, prompt_type, max_retries, temperature, few_shot_examples,
+                                              response_cache))
+                except CircuitOpen:
+                    # Keep the labels the batched answer already gave; a resumed run retries this image
+                    results.append(dict(FAILED_RESULT))
+            else:
+                results.append({'label': label, 'reasoning': None, 'request_json': batch['request_json'], 'raw_answer': label})
+        return results
+
+    def _call(self, images, prompt_type, max_retries, temperature, few_shot_examples, response_cache, build, parse,
+              prompt, cacheable):
+        """
+        Send one request for `images` with the response cache, circuit breaker, rate limiting,
+        hedging and retries around it. `build()` returns (request, request_json_str),
+        `parse(answer, request_json_str)` the result dict and `prompt()` the request text for
+        cache keys. Only answers given at the requested temperature that are not refusals and
+        pass `cacheable(result)` are cached, so a transient bad answer is asked again next run.
+        """
+        metrics = get_metrics()
+        names = [getattr(image, 'filename', None) or '' for image in images]
+        fields = {'model': self.name, 'prompt_type': prompt_type, 'image': ','.join(names) or None}
+        call = {'attempts': 0, 'hedges': 0, 'bytes_sent': 0, 'prompt_tokens': None, 'completion_tokens': None}
+        started = time.perf_counter()
+
+        def finish(status, result):
+            metrics.record_call(self.name, prompt_type, status, seconds=time.perf_counter() - started,
+                                image=fields['image'], **call)
+            return result
+
+        cache_key = None
+        limiter = get_rate_limiter(self.name)
+        hedging = get_hedge_policy(self.name)
+        breaker = get_circuit_breaker(self.name)
+        tokens = estimate_request_tokens(len(images) + (3 if prompt_type == 'few_shot' else 0),
+                                         detail=get_encoding_profile().detail)
+        network_error = False
+        for attempt in range(max_retries + 1):
+            try:
+                if attempt == 0 and response_cache is not None and response_cache.usable(temperature):
+                    target = images if len(images) > 1 else images[0]
+                    cache_key = response_cache.make_key(request_image_hashes(target, prompt_type, few_shot_examples),
+                                                        self.model_name, prompt_type, prompt(), temperature)
+                    cached = response_cache.get(cache_key)
+                    if cached is not None:
+                        return finish('cached', cached)
+                if not breaker.allow():
+                    finish('deferred', None)
+                    raise CircuitOpen(self.name, breaker.retry_in())
+                network_error = False
+                try:
+                    with metrics.stage('build', **fields):
+                        request, request_json_str = build()
+
+                    size = request_size(request)
+                    attempt_temperature = temperature + attempt * self.temperature_step
+
+                    def send(hedge=False):
+                        call['attempts'] += 1
+                        call['hedges'] += int(hedge)
+                        call['bytes_sent'] += size
+                        return self.invoke(request, attempt_temperature)
+
+                    wait_started = time.perf_counter()
+                    with limiter.request(tokens):
+                        start = time.perf_counter()
+                        metrics.record_stage('rate_limit_wait', start - wait_started, **fields)
+                        try:
+                            if hedging.enabled:
+                                # A slow attempt gets one duplicate past the latency percentile; first answer wins
+                                # Attempts left running still count against the concurrency limit until they end
+                                (answer, usage), _, _ = hedging.call(send, delay=hedging.hedge_delay(self.latency),
+                                                                     allow_hedge=lambda: limiter.try_extra_request(tokens),
+                                                                     on_abandon=limiter.hold_until_done)
+                            else:
+                                answer, usage = send()
+                        except Exception:
+                            network_error = True
+                            self.latency.record(time.perf_counter() - start, error=True)
+                            metrics.record_stage('network', time.perf_counter() - start, attempt=attempt, error=True, **fields)
+                            raise
+                        elapsed = time.perf_counter() - start
+                        self.latency.record(elapsed)
+                        metrics.record_stage('network', elapsed, attempt=attempt, **fields)
+                except BaseException:
+                    if network_error:
+                        # A failed half-open probe reopens the circuit rather than probing again on retry
+                        breaker.on_attempt_failure()
+                    else:
+                        # Never sent: give back a half-open probe so a retry or another job can take it
+                        breaker.release()
+                    raise
+                limiter.on_success()
+                breaker.on_success()
+                for name, value in (usage or {}).items():
+                    if value is not None:
+                        call[name] = (call[name] or 0) + value
+                if self.retry_on_refusal and is_refusal_message(answer) and attempt < max_retries:
+                    print(f"Refusal detected: '{answer}'. Retrying with same prompt (attempt {attempt+1}/{max_retries})...")
+                    continue
+                with metrics.stage('parse', **fields):
+                    result = parse(answer, request_json_str)
+                if (cache_key is not None and attempt_temperature == temperature
+                        and not is_refusal_message(answer) and cacheable(result)):
+                    response_cache.put(cache_key, self.model_name, prompt_type, PROMPT_VERSION, temperature, result)
+                return finish('ok', result)
+            except CircuitOpen:
+                raise
+            except Exception as e:
+                print(f"[ERROR] {self.model_name} API call failed: {e}")
+                if attempt < max_retries:
+                    print(f"Retrying due to error (attempt {attempt+1}/{max_retries})...")
+                    with metrics.stage('retry', attempt=attempt, **fields):
+                        limiter.on_error(e, attempt)
+                    continue
+                if network_error:
+                    # One failure per exhausted call, so a single job's retries cannot open the circuit
+                    breaker.on_failure()
+                return finish('failed', dict(FAILED_RESULT))
+        return finish('failed', {'label': "لم يتمكن النموذج من تحليل الصورة", 'reasoning': None, 'request_json': None})
+
+class GPT4oProvider(Provider):
+    name = 'gpt4o'
+    model_name = 'gpt-4o'
+    title = ':robot: GPT-4o'
+    retry_on_refusal = True
+    temperature_step = 0.1
+    supports_batch_prompts = True
+
+    def build_request(self, image, prompt_type, few_shot_examples=None):
+        return build_gpt4o_request(image, prompt_type, few_shot_examples)
+
+    def build_batch_request(self, images, prompt_type, few_shot_examples=None):
+        return build_gpt4o_batch_request(images, prompt_type, few_shot_examples)
+
+    def invoke(self, request, temperature):
+        response = get_openai_client().chat.completions.create(
+            model=self.model_name,
+            messages=request,
+            max_tokens=256,
+            temperature=temperature
+        )
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            usage = {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+        return response.choices[0].message.content.strip(), usage
+
+class GeminiProvider(Provider):
+    name = 'gemini'
+    model_name = 'gemini-1.5-pro'
+    title = ':crystal_ball: Gemini'
+    supports_batch_prompts = True
+
+    def build_request(self, image, prompt_type, few_shot_examples=None):
+        return build_gemini_request(image, prompt_type, few_shot_examples)
+
+    def build_batch_request(self, images, prompt_type, few_shot_examples=None):
+        return build_gemini_batch_request(images, prompt_type, few_shot_examples)
+
+    def invoke(self, request, temperature):
+        response = get_gemini_model().generate_content(request, generation_config={"temperature": temperature},
+                                                       request_options=gemini_request_options())
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            usage = {'prompt_tokens': usage.prompt_token_count, 'completion_tokens': usage.candidates_token_count}
+        return response.text.strip(), usage
+
+class StubProvider(Provider):
+    """
+    Offline stand-in: builds the real GPT-4o request (so image encoding is exercised) and
+    answers it locally with the fake server's deterministic labels after `latency` seconds.
+    """
+    name = 'stub'
+    model_name = 'stub'
+    title = ':test_tube: Stub'
+    default_concurrency = 8
+    supports_batch_prompts = True
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.delay = latency
+
+    def build_request(self, image, prompt_type, few_shot_examples=None):
+        return build_gpt4o_request(image, prompt_type, few_shot_examples)
+
+    def build_batch_request(self, images, prompt_type, few_shot_examples=None):
+        return build_gpt4o_batch_request(images, prompt_type, few_shot_examples)
+
+    def invoke(self, request, temperature):
+        if self.delay:
+            time.sleep(self.delay)
+        return fake_answer(json.dumps(request, ensure_ascii=False)), None
+
+# Registered providers by name, in CSV column order
+PROVIDERS = {}
+DEFAULT_MODELS = ('gpt4o', 'gemini')
+
+def register_provider(provider):
+    """
+    Add (or replace) a provider in the registry, making it available to --models.
+    """
+    PROVIDERS[provider.name] = provider
+    return provider
+
+def get_provider(name):
+    return PROVIDERS[name]
+
+register_provider(GPT4oProvider())
+register_provider(GeminiProvider())
+register_provider(StubProvider())
+
+def query_gpt4o(image, prompt, prompt_type: str, max_retries=3, temperature=0.0, few_shot_examples=None, response_cache=None) -> dict:
+    return PROVIDERS['gpt4o'].query(image, prompt_type, max_retries, temperature, few_shot_examples, response_cache)
+
+def query_gemini(image, prompt, prompt_type: str, max_retries=3, temperature=0.0, few_shot_examples=None, response_cache=None) -> dict:
+    return PROVIDERS['gemini'].query(image, prompt_type, max_retries, temperature, few_shot_examples, response_cache)
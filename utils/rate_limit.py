@@ -0,0 +1,279 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`.
+
+    `clock` and `sleep` are injectable so the bucket can be driven by a simulated clock in tests.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount=1):
+        """
+        Take `amount` tokens if available. Returns 0 on success, otherwise the seconds to wait.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def refund(self, amount=1):
+        """
+        Give back tokens taken for a call that was not made.
+        """
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+    def acquire(self, amount=1):
+        """
+        Block until `amount` tokens are available and take them.
+
+        Returns:
+            Total seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return waited
+            self.sleep(wait)
+            waited += wait
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted with AIMD: +`increase` after every `window` successes,
+    multiplied by `decrease_factor` on throttling, bounded by [minimum, maximum].
+    """
+
+    def __init__(self, initial, minimum=1, maximum=None, increase=1, decrease_factor=0.5, window=None):
+        self.maximum = maximum if maximum is not None else initial
+        self.minimum = minimum
+        self.limit = float(max(minimum, min(initial, self.maximum)))
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.window = window
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def hold(self):
+        """
+        Count a call that is already running (e.g. an abandoned attempt) without waiting for room.
+        """
+        with self._cond:
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            # Additive increase once per "round" of successful calls at the current limit
+            if self._successes >= (self.window or int(self.limit)):
+                self._successes = 0
+                self.limit = min(self.maximum, self.limit + self.increase)
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self._successes = 0
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+def backoff_delay(attempt, base=1.0, cap=60.0, retry_after=None, rng=random.random):
+    """
+    Exponential backoff with full jitter. A server-provided Retry-After is treated as a lower bound.
+
+    Args:
+        attempt: Zero-based retry attempt
+        base: Delay scale in seconds for the first retry
+        cap: Maximum delay before jitter
+        retry_after: Seconds requested by the server, if any
+        rng: Source of uniform [0, 1) numbers (injectable for tests)
+    """
+    delay = rng() * min(cap, base * (2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def is_rate_limit_error(exc):
+    """
+    Return True if an exception from the OpenAI or Gemini client signals throttling (HTTP 429).
+    """
+    for attr in ('status_code', 'code', 'http_status'):
+        value = getattr(exc, attr, None)
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                value = None
+        if value == 429 or str(value) == '429':
+            return True
+    return type(exc).__name__ in ('RateLimitError', 'ResourceExhausted', 'TooManyRequests')
+
+def retry_after_seconds(exc):
+    """
+    Extract a Retry-After delay in seconds from an API exception, or None if it carries none.
+    """
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(exc, 'headers', None)
+    if not headers:
+        return None
+    for name in ('retry-after-ms', 'Retry-After-Ms'):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value) / 1000.0
+            except ValueError:
+                pass
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def estimate_request_tokens(num_images, text_tokens=200, max_output_tokens=256, tokens_per_image=765, detail=None):
+    """
+    Rough token cost of a vision request, used to debit the tokens-per-minute bucket.
+    765 tokens is the OpenAI cost of a high-detail image with a 1024 px longer edge;
+    a low-detail image is a flat 85 tokens.
+    """
+    if detail == 'low':
+        tokens_per_image = 85
+    return num_images * tokens_per_image + text_tokens + max_output_tokens
+
+class ProviderRateLimiter:
+    """
+    Shared rate limiting for one provider: requests-per-minute and tokens-per-minute
+    buckets plus an AIMD concurrency limit that backs off when throttling is detected.
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_concurrency=4, min_concurrency=1,
+                 backoff_base=1.0, backoff_cap=60.0, clock=time.monotonic, sleep=time.sleep, rng=random.random):
+        self.requests = TokenBucket(rpm, clock=clock, sleep=sleep) if rpm else None
+        self.tokens = TokenBucket(tpm, clock=clock, sleep=sleep) if tpm else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency, minimum=min_concurrency, maximum=max_concurrency)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.sleep = sleep
+        self.rng = rng
+        self.throttled = 0
+        self.waited = 0.0
+
+    @contextmanager
+    def request(self, tokens=0):
+        """
+        Hold a concurrency slot and debit the rate buckets for the duration of one API call.
+        """
+        self.concurrency.acquire()
+        try:
+            if self.requests is not None:
+                self.waited += self.requests.acquire(1)
+            if self.tokens is not None and tokens:
+                self.waited += self.tokens.acquire(tokens)
+            yield
+        finally:
+            self.concurrency.release()
+
+    def hold_until_done(self, future):
+        """
+        Keep a concurrency slot for an attempt that its call stopped waiting for (past a deadline,
+        or a hedge that lost), until the attempt's future completes.
+        """
+        self.concurrency.hold()
+        future.add_done_callback(lambda _: self.concurrency.release())
+
+    def try_extra_request(self, tokens=0):
+        """
+        Debit the rate buckets for an extra call outside the concurrency limit (a hedged
+        request), but only if that needs no waiting. Returns True if the call may go ahead.
+        """
+        if self.requests is not None and self.requests.try_acquire(1) > 0:
+            return False
+        if self.tokens is not None and tokens and self.tokens.try_acquire(tokens) > 0:
+            # The hedge is not sent, so its request is not spent either
+            if self.requests is not None:
+                self.requests.refund(1)
+            return False
+        return True
+
+    def on_success(self):
+        self.concurrency.on_success()
+
+    def on_error(self, exc, attempt):
+        """
+        Record a failed call and sleep before the next attempt.
+
+        Throttling errors shrink the concurrency limit and honour Retry-After;
+        other errors just back off with jitter.
+
+        Returns:
+            The delay slept, in seconds
+        """
+        retry_after = None
+        if is_rate_limit_error(exc):
+            self.throttled += 1
+            self.concurrency.on_throttle()
+            retry_after = retry_after_seconds(exc)
+        delay = backoff_delay(attempt, base=self.backoff_base, cap=self.backoff_cap,
+                              retry_after=retry_after, rng=self.rng)
+        self.sleep(delay)
+        self.waited += delay
+        return delay
+
+    def stats(self):
+        return {
+            'throttled': self.throttled,
+            'concurrency_limit': int(self.concurrency.limit),
+            'waited_seconds': round(self.waited, 3),
+        }
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider):
+    """
+    Return the process-wide rate limiter for a provider, creating an unthrottled one on first use.
+    """
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = ProviderRateLimiter()
+        return _rate_limiters[provider]
+
+def configure_rate_limiter(provider, **kwargs):
+    """
+    Replace the process-wide rate limiter for a provider (see ProviderRateLimiter for options).
+    """
+    limiter = ProviderRateLimiter(**kwargs)
+    with _rate_limiters_lock:
+        _rate_limiters[provider] = limiter
+    return limiter
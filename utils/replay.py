@@ -0,0 +1,110 @@
+import os
+import csv
+import json
+from utils.model_utils import parse_answer
+from utils.prompt_utils import normalize_many
+from utils.checkpoint import answer_columns
+
+RAW_SUFFIX = '_raw'
+
+def load_raw_answers(cells_path, image_name):
+    """
+    Raw answers from a run's cell checkpoint, for results files written before the CSV had
+    raw answer columns.
+
+    Args:
+        cells_path: The run's .cells.jsonl file
+        image_name: callable(image_path) -> the image name used in the CSV
+
+    Returns:
+        Dict mapping (image_name, model, prompt_type) to the raw answer
+    """
+    raw_answers = {}
+    if not os.path.exists(cells_path):
+        return raw_answers
+    with open(cells_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            raw = record['result'].get('raw_answer')
+            if raw is not None:
+                raw_answers[(image_name(record['image_path']), record['model'], record['prompt_type'])] = raw
+    return raw_answers
+
+def replay_rows(rows, fieldnames, raw_answers=None, chunk_size=1000):
+    """
+    Re-derive the label and reasoning columns of results rows from their raw answers with
+    the current parse_answer and normalize_emotion. Nothing is sent to any model.
+
+    Cells without a raw answer (failed calls, or old files without a checkpoint) are kept as they are.
+
+    Args:
+        rows: Iterable of CSV row dicts
+        fieldnames: The CSV header
+        raw_answers: Optional fallback from load_raw_answers for rows without raw columns
+        chunk_size: Rows normalized together with normalize_many
+
+    Yields:
+        Updated row dicts, in input order
+    """
+    columns = answer_columns(fieldnames)
+    chunk = []
+
+    def flush():
+        cells = []
+        for row in chunk:
+            for column, model, prompt_type in columns:
+                raw = row.get(column + RAW_SUFFIX)
+                if not raw and raw_answers:
+                    raw = raw_answers.get((row['image_name'], model, prompt_type))
+                if not raw:
+                    continue
+                result = parse_answer(raw, prompt_type, row.get(f"{column}_request"))
+                row[column + RAW_SUFFIX] = raw
+                if prompt_type == 'chain_of_thought':
+                    row[f"{column}_reasoning"] = result['reasoning']
+                cells.append((row, column, result['label']))
+        for (row, column, _), label in zip(cells, normalize_many(label for _, _, label in cells)):
+            row[column] = label
+        yield from chunk
+        chunk.clear()
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from flush()
+    yield from flush()
+
+def replay_results(csv_path, output_path, cells_path=None, image_name=os.path.basename):
+    """
+    Stream a results CSV through the current parse and normalize code into a new CSV.
+
+    Raw answers come from the CSV's raw columns, falling back to the run's cell checkpoint
+    (`cells_path`) for files written before those columns existed.
+
+    Returns:
+        Number of rows written
+    """
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        raw_answers = load_raw_answers(cells_path, image_name) if cells_path else None
+        # Older files gain the raw columns, just before the timestamp
+        missing = [column + RAW_SUFFIX for column, _, _ in answer_columns(fieldnames)
+                   if column + RAW_SUFFIX not in fieldnames]
+        if missing and raw_answers:
+            at = fieldnames.index('timestamp') if 'timestamp' in fieldnames else len(fieldnames)
+            fieldnames[at:at] = missing
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        count = 0
+        with open(output_path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            for row in replay_rows(reader, fieldnames, raw_answers):
+                writer.writerow(row)
+                count += 1
+    return count
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+class ResponseCache:
+    """
+    Persistent SQLite store of model answers.
+
+    Entries are keyed on the hash of everything that determines a request: the
+    content hashes of the images sent, the model, the prompt type, the prompt
+    text and the temperature. By default only temperature-0 requests are served
+    from the cache, since sampling at higher temperatures is meant to vary.
+    """
+
+    def __init__(self, path, deterministic_only=True):
+        self.path = path
+        self.deterministic_only = deterministic_only
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY,'
+            ' model TEXT NOT NULL,'
+            ' prompt_type TEXT NOT NULL,'
+            ' prompt_version TEXT NOT NULL,'
+            ' temperature REAL NOT NULL,'
+            ' raw_answer TEXT,'
+            ' label TEXT,'
+            ' reasoning TEXT,'
+            ' request_json TEXT,'
+            ' created_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_model ON responses (model, prompt_version)')
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_hashes, model, prompt_type, prompt_text, temperature):
+        """
+        Build the cache key for a request.
+
+        Args:
+            image_hashes: Content hashes of every image in the request, in order
+            model: API model name (e.g. 'gpt-4o')
+            prompt_type: 'zero_shot', 'few_shot' or 'chain_of_thought'
+            prompt_text: The request with image data stripped (e.g. request_json)
+            temperature: Sampling temperature
+        """
+        payload = json.dumps([list(image_hashes), model, prompt_type, prompt_text, round(float(temperature), 6)],
+                             ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def usable(self, temperature):
+        return not self.deterministic_only or float(temperature) == 0.0
+
+    def get(self, key):
+        """
+        Return the cached result dict for `key`, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT label, reasoning, request_json, raw_answer FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        label, reasoning, request_json, raw_answer = row
+        return {'label': label, 'reasoning': reasoning, 'request_json': request_json, 'raw_answer': raw_answer}
+
+    def put(self, key, model, prompt_type, prompt_version, temperature, result):
+        """
+        Store a successful result dict (label, reasoning, request_json, raw_answer).
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, model, prompt_type, str(prompt_version), float(temperature), result.get('raw_answer'),
+                 result.get('label'), result.get('reasoning'), result.get('request_json'), time.time())
+            )
+
+    def invalidate(self, model=None, prompt_version=None):
+        """
+        Delete cached entries for a model and/or prompt version. With no arguments, delete everything.
+
+        Returns:
+            Number of deleted entries
+        """
+        clauses, params = [], []
+        if model is not None:
+            clauses.append('model = ?')
+            params.append(model)
+        if prompt_version is not None:
+            clauses.append('prompt_version = ?')
+            params.append(str(prompt_version))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._lock:
+            return self._conn.execute(f'DELETE FROM responses{where}', params).rowcount
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': self.count()}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or invalidate the persistent model response cache.')
+    parser.add_argument('path', help='Path to the response cache SQLite file')
+    parser.add_argument('--model', help="Only invalidate entries for this API model (e.g. 'gpt-4o')")
+    parser.add_argument('--prompt-version', help='Only invalidate entries recorded with this prompt version')
+    parser.add_argument('--invalidate', action='store_true', help='Delete the matching entries')
+    args = parser.parse_args(argv)
+    cache = ResponseCache(args.path)
+    if args.invalidate:
+        deleted = cache.invalidate(model=args.model, prompt_version=args.prompt_version)
+        print(f"Deleted {deleted} cached responses.")
+    print(f"{cache.count()} cached responses in {args.path}")
+    cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from utils.checkpoint import build_fieldnames, result_column, answer_columns
+
+class ResultsStore:
+    """
+    Indexed SQLite store of annotation results, one row per (run, image, model, prompt type).
+
+    Request templates (request_json) are nearly identical across images, so each distinct
+    template is stored once under its hash and cells only reference it. Cells are indexed
+    by model/prompt type and by image, so analysis queries do not scan a wide CSV.
+    The classic CSV layout can be exported at any time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            ' run TEXT PRIMARY KEY,'
+            ' models TEXT NOT NULL,'
+            ' prompt_types TEXT NOT NULL,'
+            ' created_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS requests ('
+            ' hash TEXT PRIMARY KEY,'
+            ' request_json TEXT NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS images ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' run TEXT NOT NULL,'
+            ' image_name TEXT NOT NULL,'
+            ' timestamp TEXT,'
+            ' UNIQUE (run, image_name));'
+            'CREATE TABLE IF NOT EXISTS cells ('
+            ' image_id INTEGER NOT NULL REFERENCES images (id),'
+            ' model TEXT NOT NULL,'
+            ' prompt_type TEXT NOT NULL,'
+            ' label TEXT,'
+            ' reasoning TEXT,'
+            ' raw_answer TEXT,'
+            ' request_hash TEXT REFERENCES requests (hash),'
+            ' PRIMARY KEY (image_id, model, prompt_type));'
+            'CREATE INDEX IF NOT EXISTS cells_model ON cells (model, prompt_type);'
+            'CREATE INDEX IF NOT EXISTS images_name ON images (image_name);'
+        )
+
+    @staticmethod
+    def request_hash(request_json):
+        return hashlib.sha256(request_json.encode('utf-8')).hexdigest()[:32]
+
+    def start_run(self, run, models, prompt_types):
+        """
+        Register a run and its column layout; an existing (resumed) run keeps its layout.
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?)',
+                               (run, json.dumps(list(models)), json.dumps(list(prompt_types)), time.time()))
+
+    def add_image(self, run, image_name, results, timestamp=None):
+        """
+        Store one finished image in a single transaction.
+
+        Args:
+            results: Dict mapping (model, prompt_type) to (normalized_label, result dict)
+        """
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN')
+            try:
+                conn.execute('INSERT INTO images (run, image_name, timestamp) VALUES (?, ?, ?) '
+                             'ON CONFLICT (run, image_name) DO UPDATE SET timestamp = excluded.timestamp',
+                             (run, image_name, timestamp))
+                image_id = conn.execute('SELECT id FROM images WHERE run = ? AND image_name = ?',
+                                        (run, image_name)).fetchone()[0]
+                for (model, prompt_type), (label, result) in results.items():
+                    request_json = result.get('request_json')
+                    request_hash = None
+                    if request_json is not None:
+                        request_hash = self.request_hash(request_json)
+                        conn.execute('INSERT OR IGNORE INTO requests VALUES (?, ?)', (request_hash, request_json))
+                    conn.execute('INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (image_id, model, prompt_type, label, result.get('reasoning'),
+                                  result.get('raw_answer'), request_hash))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def runs(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT run FROM runs ORDER BY created_at, run')]
+
+    def cells(self, run=None, model=None, prompt_type=None, image_name=None):
+        """
+        Query stored cells; every filter is optional.
+
+        Returns:
+            List of dicts with run, image_name, model, prompt_type, label, reasoning, raw_answer and request_json
+        """
+        clauses, params = [], []
+        for column, value in (('i.run', run), ('c.model', model), ('c.prompt_type', prompt_type),
+                              ('i.image_name', image_name)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT i.run, i.image_name, c.model, c.prompt_type, c.label, c.reasoning, c.raw_answer, r.request_json'
+                ' FROM cells c JOIN images i ON i.id = c.image_id LEFT JOIN requests r ON r.hash = c.request_hash'
+                f'{where} ORDER BY i.id', params
+            ).fetchall()
+        keys = ('run', 'image_name', 'model', 'prompt_type', 'label', 'reasoning', 'raw_answer', 'request_json')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def label_counts(self, run=None):
+        """
+        Return {(model, prompt_type, label): count}, e.g. for label distributions.
+        """
+        where, params = (' WHERE i.run = ?', [run]) if run is not None else ('', [])
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT c.model, c.prompt_type, c.label, COUNT(*) FROM cells c JOIN images i ON i.id = c.image_id'
+                f'{where} GROUP BY c.model, c.prompt_type, c.label', params
+            ).fetchall()
+        return {(model, prompt_type, label): count for model, prompt_type, label, count in rows}
+
+    def export_csv(self, run, path):
+        """
+        Write a run in the results CSV layout (see build_fieldnames).
+
+        Returns:
+            Number of rows written
+        """
+        with self._lock:
+            layout = self._conn.execute('SELECT models, prompt_types FROM runs WHERE run = ?', (run,)).fetchone()
+        if layout is None:
+            raise KeyError(f"No run '{run}' in {self.path}")
+        fieldnames = build_fieldnames(json.loads(layout[0]), json.loads(layout[1]))
+        with self._lock:
+            images = self._conn.execute('SELECT id, image_name, timestamp FROM images WHERE run = ? ORDER BY id',
+                                        (run,)).fetchall()
+        cells = {}
+        for cell in self.cells(run=run):
+            cells.setdefault(cell['image_name'], []).append(cell)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            for _, image_name, timestamp in images:
+                row = {field: None for field in fieldnames}
+                row['image_name'] = image_name
+                row['timestamp'] = timestamp
+                for cell in cells.get(image_name, []):
+                    column = result_column(cell['model'], cell['prompt_type'])
+                    row[column] = cell['label']
+                    row[f"{column}_request"] = cell['request_json']
+                    row[f"{column}_raw"] = cell['raw_answer']
+                    if cell['prompt_type'] == 'chain_of_thought':
+                        row[f"{column}_reasoning"] = cell['reasoning']
+                writer.writerow(row)
+        return len(images)
+
+    def import_csv(self, csv_path, run=None):
+        """
+        Load an existing results CSV, e.g. from before the store existed.
+
+        Returns:
+            (run, number of images)
+        """
+        run = run or os.path.splitext(os.path.basename(csv_path))[0]
+        count = 0
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            columns = answer_columns(reader.fieldnames or [])
+            models = list(dict.fromkeys(model for _, model, _ in columns))
+            prompt_types = list(dict.fromkeys(prompt_type for _, _, prompt_type in columns))
+            self.start_run(run, models, prompt_types)
+            for row in reader:
+                results = {}
+                for column, model, prompt_type in columns:
+                    result = {'reasoning': row.get(f"{column}_reasoning") or None,
+                              'request_json': row.get(f"{column}_request") or None,
+                              'raw_answer': row.get(f"{column}_raw") or None}
+                    results[(model, prompt_type)] = (row.get(column) or None, result)
+                self.add_image(run, row['image_name'], results, row.get('timestamp'))
+                count += 1
+        return run, count
+
+    def stats(self):
+        with self._lock:
+            return {table: self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in ('runs', 'images', 'cells', 'requests')}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query, import or export the SQLite results store.')
+    parser.add_argument('path', help='Path to the results SQLite file')
+    parser.add_argument('--import-csv', nargs='+', metavar='CSV', help='Load existing results CSVs into the store')
+    parser.add_argument('--run', help="Run to query or export (default: the latest run)")
+    parser.add_argument('--model', help="Only cells of this model (e.g. 'gpt4o')")
+    parser.add_argument('--prompt-type', help="Only cells of this prompt type (e.g. 'chain_of_thought')")
+    parser.add_argument('--image', help='Only cells of this image name')
+    parser.add_argument('--export-csv', metavar='CSV', help='Write the run in the results CSV layout')
+    args = parser.parse_args(argv)
+    store = ResultsStore(args.path)
+    for csv_path in args.import_csv or []:
+        run, count = store.import_csv(csv_path)
+        print(f"Imported {count} images from {csv_path} as run {run}")
+    runs = store.runs()
+    run = args.run or (runs[-1] if runs else None)
+    if (args.export_csv or args.model or args.prompt_type or args.image) and run not in runs:
+        store.close()
+        parser.error(f"No run '{args.run}' in {args.path}" if args.run else f"No runs in {args.path}")
+    if args.export_csv:
+        print(f"Exported {store.export_csv(run, args.export_csv)} images of run {run} to {args.export_csv}")
+    elif args.model or args.prompt_type or args.image:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['image_name', 'model', 'prompt_type', 'label'])
+        for cell in store.cells(run=run, model=args.model, prompt_type=args.prompt_type, image_name=args.image):
+            writer.writerow([cell['image_name'], cell['model'], cell['prompt_type'], cell['label']])
+    print(f"{args.path}: {store.stats()}")
+    store.close()
+
+if __name__ == '__main__':
+    main()
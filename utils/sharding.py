@@ -0,0 +1,235 @@
+import os
+import csv
+import time
+import socket
+import sqlite3
+import hashlib
+import argparse
+import threading
+from utils.checkpoint import build_fieldnames, answer_columns
+
+def parse_shard(value):
+    """
+    Parse a '--shard I/N' value: shard I (0-based) of N.
+
+    Returns:
+        (index, count)
+    """
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}': expected I/N, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}': need 0 <= I < N")
+    return index, count
+
+def shard_of(name, count):
+    """
+    The shard of an image name. Depends only on the name (with '/' separators), so every
+    machine assigns the same images to the same shard regardless of where the corpus is mounted.
+    """
+    digest = hashlib.sha1(name.replace('\\', '/').encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+def select_shard(items, shard, key=None):
+    """
+    Keep the items whose name (`key(item)`, or the item itself) belongs to shard (index, count),
+    in their original order.
+    """
+    index, count = shard
+    return [item for item in items if shard_of(key(item) if key else item, count) == index]
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    """
+    SQLite work queue of image names shared by several workers, e.g. on a shared filesystem.
+
+    Every worker adds the full image list (duplicates are ignored) and then claims images one
+    at a time. A claim is a lease: if its worker dies, the image goes back to the queue
+    after `lease` seconds. An image that was claimed `max_attempts` times without being
+    completed is given up so one broken file cannot loop forever.
+
+    `clock` is injectable so leases can be tested without waiting.
+    """
+
+    def __init__(self, path, lease=3600.0, max_attempts=3, clock=time.time):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.clock = clock
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Several processes write to the same file; wait for their transactions instead of failing
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            ' name TEXT PRIMARY KEY,'
+            " state TEXT NOT NULL DEFAULT 'pending',"
+            ' worker TEXT,'
+            ' claimed_at REAL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS items_state ON items (state, claimed_at)')
+
+    def add(self, names):
+        """
+        Enqueue image names; names already in the queue keep their state.
+
+        Returns:
+            Number of names that were new
+        """
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany('INSERT OR IGNORE INTO items (name) VALUES (?)', ((name,) for name in names))
+            self._conn.execute('COMMIT')
+            return self._conn.total_changes - before
+
+    def claim(self, worker):
+        """
+        Claim the next pending image (or one whose lease expired).
+
+        Returns:
+            The image name, or None when nothing is left to claim
+        """
+        with self._lock:
+            conn = self._conn
+            now = self.clock()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT name FROM items WHERE attempts < ? AND (state = 'pending' OR "
+                    "(state = 'claimed' AND claimed_at < ?)) ORDER BY name LIMIT 1",
+                    (self.max_attempts, now - self.lease)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE items SET state = 'claimed', worker = ?, claimed_at = ?, attempts = attempts + 1 "
+                                 "WHERE name = ?", (worker, now, row[0]))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return row[0] if row else None
+
+    def claims(self, worker):
+        """
+        Yield claimed image names until the queue is drained.
+        """
+        while True:
+            name = self.claim(worker)
+            if name is None:
+                return
+            yield name
+
+    def complete(self, name):
+        with self._lock:
+            self._conn.execute("UPDATE items SET state = 'done' WHERE name = ?", (name,))
+
+    def remaining(self):
+        """
+        Number of images not yet done (pending or claimed, excluding given-up ones).
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM items WHERE state != 'done' AND attempts < ?",
+                                      (self.max_attempts,)).fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT state, COUNT(*) FROM items GROUP BY state').fetchall())
+            given_up = self._conn.execute("SELECT COUNT(*) FROM items WHERE state != 'done' AND attempts >= ?",
+                                          (self.max_attempts,)).fetchone()[0]
+            workers = self._conn.execute("SELECT COUNT(DISTINCT worker) FROM items WHERE worker IS NOT NULL").fetchone()[0]
+        return {'pending': counts.get('pending', 0), 'claimed': counts.get('claimed', 0),
+                'done': counts.get('done', 0), 'given_up': given_up, 'workers': workers}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _label_count(row, columns):
+    return sum(1 for column, _, _ in columns if row.get(column))
+
+def merge_results(csv_paths, output_path, expected=None):
+    """
+    Combine per-shard (or per-worker) results CSVs into one file with one row per image.
+
+    When an image appears more than once (e.g. a lease expired while its worker was still
+    running), the row with the most labels wins, then the latest timestamp. Rows are
+    written in image name order.
+
+    Args:
+        csv_paths: Results CSVs to merge
+        output_path: Merged CSV path
+        expected: Optional image names that should all be present; the rest are reported missing
+
+    Returns:
+        Dict with the number of rows written, duplicate rows dropped, and the sorted list of missing image names
+    """
+    rows, layout, duplicates = {}, [], 0
+    for path in csv_paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            columns = answer_columns(reader.fieldnames or [])
+            for _, model, prompt_type in columns:
+                if (model, prompt_type) not in layout:
+                    layout.append((model, prompt_type))
+            for row in reader:
+                name = row.get('image_name')
+                if not name:
+                    continue
+                rank = (_label_count(row, columns), row.get('timestamp') or '')
+                if name in rows:
+                    duplicates += 1
+                    if rank <= rows[name][0]:
+                        continue
+                rows[name] = (rank, row)
+    models = list(dict.fromkeys(model for model, _ in layout))
+    prompt_types = list(dict.fromkeys(prompt_type for _, prompt_type in layout))
+    fieldnames = build_fieldnames(models, prompt_types)
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for name in sorted(rows):
+            writer.writerow(rows[name][1])
+    missing = sorted(set(expected) - set(rows)) if expected is not None else []
+    return {'rows': len(rows), 'duplicates': duplicates, 'missing': missing}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Merge sharded results or inspect a shared work queue.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    merge = commands.add_parser('merge', help='Combine per-shard results CSVs into one file')
+    merge.add_argument('output', help='Merged results CSV')
+    merge.add_argument('inputs', nargs='+', help='Per-shard results CSVs')
+    merge.add_argument('--images-dir', help='Report images of this folder that are in none of the inputs')
+    merge.add_argument('--recursive', action='store_true', help='With --images-dir: include sub-folders')
+    status = commands.add_parser('status', help='Show the progress of a work queue')
+    status.add_argument('queue', help='Work queue SQLite file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        queue = WorkQueue(args.queue)
+        print(f"{args.queue}: {queue.stats()}")
+        queue.close()
+        return
+    expected = None
+    if args.images_dir:
+        from utils.image_utils import list_image_paths
+        expected = [os.path.relpath(path, args.images_dir)
+                    for path in list_image_paths(args.images_dir, recursive=args.recursive)]
+    result = merge_results(args.inputs, args.output, expected)
+    print(f"Merged {len(args.inputs)} files into {args.output}: {result['rows']} images, "
+          f"{result['duplicates']} duplicate rows dropped")
+    if result['missing']:
+        print(f"Missing {len(result['missing'])} images: {', '.join(result['missing'][:20])}"
+              f"{' ...' if len(result['missing']) > 20 else ''}")
+
+if __name__ == '__main__':
+    main()